@@ -1,15 +1,26 @@
-from fastapi import FastAPI, HTTPException, Request
+from fastapi import FastAPI, Header, HTTPException, Query, Request
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi.responses import HTMLResponse, JSONResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel
 from typing import Optional, List
+import base64
+import hmac
 import json
 import os
 from datetime import datetime
 import logging
-from main import handle_request as handle_chatbot_request
+from main import handle_request as handle_chatbot_request, sessions as chatbot_sessions, session_locks as chatbot_session_locks, recent_responses as chatbot_recent_responses, router as chatbot_router
 import db_helper
+import async_db_helper
+import fast_json
+from webhook_models import WebhookRequest, WebhookResponse
+import reference_cache
+from catalog_cache import catalog
+from name_index import product_names
+from price_index import price_index
+from cheapest_index import cheapest_products
 
 
 try:
@@ -36,6 +47,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
 # Pydantic models for request/response
@@ -67,6 +79,74 @@ class ProductResponse(BaseModel):
     stock: int
     rating: float
 
+class FastJSONResponse(JSONResponse):
+    """JSON encoded with fast_json (orjson: native datetime, Decimal as number)"""
+
+    def render(self, content) -> bytes:
+        return fast_json.dumps(content)
+
+# API_FAST_JSON=0 goes back to FastAPI's response_model validation + stdlib encoder for /api/*
+FAST_JSON_RESPONSES = os.getenv("API_FAST_JSON", "1") != "0"
+
+# /admin/* endpoints require this value in the X-Admin-Token header; unset = /admin/* disabled
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+
+def require_admin(token: Optional[str]):
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=503, detail="Admin endpoints are disabled (ADMIN_TOKEN is not set)")
+    if not token or not hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+def rows_response(rows, response: Response, next_cursor: Optional[str] = None):
+    """
+    Rows from db_helper already have the response_model's fields and types, so
+    the fast path serializes them directly; returning a Response makes FastAPI
+    skip re-validating every row against the response_model.
+    The cursor for the next page (if any) goes in the X-Next-Cursor header.
+    """
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor else {}
+    if FAST_JSON_RESPONSES:
+        return FastJSONResponse(content=rows, headers=headers)
+    response.headers.update(headers)
+    return rows
+
+# Keyset pagination: the cursor is the sort key of the last row sent, opaque to clients
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+def encode_cursor(values: dict) -> str:
+    return base64.urlsafe_b64encode(fast_json.dumps(values)).decode("ascii").rstrip("=")
+
+def decode_cursor(cursor: str) -> dict:
+    try:
+        values = fast_json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        if not isinstance(values, dict):
+            raise ValueError("cursor must encode an object")
+        return values
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid pagination cursor")
+
+def parse_price_range(price_range: Optional[str]):
+    """'min-max' as sent by the catalog page ('0-100000', '1000000-'); either side may be empty"""
+    if not price_range:
+        return None, None
+    try:
+        low, _, high = price_range.partition("-")
+        min_price = float(low) if low.strip() else None
+        max_price = float(high) if high.strip() else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="price_range must look like 'min-max', e.g. '100000-500000'")
+    if min_price is not None and max_price is not None and min_price > max_price:
+        raise HTTPException(status_code=400, detail="price_range minimum is greater than its maximum")
+    return min_price, max_price
+
+def split_page(rows, limit, cursor_of):
+    """Queries fetch limit + 1 rows; the extra row only tells whether there is a next page"""
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(cursor_of(rows[-1]))
+
 # Create directories if they don't exist
 os.makedirs("static", exist_ok=True)
 os.makedirs("home", exist_ok=True)
@@ -117,11 +197,25 @@ async def startup_event():
 </html>
                     """)
         
+        await async_db_helper.init_pool()
+        await run_in_threadpool(reference_cache.load_all)
+        reference_cache.start_background_refresh()
+        catalog.start()
+
         logger.info("Startup completed successfully")
         
     except Exception as e:
         logger.error(f"Startup error: {e}")
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Close pooled database connections"""
+    reference_cache.stop_background_refresh()
+    catalog.stop()
+    await async_db_helper.close_pool()
+    if db_helper and db_helper.pool is not None:
+        db_helper.pool.closeall()
+
 # FIXED: Proper static files mounting
 # Mount static files BEFORE defining routes
 try:
@@ -153,28 +247,50 @@ async def chatbot_webhook(request: Request):
 
 @app.get("/api/products", response_model=List[ProductResponse])
 async def get_products(
+    response: Response,
     search: Optional[str] = None,
     category: Optional[str] = None,
-    price_range: Optional[str] = None
+    price_range: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    after: Optional[str] = None
 ):
+    min_price, max_price = parse_price_range(price_range)
+    search = search.strip() if search and db_helper.build_tsquery(search) else None
+    after_key = None
+    if after:
+        try:
+            values = decode_cursor(after)
+            after_key = (float(values["rank"]), int(values["id"])) if search else int(values["id"])
+        except (KeyError, TypeError, ValueError):
+            raise HTTPException(status_code=400, detail="Invalid pagination cursor")
     try:
-        # Gọi hàm từ db_helper để lấy sản phẩm
-        products = db_helper.search_products(category=category, brand=None)
-        
-        # Xử lý filter thêm nếu cần
-        filtered_products = []
-        for product in products:
-            filtered_products.append({
-                "id": product["id"],
-                "name": product["name"],
-                "description": product["description"],
-                "price": product["price"],
-                "category": product["category"],
-                "stock": product["stock"],
-                "rating": product["rating"]
-            })
-        
-        return filtered_products
+        # Lọc theo từ khoá, danh mục và khoảng giá đều được thực hiện trong SQL
+        if search:
+            # Full-text search: sản phẩm liên quan nhất trước, phân trang theo (rank, id)
+            products = await async_db_helper.search_products_ranked(
+                search,
+                category=category,
+                limit=limit + 1,
+                after=after_key,
+                min_price=min_price,
+                max_price=max_price
+            )
+            products, next_cursor = split_page(products, limit, lambda product: {"rank": product["rank"], "id": product["id"]})
+            for product in products:
+                del product["rank"]
+        else:
+            products = await async_db_helper.search_products(
+                category=category,
+                brand=None,
+                limit=limit + 1,
+                after=after_key,
+                min_price=min_price,
+                max_price=max_price
+            )
+            products, next_cursor = split_page(products, limit, lambda product: {"id": product["id"]})
+
+        # search_products trả về đúng các trường của ProductResponse
+        return rows_response(products, response, next_cursor)
         
     except Exception as e:
         logger.error(f"Error getting products: {e}")
@@ -312,23 +428,44 @@ async def serve_homepage():
         """, status_code=500)
 
 @app.get("/api/orders", response_model=List[OrderResponse])
-async def get_orders(customer_id: Optional[int] = None, customer_name: Optional[str] = None):
+async def get_orders(
+    response: Response,
+    customer_id: Optional[int] = None,
+    customer_name: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    after: Optional[str] = None
+):
     if not db_helper or not hasattr(db_helper, "get_customer_orders"):
         raise HTTPException(status_code=503, detail="Database service unavailable")
 
+    after_key = None
+    if after:
+        try:
+            cursor = decode_cursor(after)
+            after_key = (datetime.fromisoformat(cursor["date"]), int(cursor["id"]))
+        except (KeyError, TypeError, ValueError):
+            raise HTTPException(status_code=400, detail="Invalid pagination cursor")
+
     try:
         if not customer_id and not customer_name:
             raise HTTPException(status_code=400, detail="Either customer_id or customer_name must be provided")
 
         if customer_id:
             logger.info(f"Getting orders for customer_id: {customer_id}")
-            orders = db_helper.get_customer_orders(customer_id=customer_id)
+            orders = await async_db_helper.get_customer_orders(customer_id=customer_id, limit=limit + 1, after=after_key)
         else:
             logger.info(f"Getting orders for customer_name: {customer_name}")
-            orders = db_helper.get_customer_orders(customer_name=customer_name)
+            orders = await async_db_helper.get_customer_orders(customer_name=customer_name, limit=limit + 1, after=after_key)
 
-        if not orders:
+        if not orders and after_key is None:
             raise HTTPException(status_code=404, detail="No orders found for this customer")
+        orders, next_cursor = split_page(
+            orders, limit, lambda order: {"date": order["order_date"].isoformat(), "id": order["order_id"]}
+        )
+
+        # Rows come from a dict_row cursor with exactly the OrderResponse columns
+        if FAST_JSON_RESPONSES:
+            return rows_response(orders, response, next_cursor)
 
         # Format the orders to match OrderResponse model
         formatted_orders = []
@@ -344,7 +481,7 @@ async def get_orders(customer_id: Optional[int] = None, customer_name: Optional[
                 "order_status": order.get("order_status") or order.get("Order_Status"),
                 "order_date": order.get("order_date") or order.get("Order_Date")
             })
-        return formatted_orders
+        return rows_response(formatted_orders, response, next_cursor)
 
     except HTTPException:
         raise
@@ -360,7 +497,7 @@ async def get_customer(customer_id: int):
             raise HTTPException(status_code=503, detail="Database service unavailable")
             
         logger.info(f"Getting customer info for ID: {customer_id}")
-        customer_data = db_helper.get_customer_info(customer_id)
+        customer_data = await async_db_helper.get_customer_info(customer_id)
         
         if not customer_data:
             raise HTTPException(status_code=404, detail="Customer not found")
@@ -389,13 +526,13 @@ async def search_customer(email: Optional[str] = None, phone: Optional[str] = No
             raise HTTPException(status_code=503, detail="Database service unavailable")
         
         logger.info(f"Searching customer by email: {email}, phone: {phone}")
-        customer_result = db_helper.get_customer_by_email_or_phone(email or "", phone or "")
+        customer_result = await async_db_helper.get_customer_by_email_or_phone(email or "", phone or "")
         
         if not customer_result:
             raise HTTPException(status_code=404, detail="Customer not found")
         
         customer_id = customer_result[0]
-        customer_info = db_helper.get_customer_info(customer_id)
+        customer_info = await async_db_helper.get_customer_info(customer_id)
         
         return CustomerInfo(
             customer_id=customer_id,
@@ -415,13 +552,13 @@ async def search_customer(email: Optional[str] = None, phone: Optional[str] = No
 async def chatbot_webhook(request: Request):
     """Handle Dialogflow webhook requests"""
     try:
-        payload = await request.json()
-        logger.info(f"Received chatbot request: {payload}")
+        webhook = WebhookRequest.from_bytes(await request.body())
+        logger.info(f"Received chatbot request: {webhook.summary()}")
         
         # Extract intent and parameters
-        intent = payload.get('queryResult', {}).get('intent', {}).get('displayName', '')
-        parameters = payload.get('queryResult', {}).get('parameters', {})
-        query_text = payload.get('queryResult', {}).get('queryText', '')
+        intent = webhook.intent
+        parameters = webhook.parameters
+        query_text = webhook.query_text or ''
         
         # Simple response logic - you can expand this
         response_text = "Xin chào! Tôi là trợ lý ảo của ShopDB. Tôi có thể giúp bạn tra cứu thông tin đơn hàng."
@@ -432,10 +569,10 @@ async def chatbot_webhook(request: Request):
         elif 'khách hàng' in query_text.lower() or 'customer' in query_text.lower():
             response_text = "Tôi có thể giúp bạn tìm kiếm thông tin khách hàng theo email hoặc số điện thoại."
         
-        return JSONResponse(content={
-            "fulfillmentText": response_text,
-            "source": "shopdb-webhook"
-        })
+        return Response(
+            content=WebhookResponse(response_text, source="shopdb-webhook").encode(),
+            media_type="application/json"
+        )
         
     except Exception as e:
         logger.error(f"Error in chatbot webhook: {e}")
@@ -455,6 +592,8 @@ async def health_check():
             "status": "healthy",
             "timestamp": datetime.now(),
             "database": db_status,
+            "db_pool": db_helper.get_pool_stats() if db_helper else None,
+            "async_db_pool": async_db_helper.get_pool_stats(),
             "version": "1.0.0",
             "directories": {
                 "home": os.path.exists("home"),
@@ -471,6 +610,50 @@ async def health_check():
             "timestamp": datetime.now()
         }, status_code=500)
 
+@app.get("/metrics/db-pool")
+async def db_pool_metrics():
+    """Connection pool statistics (in use, waiting, wait time) for monitoring"""
+    if not db_helper or not hasattr(db_helper, "get_pool_stats"):
+        raise HTTPException(status_code=503, detail="Database service unavailable")
+    return {
+        "sync": db_helper.get_pool_stats(),
+        "async": async_db_helper.get_pool_stats(),
+    }
+
+@app.get("/metrics/cache")
+async def cache_metrics():
+    """Reference-data, product catalog and in-memory catalog index statistics"""
+    return {
+        "reference": reference_cache.stats(),
+        "catalog": catalog.stats(),
+        "product_names": product_names.stats(),
+        "prices": price_index.stats(),
+        "cheapest": cheapest_products.stats(),
+    }
+
+@app.get("/metrics/sessions")
+async def session_metrics():
+    """Chatbot session store size, hit rate and evictions, plus per-session lock contention"""
+    return {
+        **chatbot_sessions.stats(),
+        "locks": chatbot_session_locks.stats(),
+        "replayed_responses": chatbot_recent_responses.stats(),
+    }
+
+@app.get("/metrics/intents")
+async def intent_metrics():
+    """Per-intent timing, DB calls, errors and read-only response cache of the chatbot webhook"""
+    return chatbot_router.stats()
+
+@app.post("/admin/cache/invalidate")
+async def invalidate_cache(table: Optional[str] = None, x_admin_token: Optional[str] = Header(None)):
+    """Drop cached reference data (all tables, or just `table`) after editing it in the database"""
+    require_admin(x_admin_token)
+    if table and table not in reference_cache.TABLES:
+        raise HTTPException(status_code=404, detail=f"Unknown cache table '{table}'")
+    reference_cache.invalidate(table)
+    return {"invalidated": [table] if table else list(reference_cache.TABLES)}
+
 # ENHANCED: Debug endpoints to check static files
 @app.get("/debug/files")
 async def debug_files():
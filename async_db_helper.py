@@ -0,0 +1,141 @@
+"""
+Async counterpart of db_helper for the FastAPI routes.
+
+Only the queries APIBackend awaits live here. They keep the names and return
+shapes of their db_helper versions and take their SQL from the db_helper
+build_* functions, so the two cannot drift apart; they just run on psycopg 3
+with an AsyncConnectionPool, so awaiting a query yields the event loop instead
+of blocking it.
+"""
+from contextlib import asynccontextmanager
+
+from psycopg.conninfo import make_conninfo
+from psycopg.rows import dict_row
+from psycopg_pool import AsyncConnectionPool
+
+from db_helper import (
+    DB_CONFIG,
+    POOL_CONFIG,
+    build_customer_by_email_or_phone_query,
+    build_customer_info_query,
+    build_customer_orders_params,
+    build_customer_orders_query,
+    build_ranked_search_query,
+    build_search_products_query,
+    build_tsquery,
+    customer_orders_condition,
+    product_row_to_dict,
+    ranked_product_row_to_dict,
+)
+
+pool = None
+
+async def init_pool():
+    global pool
+    if pool is not None:
+        return pool
+    try:
+        pool = AsyncConnectionPool(
+            make_conninfo(
+                host=DB_CONFIG["host"],
+                user=DB_CONFIG["user"],
+                password=DB_CONFIG["password"],
+                dbname=DB_CONFIG["database"],
+            ),
+            min_size=POOL_CONFIG["minconn"],
+            max_size=POOL_CONFIG["maxconn"],
+            timeout=POOL_CONFIG["checkout_timeout"],
+            check=AsyncConnectionPool.check_connection,
+            open=False,
+        )
+        await pool.open()
+        print("Async database connection pool initialized successfully.")
+    except Exception as e:
+        print(f"Failed to initialize async database connection pool: {e}")
+        pool = None
+    return pool
+
+async def close_pool():
+    global pool
+    if pool is not None:
+        await pool.close()
+        pool = None
+
+@asynccontextmanager
+async def get_connection():
+    """Borrow a pooled async connection for the duration of the async with-block"""
+    if pool is None:
+        await init_pool()
+        if pool is None:
+            raise ConnectionError("Async database connection pool is not available")
+    async with pool.connection() as cnx:
+        yield cnx
+
+def get_pool_stats():
+    if pool is None:
+        return {"available": False}
+    return {"available": True, **pool.get_stats()}
+
+async def _fetchall(query, params=(), row_factory=None):
+    async with get_connection() as cnx:
+        async with cnx.cursor(row_factory=row_factory) as cursor:
+            await cursor.execute(query, params)
+            return await cursor.fetchall()
+
+async def _fetchone(query, params=()):
+    async with get_connection() as cnx:
+        async with cnx.cursor() as cursor:
+            await cursor.execute(query, params)
+            return await cursor.fetchone()
+
+async def get_customer_by_email_or_phone(email: str, phone: str):
+    try:
+        return await _fetchone(*build_customer_by_email_or_phone_query(email, phone))
+    except Exception as e:
+        print(f"[ERROR] Failed to get customer by email or phone: {e}")
+        return None
+
+async def get_customer_info(customer_id: int):
+    try:
+        return await _fetchone(*build_customer_info_query(customer_id))
+    except Exception as e:
+        print(f"[ERROR] Failed to get customer info: {e}")
+        return None
+
+async def get_customer_orders(customer_id=None, customer_name=None, limit=None, after=None):
+    customer = customer_orders_condition(customer_id, customer_name)
+    if customer is None:
+        return []
+    condition, param = customer
+
+    try:
+        return await _fetchall(
+            build_customer_orders_query(condition, after, limit),
+            build_customer_orders_params(param, after, limit),
+            row_factory=dict_row
+        )
+    except Exception as e:
+        print(f"An error occurred in get_customer_orders: {e}")
+        return []
+
+async def search_products(category=None, brand=None, limit=None, after=None, min_price=None, max_price=None):
+    try:
+        query, params = build_search_products_query(category, after, limit, min_price, max_price)
+        results = await _fetchall(query, params)
+        return [product_row_to_dict(row) for row in results]
+    except Exception as e:
+        print(f"Error searching products: {e}")
+        return []
+
+async def search_products_ranked(search, category=None, limit=None, after=None, min_price=None, max_price=None):
+    tsquery = build_tsquery(search)
+    if tsquery is None:
+        return []
+    try:
+        query, params = build_ranked_search_query(tsquery, category, after, limit, min_price, max_price)
+        results = await _fetchall(query, params)
+        return [ranked_product_row_to_dict(row) for row in results]
+    except Exception as e:
+        print(f"Error searching products: {e}")
+        return []
+
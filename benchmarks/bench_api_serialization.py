@@ -0,0 +1,92 @@
+"""
+Serialization cost of /api/products and /api/orders responses as the row
+count grows: FastAPI's default path (validate every row against the
+response_model, jsonable_encoder, stdlib json) against APIBackend's fast path
+(fast_json.dumps straight from the DB rows). Synthetic rows, no database needed.
+
+Usage: python benchmarks/bench_api_serialization.py [repeats]
+"""
+import json
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+from typing import List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.encoders import jsonable_encoder
+from pydantic import TypeAdapter
+
+import fast_json
+from APIBackend import OrderResponse, ProductResponse
+
+ROW_COUNTS = [1_000, 10_000, 100_000]
+
+
+def product_rows(count):
+    return [
+        {
+            "id": i,
+            "name": f"Product {i}",
+            "description": f"Description of product {i} with a few more words in it",
+            "price": Decimal("199.99") + i,
+            "category": ("Phones", "Laptops", "Shoes", "Watches")[i % 4],
+            "stock": i % 50,
+            "rating": 4.5,
+        }
+        for i in range(count)
+    ]
+
+
+def order_rows(count):
+    start = datetime(2024, 1, 1, 9, 30)
+    return [
+        {
+            "order_id": i,
+            "product_names": "Product 1, Product 2, Product 3",
+            "total_amount": Decimal("1234.50"),
+            "payment_method": "Credit Card",
+            "order_status": "processing",
+            "order_date": start + timedelta(minutes=i),
+        }
+        for i in range(count)
+    ]
+
+
+def default_path(adapter):
+    def serialize(rows):
+        validated = adapter.validate_python(rows)
+        return json.dumps(jsonable_encoder(validated), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return serialize
+
+
+def median_seconds(fn, rows, repeats):
+    timings = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        fn(rows)
+        timings.append(time.perf_counter() - started)
+    timings.sort()
+    return timings[len(timings) // 2]
+
+
+def main():
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    cases = [
+        ("products", product_rows, default_path(TypeAdapter(List[ProductResponse]))),
+        ("orders", order_rows, default_path(TypeAdapter(List[OrderResponse]))),
+    ]
+    print(f"codec: {'orjson' if fast_json.orjson else 'stdlib json'}")
+    print(f"{'endpoint':<10} {'rows':>8} {'validate+json (ms)':>19} {'fast (ms)':>10} {'speedup':>8}")
+    for name, make_rows, slow in cases:
+        for count in ROW_COUNTS:
+            rows = make_rows(count)
+            old = median_seconds(slow, rows, repeats)
+            new = median_seconds(fast_json.dumps, rows, repeats)
+            print(f"{name:<10} {count:>8} {old * 1000:>19.1f} {new * 1000:>10.1f} {old / new:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+"""
+get_customer_orders(customer_name=...) on a synthetic database with millions
+of orders: the original single join + GROUP BY over every order of every
+matching customer against db_helper.build_customer_orders_query (customers
+resolved first through the trigram index, then one keyset page of their
+order_summary rows).
+
+Customers, orders and items are generated inside a transaction that is
+rolled back at the end, so the database is left untouched. Run the
+migrations first (009: customer name trigram index, 010: order_summary).
+
+Usage: python benchmarks/bench_customer_orders.py [order_count] [customer_count]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db_helper
+
+PAGE_SIZE = 100
+# Generated names end with a space, so "... 4242 " matches exactly one customer
+NAMES = [
+    ("rare name, 1 customer", "Synthetic Customer 4242 "),
+    ("common substring", "Synthetic Customer 42"),
+    ("no match", "Nobody Like This"),
+]
+
+LEGACY_QUERY = """
+    SELECT 
+        o.order_id,
+        STRING_AGG(p.product_name, ', ') AS Product_Names,
+        o.total_amount,
+        pm.method_name AS Payment_Method,
+        o.order_status,
+        o.order_date
+    FROM "Order" o
+    JOIN order_item oi ON o.order_id = oi.order_id
+    JOIN product p ON oi.product_id = p.product_id
+    JOIN payment_method pm ON o.payment_method_id = pm.payment_method_id
+    JOIN customer c ON o.customer_id = c.customer_id
+    WHERE c.name ILIKE %s
+    GROUP BY o.order_id, o.total_amount, pm.method_name, o.order_status, o.order_date
+    ORDER BY o.order_date DESC;
+"""
+
+
+def generate_data(cursor, order_count, customer_count):
+    cursor.execute("SELECT address_id FROM shipping_address LIMIT 1")
+    address_id = cursor.fetchone()[0]
+    cursor.execute("SELECT payment_method_id FROM payment_method LIMIT 1")
+    payment_method_id = cursor.fetchone()[0]
+    cursor.execute("SELECT shipping_method_id FROM shipping_method LIMIT 1")
+    shipping_method_id = cursor.fetchone()[0]
+    cursor.execute("SELECT MIN(product_id), MAX(product_id) FROM product")
+    min_product, max_product = cursor.fetchone()
+
+    cursor.execute(
+        """
+        INSERT INTO customer (name, email, phone)
+        SELECT 'Synthetic Customer ' || i || ' ', 'synthetic' || i || '@example.com', '09' || lpad(i::text, 8, '0')
+        FROM generate_series(1, %s) AS i
+        RETURNING customer_id
+        """,
+        (customer_count,),
+    )
+    customer_ids = [row[0] for row in cursor.fetchall()]
+    low, high = min(customer_ids), max(customer_ids)
+
+    cursor.execute(
+        """
+        INSERT INTO "Order" (
+            Customer_ID, Payment_Method_ID, Shipping_Method_ID, Shipping_Address_ID,
+            Total_Amount, Shipping_Fee, Discount, Order_Date,
+            Estimated_Delivery_Date, Payment_Status, Order_Status, Note
+        )
+        SELECT
+            %s + (i %% (%s - %s + 1)), %s, %s, %s,
+            (i %% 1000) * 1000, 0, 0, NOW() - (i %% 100000) * INTERVAL '1 minute',
+            NOW(), 'pending', 'pending', 'benchmark'
+        FROM generate_series(1, %s) AS i
+        """,
+        (low, high, low, payment_method_id, shipping_method_id, address_id, order_count),
+    )
+    cursor.execute(
+        """
+        INSERT INTO Order_Item (Order_ID, Product_ID, Quantity)
+        SELECT o.order_id, %s + ((o.order_id + k) %% (%s - %s + 1)), 1
+        FROM "Order" o
+        CROSS JOIN generate_series(1, 2) AS k
+        WHERE o.note = 'benchmark'
+        """,
+        (min_product, max_product, min_product),
+    )
+    # What place_order writes for each order (migration 010)
+    cursor.execute(
+        """
+        INSERT INTO order_summary (
+            order_id, customer_id, product_names, item_count, total_amount,
+            payment_method, order_status, order_date, shipping_address_id
+        )
+        SELECT o.order_id, o.customer_id, STRING_AGG(p.product_name, ', '), COUNT(*), o.total_amount,
+               pm.method_name, o.order_status, o.order_date, o.shipping_address_id
+        FROM "Order" o
+        JOIN order_item oi ON o.order_id = oi.order_id
+        JOIN product p ON oi.product_id = p.product_id
+        JOIN payment_method pm ON o.payment_method_id = pm.payment_method_id
+        WHERE o.note = 'benchmark'
+        GROUP BY o.order_id, o.customer_id, o.total_amount, pm.method_name, o.order_status, o.order_date, o.shipping_address_id
+        """
+    )
+    cursor.execute("ANALYZE order_summary")
+    cursor.execute("ANALYZE customer")
+    cursor.execute('ANALYZE "Order"')
+    cursor.execute("ANALYZE order_item")
+
+
+def timed(cursor, query, params, repeats=3):
+    best = None
+    for _ in range(repeats):
+        started = time.perf_counter()
+        cursor.execute(query, params)
+        rows = cursor.fetchall()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best * 1000, len(rows)
+
+
+def main():
+    order_count = int(sys.argv[1]) if len(sys.argv) > 1 else 2_000_000
+    customer_count = int(sys.argv[2]) if len(sys.argv) > 2 else 200_000
+    with db_helper.get_connection() as cnx:
+        cursor = cnx.cursor()
+        try:
+            started = time.perf_counter()
+            generate_data(cursor, order_count, customer_count)
+            print(f"Generated {customer_count} customers / {order_count} orders in {time.perf_counter() - started:.1f}s\n")
+
+            print(f"{'customer_name':<24} {'legacy (ms)':>12} {'rows':>7} {'page (ms)':>10} {'rows':>5}")
+            for label, name in NAMES:
+                legacy_ms, legacy_rows = timed(cursor, LEGACY_QUERY, (f"%{name}%",))
+                condition, param = db_helper.customer_orders_condition(customer_name=name)
+                page_ms, page_rows = timed(
+                    cursor,
+                    db_helper.build_customer_orders_query(condition, limit=PAGE_SIZE),
+                    db_helper.build_customer_orders_params(param, limit=PAGE_SIZE),
+                )
+                print(f"{label:<24} {legacy_ms:>12.1f} {legacy_rows:>7} {page_ms:>10.1f} {page_rows:>5}")
+
+            condition, param = db_helper.customer_orders_condition(customer_name=NAMES[1][1])
+            cursor.execute(
+                "EXPLAIN (ANALYZE, BUFFERS) " + db_helper.build_customer_orders_query(condition, limit=PAGE_SIZE),
+                db_helper.build_customer_orders_params(param, limit=PAGE_SIZE),
+            )
+            print("\n" + "\n".join(row[0] for row in cursor.fetchall()))
+        finally:
+            cursor.close()
+            cnx.rollback()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+Latency of writing one order vs. cart size: per-row Order_Item inserts (old
+place_order) against db_helper.insert_order_with_items (single statement, COPY
+for very large carts). Every run is rolled back, the database is left untouched.
+
+Usage: python benchmarks/bench_place_order.py [repeats]
+"""
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db_helper
+
+ITEM_COUNTS = [1, 10, 50, 200, 1000, 5000]
+
+
+def legacy_insert(cursor, order_details, session_id):
+    cursor.execute(
+        """
+        INSERT INTO "Order" (
+            Customer_ID, Payment_Method_ID, Shipping_Method_ID, Shipping_Address_ID,
+            Promotion_ID, Total_Amount, Shipping_Fee, Discount,
+            Estimated_Delivery_Date, Payment_Status, Order_Status, Note
+        )
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, 'pending', 'pending', %s)
+        RETURNING Order_ID
+        """,
+        (
+            order_details["customer_id"], order_details["payment_method_id"],
+            order_details["shipping_method_id"], order_details["shipping_address_id"],
+            order_details["promotion_id"], order_details["total_amount"],
+            order_details["shipping_fee"], order_details["discount"],
+            order_details["estimated_delivery_date"], f"benchmark ({session_id})",
+        ),
+    )
+    order_id = cursor.fetchone()[0]
+    for product_id, quantity in order_details["order_list"]:
+        cursor.execute(
+            "INSERT INTO Order_Item (Order_ID, Product_ID, Quantity) VALUES (%s, %s, %s)",
+            (order_id, product_id, quantity),
+        )
+    return order_id
+
+
+def sample_order(cursor, item_count):
+    cursor.execute("SELECT customer_id FROM shipping_address LIMIT 1")
+    customer_id = cursor.fetchone()[0]
+    cursor.execute("SELECT address_id FROM shipping_address WHERE customer_id = %s LIMIT 1", (customer_id,))
+    address_id = cursor.fetchone()[0]
+    cursor.execute("SELECT payment_method_id FROM payment_method LIMIT 1")
+    payment_method_id = cursor.fetchone()[0]
+    cursor.execute("SELECT shipping_method_id FROM shipping_method LIMIT 1")
+    shipping_method_id = cursor.fetchone()[0]
+    cursor.execute("SELECT product_id FROM product ORDER BY product_id")
+    product_ids = [row[0] for row in cursor.fetchall()]
+    return {
+        "customer_id": customer_id,
+        "payment_method_id": payment_method_id,
+        "shipping_method_id": shipping_method_id,
+        "shipping_address_id": address_id,
+        "promotion_id": None,
+        "total_amount": 0,
+        "shipping_fee": 0,
+        "discount": 0,
+        "estimated_delivery_date": (datetime.now() + timedelta(days=3)).strftime("%Y-%m-%d"),
+        "order_list": [(product_id, 1) for product_id in product_ids[:item_count]],
+    }
+
+
+def time_insert(insert_fn, order_details, repeats):
+    timings = []
+    with db_helper.get_connection() as cnx:
+        for _ in range(repeats):
+            cursor = cnx.cursor()
+            started = time.perf_counter()
+            insert_fn(cursor, order_details, "bench")
+            timings.append(time.perf_counter() - started)
+            cursor.close()
+            cnx.rollback()
+    timings.sort()
+    return timings[len(timings) // 2]
+
+
+def main():
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    print(f"{'items':>7} {'per-row (ms)':>14} {'bulk (ms)':>11} {'speedup':>8}")
+    for item_count in ITEM_COUNTS:
+        with db_helper.get_connection() as cnx:
+            cursor = cnx.cursor()
+            order_details = sample_order(cursor, item_count)
+            cursor.close()
+        rows = len(order_details["order_list"])
+        if rows < item_count:
+            print(f"{item_count:>7}  skipped: catalog only has {rows} products")
+            continue
+        legacy = time_insert(legacy_insert, order_details, repeats)
+        bulk = time_insert(db_helper.insert_order_with_items, order_details, repeats)
+        print(f"{rows:>7} {legacy * 1000:>14.2f} {bulk * 1000:>11.2f} {legacy / bulk:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""
+search.by.price lookups at large catalog sizes: price_index.PriceIndex (bisect
+over sorted arrays) against the SQL of db_helper.get_list_products_by_price.
+
+The index part needs nothing but the repo. With --sql, the same synthetic
+catalog is also inserted into Postgres inside a transaction that is rolled
+back at the end, and the db_helper query is timed on it.
+
+Usage: python benchmarks/bench_price_index.py [--sql] [lookups]
+"""
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db_helper
+from price_index import PriceIndex
+
+CATALOG_SIZES = [10_000, 100_000, 1_000_000]
+BRANDS = [f"Brand {i}" for i in range(50)]
+QUERIES = [
+    ("Under 60", "", "Under", 60),
+    ("Between 100-120", "", "Between", [100, 120]),
+    ("Brand 7, under 60", "Brand 7", "Under", 60),
+]
+
+
+class SyntheticCatalog:
+    def __init__(self, size):
+        rng = random.Random(size)
+        self._rows = [
+            {
+                "product_id": i,
+                "product_name": f"Product {i}",
+                "price": round(rng.uniform(1, 5000), 2),
+                "brand_name": BRANDS[i % len(BRANDS)],
+            }
+            for i in range(1, size + 1)
+        ]
+
+    def rows(self):
+        return self._rows
+
+    def peek_rows(self, product_ids):
+        return [self._rows[pid - 1] for pid in product_ids]
+
+
+def time_per_call_us(fn, lookups):
+    started = time.perf_counter()
+    for _ in range(lookups):
+        result = fn()
+    return (time.perf_counter() - started) / lookups * 1e6, len(result)
+
+
+def sql_timings(source, lookups):
+    """Per-query SQL latency on the same catalog, inside a rolled-back transaction"""
+    timings = {}
+    with db_helper.get_connection() as cnx:
+        cursor = cnx.cursor()
+        try:
+            cursor.execute("SELECT category_id FROM product_category ORDER BY category_id LIMIT 1")
+            category_id = cursor.fetchone()[0]
+            brand_ids = {}
+            for name in BRANDS:
+                cursor.execute(
+                    "INSERT INTO brand (brand_name, description, origin_country) VALUES (%s, '', '') RETURNING brand_id",
+                    (f"bench {name}",),
+                )
+                brand_ids[name] = cursor.fetchone()[0]
+            cursor.executemany(
+                """
+                INSERT INTO product (product_name, description, price, specifications, stock_quantity, brand_id, category_id)
+                VALUES (%s, '', %s, '{}', 1, %s, %s)
+                """,
+                [(row["product_name"], row["price"], brand_ids[row["brand_name"]], category_id) for row in source.rows()],
+            )
+            cursor.execute("ANALYZE product")
+            for label, brand_name, price_range, price in QUERIES:
+                bounds = db_helper.price_range_bounds(price_range, price)
+                query, params = db_helper.build_products_by_price_query(f"bench {brand_name}" if brand_name else "", *bounds)
+
+                def run():
+                    cursor.execute(query, params)
+                    return cursor.fetchall()
+
+                timings[label] = time_per_call_us(run, lookups)
+        finally:
+            cursor.close()
+            cnx.rollback()
+    return timings
+
+
+def main():
+    args = [a for a in sys.argv[1:] if a != "--sql"]
+    with_sql = "--sql" in sys.argv[1:]
+    lookups = int(args[0]) if args else 2000
+
+    for size in CATALOG_SIZES:
+        source = SyntheticCatalog(size)
+        index = PriceIndex(source)
+        started = time.perf_counter()
+        index.on_catalog_change(None)
+        build_ms = (time.perf_counter() - started) * 1000
+        started = time.perf_counter()
+        for product_id in range(1, 101):
+            index.on_catalog_change({product_id})
+        refresh_us = (time.perf_counter() - started) / 100 * 1e6
+        print(f"\n{size} products: full build {build_ms:.0f} ms, one-product refresh {refresh_us:.1f} us")
+
+        sql = sql_timings(source, max(lookups // 100, 5)) if with_sql else {}
+        print(f"{'query':<22} {'rows':>7} {'index (us)':>11} {'SQL (us)':>10}")
+        for label, brand_name, price_range, price in QUERIES:
+            us, rows = time_per_call_us(lambda: index.get_list_products_by_price(brand_name, price_range, price), lookups)
+            sql_us = f"{sql[label][0]:>10.0f}" if label in sql else f"{'-':>10}"
+            print(f"{label:<22} {rows:>7} {us:>11.1f} {sql_us}")
+
+
+if __name__ == "__main__":
+    main()
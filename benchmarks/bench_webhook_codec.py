@@ -0,0 +1,101 @@
+"""
+Cost of decoding a Dialogflow webhook request and encoding the reply:
+stdlib json + dict lookups (old handle_request / JSONResponse) against
+webhook_models.WebhookRequest.from_bytes and fast_json.dumps (orjson).
+No database or server needed.
+
+Usage: python benchmarks/bench_webhook_codec.py [iterations]
+"""
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fast_json
+import generic_helper
+import webhook_models
+
+SESSION = "projects/shopdbchatbot-nhmk/locations/global/agent/sessions/6f1c2d9a-8b7e-4c1a-9d3e-0a1b2c3d4e5f"
+
+
+def sample_request(context_count):
+    contexts = [
+        {
+            "name": f"{SESSION}/contexts/context-{i}",
+            "lifespanCount": 5,
+            "parameters": {
+                "product": [f"Product {i}"],
+                "rating": 4,
+                "unreviewed_products": [f"Product {j}" for j in range(10)],
+                "product.original": f"product {i}",
+            },
+        }
+        for i in range(context_count)
+    ]
+    return {
+        "responseId": "2f7c1b9e-4e5d-4f3a-a1b2-c3d4e5f60718-0820055c",
+        "session": SESSION,
+        "queryResult": {
+            "queryText": "I want 2 iPhone 15 and 1 Galaxy S24",
+            "parameters": {"product-name": ["iPhone 15", "Galaxy S24"], "number": [2, 1]},
+            "allRequiredParamsPresent": True,
+            "intent": {"name": "projects/shopdbchatbot-nhmk/agent/intents/1", "displayName": "confirm.product.order : context: ongoing-order"},
+            "intentDetectionConfidence": 1,
+            "languageCode": "en",
+            "outputContexts": contexts,
+        },
+    }
+
+
+def sample_response(line_count):
+    return {
+        "fulfillmentText": "||".join(f"ID: {i:<5} --> Name:Product {i}" for i in range(line_count)),
+        "source": "shopdb-chatbot",
+        "outputContexts": [{"name": f"{SESSION}/contexts/ongoing-order", "lifespanCount": 5, "parameters": {"ids": list(range(line_count))}}],
+    }
+
+
+def stdlib_decode(body):
+    payload = json.loads(body)
+    intent = payload['queryResult']['intent']['displayName']
+    parameters = payload['queryResult']['parameters']
+    output_contexts = payload['queryResult']['outputContexts']
+    session_id = generic_helper.extract_session_id(output_contexts[0]["name"])
+    return intent, parameters, output_contexts, session_id
+
+
+def stdlib_encode(content):
+    # What starlette's JSONResponse.render does
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+
+def per_call_us(fn, arg, iterations):
+    started = time.perf_counter()
+    for _ in range(iterations):
+        fn(arg)
+    return (time.perf_counter() - started) / iterations * 1e6
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    print(f"codec: {'orjson' if fast_json.orjson else 'stdlib json (orjson not installed)'}")
+    print(f"{'decode':<22} {'bytes':>8} {'stdlib (us)':>12} {'typed (us)':>11} {'speedup':>8}")
+    for context_count in (1, 5, 20):
+        body = json.dumps(sample_request(context_count)).encode("utf-8")
+        old = per_call_us(stdlib_decode, body, iterations)
+        new = per_call_us(webhook_models.WebhookRequest.from_bytes, body, iterations)
+        print(f"{f'{context_count} contexts':<22} {len(body):>8} {old:>12.2f} {new:>11.2f} {old / new:>7.1f}x")
+
+    print(f"{'encode':<22} {'bytes':>8} {'stdlib (us)':>12} {'orjson (us)':>11} {'speedup':>8}")
+    for line_count in (1, 20, 200):
+        content = sample_response(line_count)
+        size = len(stdlib_encode(content))
+        old = per_call_us(stdlib_encode, content, iterations)
+        new = per_call_us(fast_json.dumps, content, iterations)
+        print(f"{f'{line_count} lines':<22} {size:>8} {old:>12.2f} {new:>11.2f} {old / new:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
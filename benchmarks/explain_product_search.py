@@ -0,0 +1,83 @@
+"""
+Query plans and timings of db_helper.search_products filters on a large
+synthetic catalog. N products are generated inside a transaction that is
+rolled back at the end, so the database is left untouched. Run the
+migrations first (004: price index, 006: full-text search).
+
+Usage: python benchmarks/explain_product_search.py [product_count]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db_helper
+
+CASES = [
+    ("no filter, first page", {}),
+    ("price 100000-500000", {"min_price": 100000, "max_price": 500000}),
+    ("price 1000000-", {"min_price": 1000000}),
+]
+
+# /api/products?search= goes through the tsvector index (migration 006)
+RANKED_CASES = [
+    ("'phone'", "phone"),
+    ("'synthetic phone 42'", "synthetic phone 42"),
+]
+
+
+def generate_catalog(cursor, product_count):
+    cursor.execute("SELECT brand_id FROM brand ORDER BY brand_id LIMIT 1")
+    brand_id = cursor.fetchone()[0]
+    cursor.execute("SELECT category_id FROM product_category ORDER BY category_id LIMIT 1")
+    category_id = cursor.fetchone()[0]
+    cursor.execute(
+        """
+        INSERT INTO product (product_name, description, price, specifications, stock_quantity, brand_id, category_id)
+        SELECT
+            'Synthetic ' || (ARRAY['Phone', 'Laptop', 'Shoe', 'Watch', 'Camera'])[1 + i % 5] || ' ' || i,
+            'Generated product number ' || i || ' for query plan checks',
+            (i % 2000) * 1000,
+            '{}',
+            i % 100,
+            %s,
+            %s
+        FROM generate_series(1, %s) AS i
+        """,
+        (brand_id, category_id, product_count),
+    )
+    cursor.execute("ANALYZE product")
+
+
+def main():
+    product_count = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    with db_helper.get_connection() as cnx:
+        cursor = cnx.cursor()
+        try:
+            started = time.perf_counter()
+            generate_catalog(cursor, product_count)
+            print(f"Generated {product_count} products in {time.perf_counter() - started:.1f}s\n")
+
+            for label, filters in CASES:
+                query, params = db_helper.build_search_products_query(limit=101, **filters)
+                cursor.execute("EXPLAIN (ANALYZE, BUFFERS) " + query, params)
+                plan = [row[0] for row in cursor.fetchall()]
+                print(f"=== {label}")
+                print("\n".join(plan))
+                print()
+
+            for label, search in RANKED_CASES:
+                query, params = db_helper.build_ranked_search_query(db_helper.build_tsquery(search), limit=101)
+                cursor.execute("EXPLAIN (ANALYZE, BUFFERS) " + query, params)
+                plan = [row[0] for row in cursor.fetchall()]
+                print(f"=== full-text {label}")
+                print("\n".join(plan))
+                print()
+        finally:
+            cursor.close()
+            cnx.rollback()
+
+
+if __name__ == "__main__":
+    main()
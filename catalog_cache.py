@@ -0,0 +1,293 @@
+import json
+import select
+import threading
+from bisect import bisect_right, insort
+
+import psycopg2
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+
+import db_helper
+
+NOTIFY_CHANNEL = "catalog_changed"  # see migrations/001_catalog_change_notify.sql
+LISTEN_POLL_SECONDS = 5.0
+RECONNECT_DELAY_SECONDS = 5.0
+
+
+class CatalogCache:
+    """
+    In-memory product + brand + category rows keyed by product id and by name.
+
+    Readers get the same return shapes as the db_helper functions they replace.
+    A lookup the cache cannot answer (not loaded yet, unknown id/name) falls
+    back to the database and is counted as a miss. Rows are refreshed per
+    product / per brand from Postgres LISTEN/NOTIFY messages, and fully
+    reloaded every time the listener (re)connects.
+
+    Other in-memory indexes subscribe with add_listener(callback); the callback
+    receives the set of changed product ids, or None after a full reload.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._products = {}     # product_id -> row dict
+        self._by_name = {}      # lower-cased product_name -> [product_id]
+        self._by_brand = {}     # brand_name -> sorted [product_id]
+        self._loaded = False
+        self._listeners = []
+        self._stop = threading.Event()
+        self._thread = None
+        self.hits = 0
+        self.misses = 0
+        self.reloads = 0
+        self.row_refreshes = 0
+
+    # ---------- maintenance ----------
+
+    def add_listener(self, callback):
+        self._listeners.append(callback)
+
+    def _notify_listeners(self, changed_ids):
+        for callback in self._listeners:
+            try:
+                callback(changed_ids)
+            except Exception as e:
+                print(f"[ERROR] Catalog listener {callback} failed: {e}")
+
+    def _index_row(self, row):
+        self._products[row["product_id"]] = row
+        self._by_name.setdefault(row["product_name"].lower(), []).append(row["product_id"])
+        insort(self._by_brand.setdefault(row["brand_name"], []), row["product_id"])
+
+    def _unindex_row(self, product_id):
+        row = self._products.pop(product_id, None)
+        if row is None:
+            return
+        key = row["product_name"].lower()
+        ids = [pid for pid in self._by_name.get(key, []) if pid != product_id]
+        if ids:
+            self._by_name[key] = ids
+        else:
+            self._by_name.pop(key, None)
+        brand_ids = self._by_brand.get(row["brand_name"], [])
+        i = bisect_right(brand_ids, product_id) - 1
+        if i >= 0 and brand_ids[i] == product_id:
+            del brand_ids[i]
+        if not brand_ids:
+            self._by_brand.pop(row["brand_name"], None)
+
+    def load(self):
+        """Replace the whole catalog from the database"""
+        rows = db_helper.get_catalog_rows()
+        with self._lock:
+            self._products = {}
+            self._by_name = {}
+            self._by_brand = {}
+            for row in rows:
+                self._index_row(dict(row))
+            self._loaded = True
+            self.reloads += 1
+        self._notify_listeners(None)
+
+    def refresh_products(self, product_ids):
+        """Re-read the given products; ids that no longer exist are dropped"""
+        product_ids = set(product_ids)
+        if not product_ids:
+            return
+        rows = db_helper.get_catalog_rows(product_ids=product_ids)
+        with self._lock:
+            for product_id in product_ids:
+                self._unindex_row(product_id)
+            for row in rows:
+                self._index_row(dict(row))
+            self.row_refreshes += len(product_ids)
+        self._notify_listeners(product_ids)
+
+    def refresh_brand(self, brand_id):
+        """Re-read every product of a brand (brand name/description/country changed)"""
+        rows = db_helper.get_catalog_rows(brand_id=brand_id)
+        with self._lock:
+            stale = {pid for pid, row in self._products.items() if row["brand_id"] == brand_id}
+            changed = stale | {row["product_id"] for row in rows}
+            for product_id in stale:
+                self._unindex_row(product_id)
+            for row in rows:
+                self._index_row(dict(row))
+            self.row_refreshes += len(changed)
+        self._notify_listeners(changed)
+
+    def handle_notification(self, payloads):
+        product_ids, brand_ids = set(), set()
+        for payload in payloads:
+            try:
+                message = json.loads(payload)
+            except ValueError:
+                continue
+            if message.get("table") == "product":
+                product_ids.add(message["id"])
+            elif message.get("table") == "brand":
+                brand_ids.add(message["id"])
+        self.refresh_products(product_ids)
+        for brand_id in brand_ids:
+            self.refresh_brand(brand_id)
+
+    def _listen_loop(self):
+        while not self._stop.is_set():
+            conn = None
+            try:
+                conn = psycopg2.connect(**db_helper.DB_CONFIG)
+                conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+                cursor = conn.cursor()
+                cursor.execute(f"LISTEN {NOTIFY_CHANNEL};")
+                cursor.close()
+                # Resync: anything changed while we were not listening is picked up here
+                self.load()
+                while not self._stop.is_set():
+                    if select.select([conn], [], [], LISTEN_POLL_SECONDS) == ([], [], []):
+                        continue
+                    conn.poll()
+                    payloads = [notify.payload for notify in conn.notifies]
+                    conn.notifies.clear()
+                    if payloads:
+                        self.handle_notification(payloads)
+            except Exception as e:
+                print(f"[ERROR] Catalog cache listener error: {e}")
+                self._stop.wait(RECONNECT_DELAY_SECONDS)
+            finally:
+                if conn is not None:
+                    conn.close()
+
+    def start(self):
+        """Load the catalog and keep it in sync in a background thread"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._listen_loop, name="catalog-cache-listener", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "loaded": self._loaded,
+            "products": len(self._products),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else None,
+            "reloads": self.reloads,
+            "row_refreshes": self.row_refreshes,
+            "listener_alive": self._thread is not None and self._thread.is_alive(),
+        }
+
+    # ---------- readers ----------
+
+    def get_row(self, product_id):
+        row = self._products.get(product_id)
+        if row is not None:
+            self.hits += 1
+        return row
+
+    def rows(self):
+        with self._lock:
+            return list(self._products.values())
+
+    def peek_rows(self, product_ids):
+        """Cached rows of the given ids, without touching the hit/miss counters"""
+        with self._lock:
+            return [self._products[pid] for pid in product_ids if pid in self._products]
+
+    def get_list_products_by_id(self, product_id):
+        row = self.get_row(product_id)
+        if row is None:
+            self.misses += 1
+            return db_helper.get_list_products_by_id(product_id)
+        return [(
+            row["product_name"],
+            row["product_description"],
+            row["price"],
+            row["specifications"],
+            row["brand_name"],
+            row["stock_quantity"],
+            row["brand_description"],
+            row["origin_country"],
+        )]
+
+    def get_products_by_ids(self, product_ids):
+        result, missing = {}, []
+        for product_id in {int(pid) for pid in product_ids}:
+            row = self.get_row(product_id)
+            if row is None:
+                missing.append(product_id)
+                continue
+            result[product_id] = (
+                row["product_name"],
+                row["product_description"],
+                row["price"],
+                row["specifications"],
+                row["brand_name"],
+                row["stock_quantity"],
+                row["brand_description"],
+                row["origin_country"],
+            )
+        if missing:
+            self.misses += len(missing)
+            result.update(db_helper.get_products_by_ids(missing))
+        return result
+
+    def get_products_by_name(self, product_name):
+        with self._lock:
+            ids = list(self._by_name.get(product_name.lower(), [])) if product_name else []
+            rows = [self._products[pid] for pid in ids if pid in self._products]
+        # get_products_by_name is an exact, case-sensitive match
+        rows = [row for row in rows if row["product_name"] == product_name]
+        if not rows:
+            self.misses += 1
+            return db_helper.get_products_by_name(product_name)
+        self.hits += 1
+        return [
+            (
+                row["product_id"],
+                row["product_name"],
+                row["product_description"],
+                row["price"],
+                row["specifications"],
+                row["brand_name"],
+                row["origin_country"],
+                row["stock_quantity"],
+            )
+            for row in rows
+        ]
+
+    def get_list_products_by_brand(self, brand_name, after=None, limit=None):
+        if not self._loaded:
+            self.misses += 1
+            return db_helper.get_list_products_by_brand(brand_name, after, limit)
+        self.hits += 1
+        with self._lock:
+            ids = self._by_brand.get(brand_name, [])
+            start = bisect_right(ids, after) if after is not None else 0
+            end = len(ids) if limit is None else start + limit
+            return [(pid, self._products[pid]["product_name"]) for pid in ids[start:end]]
+
+    def get_product_details(self, product_name):
+        with self._lock:
+            ids = list(self._by_name.get(product_name.lower(), [])) if product_name else []
+            rows = [self._products[pid] for pid in ids if pid in self._products and self._products[pid]["product_name"] == product_name]
+        if not rows:
+            self.misses += 1
+            return db_helper.get_product_details(product_name)
+        self.hits += 1
+        row = rows[0]
+        return (
+            row["product_name"],
+            row["price"],
+            row["product_description"],
+            row["specifications"],
+            row["stock_quantity"],
+            row["brand_name"],
+            row["category_name"],
+        )
+
+
+catalog = CatalogCache()
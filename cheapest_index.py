@@ -0,0 +1,136 @@
+import heapq
+import threading
+from bisect import insort
+
+import db_helper
+from catalog_cache import catalog
+
+TOP_N = 5
+
+
+class CheapestIndex:
+    """
+    The TOP_N cheapest in-stock products of the whole catalog, of every brand,
+    of every category and of every brand + category pair, kept ready so the
+    choose.cheapest.product intent is a dict lookup.
+
+    Subscribed to the catalog cache like name_index / price_index. A refresh
+    only recomputes a group's top list when a product that was in it changed;
+    other changes are inserted into the list or ignored.
+    Until the first load it answers from db_helper.
+    """
+
+    def __init__(self, source, top_n=TOP_N):
+        self._source = source
+        self.top_n = top_n
+        self._lock = threading.Lock()
+        self._members = {}      # group -> {product_id: (price, product_id)}, in-stock products only
+        self._top = {}          # group -> sorted [(price, product_id)], at most top_n
+        self._groups_of = {}    # product_id -> groups it is a member of
+        self._loaded = False
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _groups(row):
+        brand, category = row["brand_name"], row["category_name"]
+        return (None, None), (brand, None), (None, category), (brand, category)
+
+    @staticmethod
+    def _in_stock(row):
+        return row["price"] is not None and int(row["stock_quantity"] or 0) > 0
+
+    # ---------- maintenance ----------
+
+    def on_catalog_change(self, changed_ids):
+        """Catalog listener: None after a full reload, else the refreshed product ids"""
+        if changed_ids is None:
+            members, groups_of = {}, {}
+            for row in self._source.rows():
+                if not self._in_stock(row):
+                    continue
+                key = (float(row["price"]), row["product_id"])
+                groups = self._groups(row)
+                for group in groups:
+                    members.setdefault(group, {})[row["product_id"]] = key
+                groups_of[row["product_id"]] = groups
+            top = {group: heapq.nsmallest(self.top_n, entries.values()) for group, entries in members.items()}
+            with self._lock:
+                self._members, self._top, self._groups_of = members, top, groups_of
+                self._loaded = True
+            return
+
+        rows = {row["product_id"]: row for row in self._source.peek_rows(changed_ids)}
+        with self._lock:
+            stale = set()
+            for product_id in changed_ids:
+                for group in self._groups_of.pop(product_id, ()):
+                    entries = self._members[group]
+                    key = entries.pop(product_id)
+                    if key in self._top[group]:
+                        stale.add(group)
+                    if not entries:
+                        del self._members[group], self._top[group]
+                        stale.discard(group)
+
+                row = rows.get(product_id)
+                if row is None or not self._in_stock(row):
+                    continue
+                key = (float(row["price"]), product_id)
+                groups = self._groups(row)
+                for group in groups:
+                    self._members.setdefault(group, {})[product_id] = key
+                    top = self._top.setdefault(group, [])
+                    if group not in stale and (len(top) < self.top_n or key < top[-1]):
+                        insort(top, key)
+                        del top[self.top_n:]
+                self._groups_of[product_id] = groups
+
+            # A product left (or got dearer in) a top list: the next cheapest has to be found
+            for group in stale:
+                self._top[group] = heapq.nsmallest(self.top_n, self._members[group].values())
+
+    # ---------- readers ----------
+
+    def get_cheapest_products(self, brand_name=None, category_name=None, limit=1):
+        """Same arguments and rows as db_helper.get_cheapest_products (limit up to top_n)"""
+        if not self._loaded or limit > self.top_n:
+            self.misses += 1
+            return db_helper.get_cheapest_products(brand_name, category_name, limit)
+        with self._lock:
+            top = self._top.get((brand_name or None, category_name or None), [])[:limit]
+        rows = self._source.peek_rows([product_id for _, product_id in top])
+        if len(rows) < len(top):
+            # The catalog moved on between the two lookups
+            self.misses += 1
+            return db_helper.get_cheapest_products(brand_name, category_name, limit)
+        self.hits += 1
+        return [
+            (
+                row["product_name"],
+                row["product_description"],
+                row["price"],
+                row["specifications"],
+                row["brand_name"],
+                row["brand_description"],
+                row["origin_country"],
+            )
+            for row in rows
+        ]
+
+    def get_product_cheapest(self, brand_name=None, category_name=None):
+        rows = self.get_cheapest_products(brand_name, category_name, limit=1)
+        return rows[0] if rows else None
+
+    def stats(self):
+        return {
+            "loaded": self._loaded,
+            "groups": len(self._top),
+            "top_n": self.top_n,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+cheapest_products = CheapestIndex(catalog)
+catalog.add_listener(cheapest_products.on_catalog_change)
@@ -1,466 +1,746 @@
 from binascii import Error
+import contextvars
+import io
+import math
+import os
+import re
+from contextlib import contextmanager
 import psycopg2
+import psycopg2.errors
 from psycopg2.extras import RealDictCursor
 from datetime import datetime, timedelta
+from db_pool import BoundedConnectionPool, PoolTimeoutError
 
-# global cnx
+DB_CONFIG = {
+    "host": os.getenv("DB_HOST", "localhost"),
+    "user": os.getenv("DB_USER", "postgres"),
+    "password": os.getenv("DB_PASSWORD", "admin"),
+    "database": os.getenv("DB_NAME", "shopDB"),
+}
 
-# cnx = psycopg2.connect(
-#     host="localhost",
-#     user="postgres",
-#     password="admin",
-#     database="shopDB"
-# )
+POOL_CONFIG = {
+    "minconn": int(os.getenv("DB_POOL_MIN", "1")),
+    "maxconn": int(os.getenv("DB_POOL_MAX", "10")),
+    "checkout_timeout": float(os.getenv("DB_POOL_TIMEOUT", "5")),
+    "health_check_after": float(os.getenv("DB_POOL_HEALTH_CHECK_AFTER", "30")),
+}
+
+pool = None
 
 def init_db_connection():
-    global cnx
+    global pool
     try:
-        cnx = psycopg2.connect(
-            host="localhost",
-            user="postgres",
-            password="admin",
-            database="shopDB"
-        )
-        print("Database connection initialized successfully.")
+        if pool is not None:
+            pool.closeall()
+        pool = BoundedConnectionPool(**POOL_CONFIG, **DB_CONFIG)
+        print("Database connection pool initialized successfully.")
     except Exception as e:
-        print(f"Failed to initialize database connection: {e}")
-        cnx = None
+        print(f"Failed to initialize database connection pool: {e}")
+        pool = None
+
+# Set by count_db_calls(); every get_connection() checkout inside that block is counted
+_db_call_counter = contextvars.ContextVar("db_call_counter", default=None)
+
+@contextmanager
+def count_db_calls():
+    """Count db_helper calls (connection checkouts) made by the current thread/task inside the with-block"""
+    counter = [0]
+    token = _db_call_counter.set(counter)
+    try:
+        yield counter
+    finally:
+        _db_call_counter.reset(token)
+
+@contextmanager
+def get_connection(timeout=None):
+    """Borrow a pooled connection for the duration of the with-block"""
+    if pool is None:
+        init_db_connection()
+        if pool is None:
+            raise psycopg2.OperationalError("Database connection pool is not available")
+    counter = _db_call_counter.get()
+    if counter is not None:
+        counter[0] += 1
+    with pool.connection(timeout) as cnx:
+        yield cnx
+
+def get_pool_stats():
+    if pool is None:
+        return {"available": False}
+    return {"available": True, **pool.stats()}
 
 init_db_connection()
 
-def get_list_products_by_brand(brand_name):
-    cursor = cnx.cursor()
+def get_list_products_by_brand(brand_name, after=None, limit=None):
+    """(product_id, product_name) of a brand in id order; `after` (last id seen) and `limit` page through it"""
+    with get_connection() as cnx:
+        cursor = cnx.cursor()
+        query = """
+            SELECT product_id, product_name 
+            FROM product 
+            JOIN brand ON product.brand_id = brand.brand_id 
+            WHERE brand.brand_name = %s
+        """
+        params = [brand_name]
+        if after is not None:
+            query += " AND product_id > %s"
+            params.append(after)
+        query += " ORDER BY product_id"
+        if limit is not None:
+            query += " LIMIT %s"
+            params.append(limit)
+        cursor.execute(query, params)
+        results = cursor.fetchall()
+        cursor.close()
+        return results
+
+def _as_price(value):
+    """float(value) for a usable price bound, None for missing / empty / non-numeric values"""
+    if value is None or isinstance(value, bool):
+        return None
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    return value if math.isfinite(value) else None
+
+def price_range_bounds(price_range, price):
+    """
+    (min_price, max_price) of a search.by.price request ("Under" x / "Between" [x, y]),
+    None if the range is unknown or a bound is missing or not a number
+    """
+    if price_range == "Under":
+        bounds = (0.0, _as_price(price))
+    elif price_range == "Between":
+        if not isinstance(price, (list, tuple)) or len(price) != 2:
+            return None
+        bounds = (_as_price(price[0]), _as_price(price[1]))
+    else:
+        return None
+    return None if None in bounds else bounds
+
+def build_products_by_price_query(brand_name, min_price, max_price, after=None, limit=None):
+    """
+    (product_id, product_name, price) rows, cheapest first; `after` is the
+    (price, product_id) of the last row seen (keyset paging).
+    """
     query = """
-        SELECT product_id, product_name 
+        SELECT product_id, product_name, price 
         FROM product 
-        JOIN brand ON product.brand_id = brand.brand_id 
-        WHERE brand.brand_name = %s;
     """
-    cursor.execute(query, (brand_name,))
-    results = cursor.fetchall()
-    cursor.close()
-    return results
+    params = []
+    if brand_name == "":
+        query += " WHERE price BETWEEN %s AND %s"
+    else:
+        query += """
+            JOIN brand ON product.brand_id = brand.brand_id 
+            WHERE brand.brand_name = %s AND price BETWEEN %s AND %s
+        """
+        params.append(brand_name)
+    params.extend([min_price, max_price])
+    if after is not None:
+        query += " AND (price, product_id) > (%s, %s)"
+        params.extend(after)
+    query += " ORDER BY price, product_id"
+    if limit is not None:
+        query += " LIMIT %s"
+        params.append(limit)
+    return query, tuple(params)
 
-def get_list_products_by_price(brand_name, price_range, price):
-    cursor = cnx.cursor()
-    try:
-        if price_range == "Under":
-            min_price = 0
-            max_price = price
-        elif price_range == "Between":
-            if not isinstance(price, (list, tuple)) or len(price) != 2:
-                return [] 
-            min_price, max_price = price
-        else:
-            return [] 
-
-        if brand_name == "":
+def get_list_products_by_price(brand_name, price_range, price, after=None, limit=None):
+    bounds = price_range_bounds(price_range, price)
+    if bounds is None:
+        return []
+    with get_connection() as cnx:
+        cursor = cnx.cursor()
+        try:
+            query, params = build_products_by_price_query(brand_name, *bounds, after=after, limit=limit)
+            cursor.execute(query, params)
+            results = cursor.fetchall()
+            return results
+        finally:
+            cursor.close()
+
+def get_list_products_by_id(product_id):
+    with get_connection() as cnx:
+        cursor = cnx.cursor()
+        try:
             query = """
-                SELECT product_id, product_name 
-                FROM product 
-                WHERE price BETWEEN %s AND %s;
+                SELECT 
+                    p.product_name, 
+                    p.description AS product_description,
+                    p.price, 
+                    p.specifications, 
+                    b.brand_name, 
+                    p.stock_quantity,
+                    b.description AS brand_description,
+                    b.origin_country 
+                FROM product p 
+                JOIN brand b ON p.brand_id = b.brand_id
+                WHERE p.product_id = %s;
             """
-            cursor.execute(query, (min_price, max_price))
-        else:
+            cursor.execute(query, (product_id,))
+            results = cursor.fetchall()
+            return results
+        except Exception as e:
+            cnx.rollback()  
+            print(f"[ERROR] Failed to execute query: {e}")
+            return []
+        finally:
+            cursor.close()
+
+def get_products_by_ids(product_ids):
+    """
+    Bulk version of get_list_products_by_id: one query for many ids.
+    Returns {product_id: row} where row has the same columns as get_list_products_by_id.
+    """
+    ids = list({int(pid) for pid in product_ids})
+    if not ids:
+        return {}
+    with get_connection() as cnx:
+        cursor = cnx.cursor()
+        try:
             query = """
-                SELECT product_id, product_name 
-                FROM product 
-                JOIN brand ON product.brand_id = brand.brand_id 
-                WHERE brand.brand_name = %s AND price BETWEEN %s AND %s;
+                SELECT 
+                    p.product_id,
+                    p.product_name, 
+                    p.description AS product_description,
+                    p.price, 
+                    p.specifications, 
+                    b.brand_name, 
+                    p.stock_quantity,
+                    b.description AS brand_description,
+                    b.origin_country 
+                FROM product p 
+                JOIN brand b ON p.brand_id = b.brand_id
+                WHERE p.product_id = ANY(%s);
             """
-            cursor.execute(query, (brand_name, min_price, max_price))
-
-        results = cursor.fetchall()
-        return results
-    finally:
-        cursor.close()
+            cursor.execute(query, (ids,))
+            return {row[0]: row[1:] for row in cursor.fetchall()}
+        except Exception as e:
+            cnx.rollback()
+            print(f"[ERROR] Failed to execute bulk product query: {e}")
+            return {}
+        finally:
+            cursor.close()
 
-def get_list_products_by_id(product_id):
-    cursor = cnx.cursor()
-    try:
-        query = """
-            SELECT 
-                p.product_name, 
-                p.description AS product_description,
-                p.price, 
-                p.specifications, 
-                b.brand_name, 
-                p.stock_quantity,
-                b.description AS brand_description,
-                b.origin_country 
-            FROM product p 
-            JOIN brand b ON p.brand_id = b.brand_id
-            WHERE p.product_id = %s;
-        """
-        cursor.execute(query, (product_id,))
-        results = cursor.fetchall()
-        return results
-    except Exception as e:
-        cnx.rollback()  
-        print(f"[ERROR] Failed to execute query: {e}")
-        return []
-    finally:
-        cursor.close()
+def get_catalog_rows(product_ids=None, brand_id=None):
+    """
+    Full product + brand + category rows for the in-memory catalog cache.
+    Loads the whole catalog, or only the given product ids / brand.
+    """
+    with get_connection() as cnx:
+        cursor = cnx.cursor(cursor_factory=RealDictCursor)
+        try:
+            query = """
+                SELECT 
+                    p.product_id,
+                    p.product_name,
+                    p.description AS product_description,
+                    p.price,
+                    p.specifications,
+                    p.stock_quantity,
+                    b.brand_id,
+                    b.brand_name,
+                    b.description AS brand_description,
+                    b.origin_country,
+                    pc.category_id,
+                    pc.category_name
+                FROM product p 
+                JOIN brand b ON p.brand_id = b.brand_id
+                LEFT JOIN product_category pc ON p.category_id = pc.category_id
+            """
+            params = ()
+            if product_ids is not None:
+                query += " WHERE p.product_id = ANY(%s)"
+                params = (list(product_ids),)
+            elif brand_id is not None:
+                query += " WHERE b.brand_id = %s"
+                params = (brand_id,)
+            cursor.execute(query, params)
+            return cursor.fetchall()
+        finally:
+            cursor.close()
 
 def get_list_products_by_name(product_name):
-    cursor = cnx.cursor()
-    try:
-        query = """
-            SELECT 
-                p.product_name, 
-                p.description AS product_description,
-                p.price, 
-                p.specifications, 
-                b.brand_name, 
-                p.stock_quantity,
-                b.description AS brand_description,
-                b.origin_country 
-            FROM product p 
-            JOIN brand b ON p.brand_id = b.brand_id
-            WHERE p.product_id = %s;
-        """
-        cursor.execute(query, (product_name,))
-        results = cursor.fetchall()
-        return results
-    except Exception as e:
-        cnx.rollback()  
-        print(f"[ERROR] Failed to execute query: {e}")
-        return []
-    finally:
-        cursor.close()
+    with get_connection() as cnx:
+        cursor = cnx.cursor()
+        try:
+            query = """
+                SELECT 
+                    p.product_name, 
+                    p.description AS product_description,
+                    p.price, 
+                    p.specifications, 
+                    b.brand_name, 
+                    p.stock_quantity,
+                    b.description AS brand_description,
+                    b.origin_country 
+                FROM product p 
+                JOIN brand b ON p.brand_id = b.brand_id
+                WHERE p.product_id = %s;
+            """
+            cursor.execute(query, (product_name,))
+            results = cursor.fetchall()
+            return results
+        except Exception as e:
+            cnx.rollback()  
+            print(f"[ERROR] Failed to execute query: {e}")
+            return []
+        finally:
+            cursor.close()
 
 
-def get_product_cheapest():
-    cursor = cnx.cursor()
-    try:
-        query = """
-            SELECT 
-                p.product_name, 
-                p.description AS product_description,
-                p.price, 
-                p.specifications, 
-                b.brand_name, 
-                b.description AS brand_description,
-                b.origin_country 
-            FROM product p 
-            JOIN brand b ON p.brand_id = b.brand_id
-            ORDER BY p.price ASC LIMIT 1;
-        """
-        cursor.execute(query)
-        result = cursor.fetchone()
-        return result
-    except Exception as e:
-        print(f"[ERROR] Failed to execute query: {e}")
-        return None
-    finally:
-        cursor.close()
+def get_cheapest_products(brand_name=None, category_name=None, limit=1):
+    """In-stock products, cheapest first, optionally within one brand and/or category (migration 007 indexes)"""
+    with get_connection() as cnx:
+        cursor = cnx.cursor()
+        try:
+            query = """
+                SELECT 
+                    p.product_name, 
+                    p.description AS product_description,
+                    p.price, 
+                    p.specifications, 
+                    b.brand_name, 
+                    b.description AS brand_description,
+                    b.origin_country 
+                FROM product p 
+                JOIN brand b ON p.brand_id = b.brand_id
+                LEFT JOIN product_category pc ON p.category_id = pc.category_id
+                WHERE p.stock_quantity > 0
+            """
+            params = []
+            if brand_name:
+                query += " AND b.brand_name = %s"
+                params.append(brand_name)
+            if category_name:
+                query += " AND pc.category_name = %s"
+                params.append(category_name)
+            query += " ORDER BY p.price ASC, p.product_id LIMIT %s;"
+            params.append(limit)
+            cursor.execute(query, params)
+            return cursor.fetchall()
+        except Exception as e:
+            print(f"[ERROR] Failed to execute query: {e}")
+            return []
+        finally:
+            cursor.close()
 
 def get_products_by_name(product_name):
-    cursor = cnx.cursor()
-    try:
-        query = """
-            SELECT 
-                p.product_id,
-                p.product_name, 
-                p.description AS product_description,
-                p.price, 
-                p.specifications, 
-                b.brand_name, 
-                b.origin_country, 
-                p.stock_quantity
-            FROM product p 
-            JOIN brand b ON p.brand_id = b.brand_id
-            WHERE p.product_name = %s;
-        """
-        cursor.execute(query, (product_name,))
-        return cursor.fetchall()
-    except Exception as e:
-        print(f"[ERROR] Failed to query products by name: {e}")
-        return None
-    finally:
-        cursor.close()
+    with get_connection() as cnx:
+        cursor = cnx.cursor()
+        try:
+            query = """
+                SELECT 
+                    p.product_id,
+                    p.product_name, 
+                    p.description AS product_description,
+                    p.price, 
+                    p.specifications, 
+                    b.brand_name, 
+                    b.origin_country, 
+                    p.stock_quantity
+                FROM product p 
+                JOIN brand b ON p.brand_id = b.brand_id
+                WHERE p.product_name = %s;
+            """
+            cursor.execute(query, (product_name,))
+            return cursor.fetchall()
+        except Exception as e:
+            print(f"[ERROR] Failed to query products by name: {e}")
+            return None
+        finally:
+            cursor.close()
 
 def get_valid_promotions(min_order: float):
-    cursor = cnx.cursor()
-    try:
-        query = """
-            SELECT 
-                coupon_code, 
-                description, 
-                minimum_order
-            FROM promotion
-            WHERE minimum_order <= %s AND status = 'active'
-        """
-        cursor.execute(query, (min_order,))
-        results = cursor.fetchall()
-        return [
-            {
-                "coupon_code": row[0],
-                "description": row[1],
-                "minimum_order": row[2]
-            }
-            for row in results
-        ]
-    except Exception as e:
-        print(f"[ERROR] Failed to get promotions: {e}")
-        return []
-    finally:
-        cursor.close()
+    with get_connection() as cnx:
+        cursor = cnx.cursor()
+        try:
+            query = """
+                SELECT 
+                    coupon_code, 
+                    description, 
+                    minimum_order
+                FROM promotion
+                WHERE minimum_order <= %s AND status = 'active'
+            """
+            cursor.execute(query, (min_order,))
+            results = cursor.fetchall()
+            return [
+                {
+                    "coupon_code": row[0],
+                    "description": row[1],
+                    "minimum_order": row[2]
+                }
+                for row in results
+            ]
+        except Exception as e:
+            print(f"[ERROR] Failed to get promotions: {e}")
+            return []
+        finally:
+            cursor.close()
 
 def get_promotion_by_code(coupon_code: str):
-    cursor = cnx.cursor()
-    try:
-        query = """
-            SELECT Promotion_ID, coupon_code, discount_value
-            FROM promotion
-            WHERE coupon_code = %s
-        """
-        cursor.execute(query, (coupon_code,))
-        result = cursor.fetchone()
-        return result  # (promotion_id, coupon_code, discount_value)
-    except Exception as e:
-        print(f"[ERROR] get_promotion_by_code failed: {e}")
-        return None
-    finally:
-        cursor.close()
+    with get_connection() as cnx:
+        cursor = cnx.cursor()
+        try:
+            query = """
+                SELECT Promotion_ID, coupon_code, discount_value
+                FROM promotion
+                WHERE coupon_code = %s
+            """
+            cursor.execute(query, (coupon_code,))
+            result = cursor.fetchone()
+            return result  # (promotion_id, coupon_code, discount_value)
+        except Exception as e:
+            print(f"[ERROR] get_promotion_by_code failed: {e}")
+            return None
+        finally:
+            cursor.close()
+
+def build_customer_by_email_or_phone_query(email: str, phone: str):
+    """(query, params) shared with async_db_helper.get_customer_by_email_or_phone"""
+    query = """
+        SELECT customer_id FROM customer
+        WHERE email = %s OR phone = %s
+    """
+    return query, (email, phone)
 
 def get_customer_by_email_or_phone(email: str, phone: str):
-    cursor = cnx.cursor()
-    try:
-        query = """
-            SELECT customer_id FROM customer
-            WHERE email = %s OR phone = %s
-        """
-        cursor.execute(query, (email, phone))
-        result = cursor.fetchone()
-        return result
-    except Exception as e:
-        print(f"[ERROR] Failed to get customer by email or phone: {e}")
-        return None
-    finally:
-        cursor.close()
+    with get_connection() as cnx:
+        cursor = cnx.cursor()
+        try:
+            cursor.execute(*build_customer_by_email_or_phone_query(email, phone))
+            result = cursor.fetchone()
+            return result
+        except Exception as e:
+            print(f"[ERROR] Failed to get customer by email or phone: {e}")
+            return None
+        finally:
+            cursor.close()
+
+def build_customer_info_query(customer_id: int):
+    """(query, params) shared with async_db_helper.get_customer_info"""
+    query = """
+        SELECT name, email, phone
+        FROM customer
+        WHERE customer_id = %s
+    """
+    return query, (customer_id,)
 
 def get_customer_info(customer_id: int):
-    cursor = cnx.cursor()
-    try:
-        query = """
-            SELECT name, email, phone
-            FROM customer
-            WHERE customer_id = %s
-        """
-        cursor.execute(query, (customer_id,))
-        result = cursor.fetchone()
-        return result
-    except Exception as e:
-        print(f"[ERROR] Failed to get customer info: {e}")
-        return None
-    finally:
-        cursor.close()
+    with get_connection() as cnx:
+        cursor = cnx.cursor()
+        try:
+            cursor.execute(*build_customer_info_query(customer_id))
+            result = cursor.fetchone()
+            return result
+        except Exception as e:
+            print(f"[ERROR] Failed to get customer info: {e}")
+            return None
+        finally:
+            cursor.close()
 
 def get_default_address_by_customer(customer_id: int):
-    cursor = cnx.cursor()
-    try:
-        query = """
-            SELECT address_id, receiver_name, receiver_phone, country, city, province_state, postal_code
-            FROM shipping_address
-            WHERE customer_id = %s AND is_default = TRUE
-        """
-        cursor.execute(query, (customer_id,))
-        result = cursor.fetchone()
-        return result
-    except Exception as e:
-        print(f"[ERROR] Failed to get default address: {e}")
-        return None
-    finally:
-        cursor.close()
+    with get_connection() as cnx:
+        cursor = cnx.cursor()
+        try:
+            query = """
+                SELECT address_id, receiver_name, receiver_phone, country, city, province_state, postal_code
+                FROM shipping_address
+                WHERE customer_id = %s AND is_default = TRUE
+            """
+            cursor.execute(query, (customer_id,))
+            result = cursor.fetchone()
+            return result
+        except Exception as e:
+            print(f"[ERROR] Failed to get default address: {e}")
+            return None
+        finally:
+            cursor.close()
 
 def get_shipping_methods():
-    cursor = cnx.cursor()
-    try:
-        query = """
-            SELECT shipping_method_id, method_name, cost_per_product, average_delivery_time_per_km
-            FROM shipping_method
-        """
-        cursor.execute(query)
-        results = cursor.fetchall()
-        return [
-            {
-                "method_id": row[0],
-                "method_name": row[1],
-                "cost_per_product": float(row[2]),
-                "average_delivery_time_per_km": float(row[3])
-            }
-            for row in results
-        ]
-    except Exception as e:
-        print(f"[ERROR] Failed to get shipping methods: {e}")
-        return []
-    finally:
-        cursor.close()
+    with get_connection() as cnx:
+        cursor = cnx.cursor()
+        try:
+            query = """
+                SELECT shipping_method_id, method_name, cost_per_product, average_delivery_time_per_km
+                FROM shipping_method
+            """
+            cursor.execute(query)
+            results = cursor.fetchall()
+            return [
+                {
+                    "method_id": row[0],
+                    "method_name": row[1],
+                    "cost_per_product": float(row[2]),
+                    "average_delivery_time_per_km": float(row[3])
+                }
+                for row in results
+            ]
+        except Exception as e:
+            print(f"[ERROR] Failed to get shipping methods: {e}")
+            return []
+        finally:
+            cursor.close()
+
+def get_brands():
+    with get_connection() as cnx:
+        cursor = cnx.cursor()
+        try:
+            query = """
+                SELECT brand_id, brand_name, description, origin_country
+                FROM brand
+            """
+            cursor.execute(query)
+            results = cursor.fetchall()
+            return [
+                {
+                    "brand_id": row[0],
+                    "brand_name": row[1],
+                    "description": row[2],
+                    "origin_country": row[3]
+                }
+                for row in results
+            ]
+        except Exception as e:
+            print(f"[ERROR] Failed to get brands: {e}")
+            return []
+        finally:
+            cursor.close()
 
 def save_new_shipping_address(customer_id, receiver_name, receiver_phone, country, city, province_state, postal_code, is_default):
-    cursor = cnx.cursor()
-    try:
-        query = """
-            INSERT INTO shipping_address (customer_id, receiver_name, receiver_phone, country, city, province_state, postal_code, is_default)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-            RETURNING address_id
-        """
-        cursor.execute(query, (customer_id, receiver_name, receiver_phone, country, city, province_state, postal_code, is_default))
-        new_address_id = cursor.fetchone()[0]
-        cnx.commit()
-        return new_address_id
-    except Exception as e:
-        cnx.rollback()
-        print(f"[ERROR] Failed to save new shipping address: {e}")
-        return None
-    finally:
-        cursor.close()
+    with get_connection() as cnx:
+        cursor = cnx.cursor()
+        try:
+            query = """
+                INSERT INTO shipping_address (customer_id, receiver_name, receiver_phone, country, city, province_state, postal_code, is_default)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+                RETURNING address_id
+            """
+            cursor.execute(query, (customer_id, receiver_name, receiver_phone, country, city, province_state, postal_code, is_default))
+            new_address_id = cursor.fetchone()[0]
+            cnx.commit()
+            return new_address_id
+        except Exception as e:
+            cnx.rollback()
+            print(f"[ERROR] Failed to save new shipping address: {e}")
+            return None
+        finally:
+            cursor.close()
 
 def get_payment_methods():
-    cursor = cnx.cursor()
-    try:
-        query = """
-            SELECT Payment_Method_ID, Method_Name, Description
-            FROM Payment_Method
-        """
-        cursor.execute(query)
-        results = cursor.fetchall()
-        return [
-            {
-                "method_id": row[0],
-                "method_name": row[1],
-                "description": row[2]
-            }
-            for row in results
-        ]
-    except Exception as e:
-        print(f"[ERROR] Failed to get payment methods: {e}")
-        return []
-    finally:
-        cursor.close()
+    with get_connection() as cnx:
+        cursor = cnx.cursor()
+        try:
+            query = """
+                SELECT Payment_Method_ID, Method_Name, Description
+                FROM Payment_Method
+            """
+            cursor.execute(query)
+            results = cursor.fetchall()
+            return [
+                {
+                    "method_id": row[0],
+                    "method_name": row[1],
+                    "description": row[2]
+                }
+                for row in results
+            ]
+        except Exception as e:
+            print(f"[ERROR] Failed to get payment methods: {e}")
+            return []
+        finally:
+            cursor.close()
 
-def place_order(order_details: dict, session_id: str):
-    cursor = cnx.cursor()
-    try:
-        # Lưu vào bảng Order
-        query = """
-            INSERT INTO "Order" (
-                Customer_ID, Payment_Method_ID, Shipping_Method_ID, Shipping_Address_ID,
-                Promotion_ID, Total_Amount, Shipping_Fee, Discount,
-                Estimated_Delivery_Date, Payment_Status, Order_Status, Note
+# Carts larger than this are streamed into Order_Item with COPY instead of unnest()
+ORDER_ITEM_COPY_THRESHOLD = 1000
+
+def insert_order_with_items(cursor, order_details: dict, session_id: str):
+    """Write the "Order" header and its Order_Item rows on `cursor` without committing; returns Order_ID"""
+    order_list = [(int(product_id), int(quantity)) for product_id, quantity in order_details["order_list"]]
+    order_params = (
+        order_details["customer_id"],
+        order_details["payment_method_id"],
+        order_details["shipping_method_id"],
+        order_details["shipping_address_id"],
+        order_details["promotion_id"],
+        order_details["total_amount"],
+        order_details["shipping_fee"],
+        order_details["discount"],
+        order_details["estimated_delivery_date"],
+        "pending",  # Payment_Status
+        "pending",  # Order_Status
+        f"Order placed via chatbot (session: {session_id})",  # Note
+        order_details.get("idempotency_key")  # see migrations/002_order_idempotency_key.sql
+    )
+    order_insert = """
+        INSERT INTO "Order" (
+            Customer_ID, Payment_Method_ID, Shipping_Method_ID, Shipping_Address_ID,
+            Promotion_ID, Total_Amount, Shipping_Fee, Discount,
+            Estimated_Delivery_Date, Payment_Status, Order_Status, Note, Idempotency_Key
+        )
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+        RETURNING Order_ID
+    """
+
+    if len(order_list) <= ORDER_ITEM_COPY_THRESHOLD:
+        # Header và toàn bộ Order_Item trong một câu lệnh (một round trip)
+        query = f"""
+            WITH new_order AS ({order_insert}),
+            new_items AS (
+                INSERT INTO Order_Item (Order_ID, Product_ID, Quantity)
+                SELECT new_order.Order_ID, item.product_id, item.quantity
+                FROM new_order
+                CROSS JOIN unnest(%s::int[], %s::int[]) AS item(product_id, quantity)
             )
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-            RETURNING Order_ID
+            SELECT Order_ID FROM new_order
         """
-        cursor.execute(query, (
-            order_details["customer_id"],
-            order_details["payment_method_id"],
-            order_details["shipping_method_id"],
-            order_details["shipping_address_id"],
-            order_details["promotion_id"],
-            order_details["total_amount"],
-            order_details["shipping_fee"],
-            order_details["discount"],
-            order_details["estimated_delivery_date"],
-            "pending",  # Payment_Status
-            "pending",  # Order_Status
-            f"Order placed via chatbot (session: {session_id})"  # Note
+        cursor.execute(query, order_params + (
+            [product_id for product_id, _ in order_list],
+            [quantity for _, quantity in order_list],
         ))
-        order_id = cursor.fetchone()[0]
+        return cursor.fetchone()[0]
+
+    # Đơn hàng rất lớn: COPY nhanh hơn một mảng tham số khổng lồ
+    cursor.execute(order_insert, order_params)
+    order_id = cursor.fetchone()[0]
+    buffer = io.StringIO("".join(
+        f"{order_id}\t{product_id}\t{quantity}\n" for product_id, quantity in order_list
+    ))
+    cursor.copy_expert("COPY Order_Item (Order_ID, Product_ID, Quantity) FROM STDIN", buffer)
+    return order_id
+
+def get_order_id_by_idempotency_key(cursor, idempotency_key: str):
+    cursor.execute('SELECT Order_ID FROM "Order" WHERE Idempotency_Key = %s', (idempotency_key,))
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+def place_order(order_details: dict, session_id: str):
+    """
+    Insert the order and return its Order_ID. If order_details carries an
+    "idempotency_key" that was already used, nothing is written and the
+    existing Order_ID is returned.
+    """
+    idempotency_key = order_details.get("idempotency_key")
+    with get_connection() as cnx:
+        cursor = cnx.cursor()
+        try:
+            if idempotency_key:
+                order_id = get_order_id_by_idempotency_key(cursor, idempotency_key)
+                if order_id:
+                    cnx.rollback()
+                    return order_id
+            order_id = insert_order_with_items(cursor, order_details, session_id)
+            cnx.commit()
+            return order_id
+        except psycopg2.errors.UniqueViolation:
+            # A concurrent request (another worker) placed the same order first
+            cnx.rollback()
+            order_id = get_order_id_by_idempotency_key(cursor, idempotency_key) if idempotency_key else None
+            cnx.rollback()
+            return order_id
+        except Exception as e:
+            cnx.rollback()
+            print(f"[ERROR] Failed to place order: {e}")
+            return None
+        finally:
+            cursor.close()
 
-        # Lưu chi tiết order vào bảng Order_Item
-        for product_id, quantity in order_details["order_list"]:
+def get_available_promotions(minimum_order_value: float):
+    with get_connection() as cnx:
+        cursor = cnx.cursor()
+        try:
             query = """
-                INSERT INTO Order_Item (Order_ID, Product_ID, Quantity)
-                VALUES (%s, %s, %s)
+                SELECT Promotion_ID, Coupon_Code, Discount_Value, Minimum_Order
+                FROM Promotion
+                WHERE Status = 'active'
+                AND Minimum_Order <= %s
+                AND (End_Date IS NULL OR End_Date >= CURRENT_DATE)
             """
-            cursor.execute(query, (order_id, product_id, quantity))
+            cursor.execute(query, (minimum_order_value,))
+            results = cursor.fetchall()
+            return results  # (promotion_id, coupon_code, discount_value, minimum_order)
+        except Exception as e:
+            print(f"[ERROR] Failed to get available promotions: {e}")
+            return []
+        finally:
+            cursor.close()
 
-        cnx.commit()
-        return order_id
-    except Exception as e:
-        cnx.rollback()
-        print(f"[ERROR] Failed to place order: {e}")
-        return None
-    finally:
-        cursor.close()
+def customer_orders_condition(customer_id=None, customer_name=None):
+    """(WHERE condition on customer c, parameter) for get_customer_orders, None without a customer"""
+    if customer_id is not None:
+        return "c.customer_id = %s", customer_id
+    if customer_name is not None:
+        # Substring match served by the trigram index of migration 009
+        return "c.name ILIKE %s", f"%{escape_like(customer_name)}%"
+    return None
+
+def build_customer_orders_query(condition, after=None, limit=None):
+    """
+    One page of a customer's orders, newest first, read from order_summary
+    (migration 010: product names already aggregated per order). The matching
+    customers are resolved first (customer_name_trgm_idx), then each one
+    contributes at most one page from order_summary_customer_date_idx
+    (keyset on (order_date, order_id)).
+    """
+    keyset = "AND (s.order_date, s.order_id) < (%s, %s)" if after is not None else ""
+    page_limit = "LIMIT %s" if limit is not None else ""
+    return f"""
+        WITH customers AS MATERIALIZED (
+            SELECT c.customer_id
+            FROM customer c
+            WHERE {condition}
+        )
+        SELECT 
+            s.order_id,
+            s.product_names,
+            s.total_amount,
+            s.payment_method,
+            s.order_status,
+            s.order_date
+        FROM customers
+        CROSS JOIN LATERAL (
+            SELECT s.order_id, s.product_names, s.total_amount, s.payment_method, s.order_status, s.order_date
+            FROM order_summary s
+            WHERE s.customer_id = customers.customer_id
+              {keyset}
+            ORDER BY s.order_date DESC, s.order_id DESC
+            {page_limit}
+        ) s
+        ORDER BY s.order_date DESC, s.order_id DESC
+        {page_limit};
+    """
 
-def get_available_promotions(minimum_order_value: float):
-    cursor = cnx.cursor()
-    try:
-        query = """
-            SELECT Promotion_ID, Coupon_Code, Discount_Value, Minimum_Order
-            FROM Promotion
-            WHERE Status = 'active'
-            AND Minimum_Order <= %s
-            AND (End_Date IS NULL OR End_Date >= CURRENT_DATE)
-        """
-        cursor.execute(query, (minimum_order_value,))
-        results = cursor.fetchall()
-        return results  # (promotion_id, coupon_code, discount_value, minimum_order)
-    except Exception as e:
-        print(f"[ERROR] Failed to get available promotions: {e}")
-        return []
-    finally:
-        cursor.close()
+def build_customer_orders_params(param, after=None, limit=None):
+    params = [param]
+    if after is not None:
+        params.extend(after)  # (order_date, order_id) of the last order on the previous page
+    if limit is not None:
+        params.extend([limit, limit])  # per customer, then for the whole page
+    return params
 
-def get_customer_orders(customer_id=None, customer_name=None):
-    if not cnx:
-        init_db_connection()
-        if not cnx:
-            return []
+def get_customer_orders(customer_id=None, customer_name=None, limit=None, after=None):
+    """
+    Orders of a customer (by id, or by name substring), newest first.
+    limit/after page through them: `after` is the (order_date, order_id) of the last row already seen.
+    """
+    customer = customer_orders_condition(customer_id, customer_name)
+    if customer is None:
+        return []
+    condition, param = customer
 
     try:
-        cursor = cnx.cursor(cursor_factory=RealDictCursor)
-
-        if customer_id is not None:
-            query = """
-                SELECT 
-                    o.order_id,
-                    STRING_AGG(p.product_name, ', ') AS Product_Names,
-                    o.total_amount,
-                    pm.method_name AS Payment_Method,
-                    o.order_status,
-                    o.order_date
-                FROM "Order" o
-                JOIN order_item oi ON o.order_id = oi.order_id
-                JOIN product p ON oi.product_id = p.product_id
-                JOIN payment_method pm ON o.payment_method_id = pm.payment_method_id
-                JOIN customer c ON o.customer_id = c.customer_id
-                WHERE c.customer_id = %s
-                GROUP BY o.order_id, o.total_amount, pm.method_name, o.order_status, o.order_date
-                ORDER BY o.order_date DESC;
-            """
-            cursor.execute(query, (customer_id,))
-            orders = cursor.fetchall()
-                    
-        elif customer_name is not None:
-            query = """
-                SELECT 
-                    o.order_id,
-                    STRING_AGG(p.product_name, ', ') AS Product_Names,
-                    o.total_amount,
-                    pm.method_name AS Payment_Method,
-                    o.order_status,
-                    o.order_date
-                FROM "Order" o
-                JOIN order_item oi ON o.order_id = oi.order_id
-                JOIN product p ON oi.product_id = p.product_id
-                JOIN payment_method pm ON o.payment_method_id = pm.payment_method_id
-                JOIN customer c ON o.customer_id = c.customer_id
-                WHERE c.name ILIKE %s
-                GROUP BY o.order_id, o.total_amount, pm.method_name, o.order_status, o.order_date
-                ORDER BY o.order_date DESC;
-            """
-            cursor.execute(query, (f"%{customer_name}%",))
+        with get_connection() as cnx:
+            cursor = cnx.cursor(cursor_factory=RealDictCursor)
+            cursor.execute(
+                build_customer_orders_query(condition, after, limit),
+                build_customer_orders_params(param, after, limit)
+            )
             orders = cursor.fetchall()
-        else:
             cursor.close()
-            return []
-        
-        cursor.close()
-        return orders
+            return orders
 
     except Exception as e:
         print(f"An error occurred in get_customer_orders: {e}")
@@ -473,53 +753,45 @@ def delete_order(order_id):
     Delete a specific order by Order_ID if its status is 'Processing'.
     Returns True if successful, False if the order doesn't exist or status is not 'Processing'.
     """
-    cursor = None
     try:
-        if not cnx:
-            init_db_connection()
-        
-        if not cnx:
-            return False
-        
-        cursor = cnx.cursor()
-        
-        debug_query = """
-            SELECT order_id, order_status FROM "Order" 
-            WHERE order_id = %s
-        """
-        cursor.execute(debug_query, (order_id,))
-        debug_result = cursor.fetchone()
-        
-        if debug_result:
-            
-            # Check if the order has status 'Processing'
-            if debug_result[1] != 'Processing':
-                return False
-        else:
-            return False
-        
-        
-        delete_items_query = 'DELETE FROM "order_item" WHERE order_id = %s'
-        cursor.execute(delete_items_query, (order_id,))
-        items_deleted = cursor.rowcount
-        
-        delete_order_query = 'DELETE FROM "Order" WHERE order_id = %s'
-        cursor.execute(delete_order_query, (order_id,))
-        orders_deleted = cursor.rowcount
-        
-        if orders_deleted > 0:
-            cnx.commit()
-            return True
-        else:
-            return False
-            
+        with get_connection() as cnx:
+            cursor = cnx.cursor()
+            try:
+                debug_query = """
+                    SELECT order_id, order_status FROM "Order" 
+                    WHERE order_id = %s
+                """
+                cursor.execute(debug_query, (order_id,))
+                debug_result = cursor.fetchone()
+
+                if debug_result:
+
+                    # Check if the order has status 'Processing'
+                    if debug_result[1] != 'Processing':
+                        return False
+                else:
+                    return False
+
+
+                delete_items_query = 'DELETE FROM "order_item" WHERE order_id = %s'
+                cursor.execute(delete_items_query, (order_id,))
+                items_deleted = cursor.rowcount
+
+                delete_order_query = 'DELETE FROM "Order" WHERE order_id = %s'
+                cursor.execute(delete_order_query, (order_id,))
+                orders_deleted = cursor.rowcount
+
+                if orders_deleted > 0:
+                    cnx.commit()
+                    return True
+                else:
+                    return False
+            finally:
+                cursor.close()
+
     except Exception as err:
-        if cnx:
-            cnx.rollback()
+        # The pooled connection has already been rolled back on the way out
         return False
-    finally:
-        if cursor:
-            cursor.close()
 
 def update_shipping_address(order_id, customer_id, receiver_name, receiver_phone, country, city, province_state, postal_code):
     """
@@ -529,218 +801,307 @@ def update_shipping_address(order_id, customer_id, receiver_name, receiver_phone
     - False: if order doesn't exist, doesn't belong to customer, or status is not 'Processing'
     - None: if database error occurred
     """
-    if not cnx:
-        init_db_connection()
-        if not cnx:
-            return None
-
-    cursor = None  
     try:
-        # Debug info
-        print(f"Attempting to update shipping address for Order ID: {order_id}, Customer ID: {customer_id}")
+        with get_connection() as cnx:
+            cursor = None  
+            try:
+                # Debug info
+                print(f"Attempting to update shipping address for Order ID: {order_id}, Customer ID: {customer_id}")
         
-        cursor = cnx.cursor()
+                cursor = cnx.cursor()
         
-        # 1. First check order status and ownership
-        status_check_query = """
-            SELECT order_status FROM "Order"
-            WHERE order_id = %s AND customer_id = %s
-        """
-        cursor.execute(status_check_query, (order_id, customer_id))
-        result = cursor.fetchone()
+                # 1. First check order status and ownership
+                status_check_query = """
+                    SELECT order_status FROM "Order"
+                    WHERE order_id = %s AND customer_id = %s
+                """
+                cursor.execute(status_check_query, (order_id, customer_id))
+                result = cursor.fetchone()
         
-        # Case 1: Order doesn't exist or doesn't belong to customer
-        if not result:
-            print(f"Order {order_id} not found or doesn't belong to customer {customer_id}")
-            return False
+                # Case 1: Order doesn't exist or doesn't belong to customer
+                if not result:
+                    print(f"Order {order_id} not found or doesn't belong to customer {customer_id}")
+                    return False
             
-        current_status = result[0]
+                current_status = result[0]
         
-        # Case 2: Order status is not 'Processing'
-        if current_status.lower() != 'processing':
-            print(f"Order {order_id} status is '{current_status}' - cannot update address")
-            return False
+                # Case 2: Order status is not 'Processing'
+                if current_status.lower() != 'processing':
+                    print(f"Order {order_id} status is '{current_status}' - cannot update address")
+                    return False
             
-        # 2. Insert new shipping address
-        insert_address_query = """
-            INSERT INTO "shipping_address" 
-            (customer_id, receiver_name, receiver_phone, country, city, province_state, postal_code)
-            VALUES (%s, %s, %s, %s, %s, %s, %s)
-            RETURNING address_id
-        """
-        cursor.execute(insert_address_query, 
-                      (customer_id, receiver_name, receiver_phone, 
-                       country, city, province_state, postal_code))
+                # 2. Insert new shipping address
+                insert_address_query = """
+                    INSERT INTO "shipping_address" 
+                    (customer_id, receiver_name, receiver_phone, country, city, province_state, postal_code)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s)
+                    RETURNING address_id
+                """
+                cursor.execute(insert_address_query, 
+                              (customer_id, receiver_name, receiver_phone, 
+                               country, city, province_state, postal_code))
         
-        new_address_id = cursor.fetchone()[0]
+                new_address_id = cursor.fetchone()[0]
 
-        # 3. Update order with new address
-        update_order_query = """
-            UPDATE "Order"
-            SET shipping_address_id = %s
-            WHERE order_id = %s
-        """
-        cursor.execute(update_order_query, (new_address_id, order_id))
+                # 3. Update order with new address
+                update_order_query = """
+                    UPDATE "Order"
+                    SET shipping_address_id = %s
+                    WHERE order_id = %s
+                """
+                cursor.execute(update_order_query, (new_address_id, order_id))
         
-        cnx.commit()
-        print(f"Successfully updated shipping address for Order {order_id}")
-        return True
+                cnx.commit()
+                print(f"Successfully updated shipping address for Order {order_id}")
+                return True
         
-    except Error as err:
-        print(f"Database error updating order {order_id}: {err}")
-        if cnx:
-            cnx.rollback()
-        return None
-    except Exception as e:
-        print(f"Unexpected error: {e}")
-        if cnx:
-            cnx.rollback()
+            except Error as err:
+                print(f"Database error updating order {order_id}: {err}")
+                if cnx:
+                    cnx.rollback()
+                return None
+            except Exception as e:
+                print(f"Unexpected error: {e}")
+                if cnx:
+                    cnx.rollback()
+                return None
+            finally:
+                if cursor:
+                    cursor.close()
+
+    except (psycopg2.OperationalError, PoolTimeoutError) as e:
+        print(f"Database unavailable while updating order {order_id}: {e}")
         return None
-    finally:
-        if cursor:
-            cursor.close()
-            
+
 def insert_order_item(product_name, quantity, order_id):
-    try:
-        cursor = cnx.cursor()
+    with get_connection() as cnx:
+        try:
+            cursor = cnx.cursor()
 
-        # Find Product_ID based on Product_Name
-        cursor.execute("SELECT product_id, price FROM product WHERE product_name = %s", (product_name,))
-        result = cursor.fetchone()
-        if not result:
-            print(f"Product {product_name} not found.")
-            return -1
+            # Find Product_ID based on Product_Name
+            cursor.execute("SELECT product_id, price FROM product WHERE product_name = %s", (product_name,))
+            result = cursor.fetchone()
+            if not result:
+                print(f"Product {product_name} not found.")
+                return -1
 
-        product_id, price = result
+            product_id, price = result
 
-        # Insert into Order_Item
-        cursor.execute(
-            "INSERT INTO Order_Item (Order_ID, Product_ID, Quantity) VALUES (%s, %s, %s)",
-            (order_id, product_id, quantity)
-        )
+            # Insert into Order_Item
+            cursor.execute(
+                "INSERT INTO Order_Item (Order_ID, Product_ID, Quantity) VALUES (%s, %s, %s)",
+                (order_id, product_id, quantity)
+            )
 
-        # Update Total_Amount in Order
-        total_amount = quantity * price
-        cursor.execute(
-            "UPDATE `Order` SET Total_Amount = Total_Amount + %s WHERE Order_ID = %s",
-            (total_amount, order_id)
-        )
+            # Update Total_Amount in Order
+            total_amount = quantity * price
+            cursor.execute(
+                "UPDATE `Order` SET Total_Amount = Total_Amount + %s WHERE Order_ID = %s",
+                (total_amount, order_id)
+            )
 
-        cnx.commit()
-        cursor.close()
+            cnx.commit()
+            cursor.close()
 
-        print(f"Inserted {quantity} of {product_name} into order {order_id}.")
-        return 1
+            print(f"Inserted {quantity} of {product_name} into order {order_id}.")
+            return 1
 
-    except mysql.connector.Error as err:
-        print(f"Error inserting order item: {err}")
-        cnx.rollback()
-        return -1
+        except mysql.connector.Error as err:
+            print(f"Error inserting order item: {err}")
+            cnx.rollback()
+            return -1
 
 def insert_order(customer_id, shipping_method_id, shipping_address_id, promotion_id):
-    try:
-        cursor = cnx.cursor()
-
-        # Calculate Shipping_Fee (based on Shipping_Method)
-        cursor.execute(
-            "SELECT Cost_per_product FROM Shipping_Method WHERE Shipping_Method_ID = %s",
-            (shipping_method_id,)
-        )
-        shipping_fee = cursor.fetchone()[0]
+    with get_connection() as cnx:
+        try:
+            cursor = cnx.cursor()
 
-        # Apply Promotion (if any)
-        discount = 0
-        if promotion_id:
+            # Calculate Shipping_Fee (based on Shipping_Method)
             cursor.execute(
-                "SELECT Discount_Type, Discount_Value, Minimum_Order FROM Promotion WHERE Promotion_ID = %s",
-                (promotion_id,)
+                "SELECT Cost_per_product FROM Shipping_Method WHERE Shipping_Method_ID = %s",
+                (shipping_method_id,)
             )
-            promo = cursor.fetchone()
-            if promo:
-                discount_type, discount_value, min_order = promo
-                if discount_type == 'percentage':
-                    discount = discount_value  # Will be applied as percentage later
-                else:
-                    discount = discount_value
+            shipping_fee = cursor.fetchone()[0]
 
-        # Insert new Order
-        cursor.execute(
-            """
-            INSERT INTO `Order` (Customer_ID, Payment_Method_ID, Shipping_Method_ID, Shipping_Address_ID, Promotion_ID,
-            Order_Date, Total_Amount, Shipping_Fee, Discount, Payment_Status, Order_Status, Estimated_Delivery_Date)
-            VALUES (%s, %s, %s, %s, %s, NOW(), 0.00, %s, %s, 'pending', 'Pending', DATE_ADD(NOW(), INTERVAL 3 DAY))
-            """,
-            (customer_id, 1, shipping_method_id, shipping_address_id, promotion_id, shipping_fee, discount)
-        )
+            # Apply Promotion (if any)
+            discount = 0
+            if promotion_id:
+                cursor.execute(
+                    "SELECT Discount_Type, Discount_Value, Minimum_Order FROM Promotion WHERE Promotion_ID = %s",
+                    (promotion_id,)
+                )
+                promo = cursor.fetchone()
+                if promo:
+                    discount_type, discount_value, min_order = promo
+                    if discount_type == 'percentage':
+                        discount = discount_value  # Will be applied as percentage later
+                    else:
+                        discount = discount_value
 
-        order_id = cursor.lastrowid
-        cnx.commit()
-        cursor.close()
+            # Insert new Order
+            cursor.execute(
+                """
+                INSERT INTO `Order` (Customer_ID, Payment_Method_ID, Shipping_Method_ID, Shipping_Address_ID, Promotion_ID,
+                Order_Date, Total_Amount, Shipping_Fee, Discount, Payment_Status, Order_Status, Estimated_Delivery_Date)
+                VALUES (%s, %s, %s, %s, %s, NOW(), 0.00, %s, %s, 'pending', 'Pending', DATE_ADD(NOW(), INTERVAL 3 DAY))
+                """,
+                (customer_id, 1, shipping_method_id, shipping_address_id, promotion_id, shipping_fee, discount)
+            )
+
+            order_id = cursor.lastrowid
+            cnx.commit()
+            cursor.close()
 
-        return order_id
+            return order_id
 
-    except mysql.connector.Error as err:
-        print(f"Error inserting order: {err}")
-        cnx.rollback()
-        return -1
+        except mysql.connector.Error as err:
+            print(f"Error inserting order: {err}")
+            cnx.rollback()
+            return -1
 
 def insert_order_tracking(order_id, status):
-    cursor = cnx.cursor()
-    cursor.execute(
-        "INSERT INTO order_tracking (order_id, status) VALUES (%s, %s)",
-        (order_id, status)
-    )
-    cursor.execute(
-        "UPDATE `Order` SET Order_Status = %s WHERE Order_ID = %s",
-        (status, order_id)
-    )
-    cnx.commit()
-    cursor.close()
+    with get_connection() as cnx:
+        cursor = cnx.cursor()
+        cursor.execute(
+            "INSERT INTO order_tracking (order_id, status) VALUES (%s, %s)",
+            (order_id, status)
+        )
+        cursor.execute(
+            "UPDATE `Order` SET Order_Status = %s WHERE Order_ID = %s",
+            (status, order_id)
+        )
+        cnx.commit()
+        cursor.close()
 
 def get_total_order_price(order_id):
-    cursor = cnx.cursor()
-    cursor.execute(
-        "SELECT Total_Amount, Shipping_Fee, Discount, Promotion_ID FROM `Order` WHERE Order_ID = %s",
-        (order_id,)
-    )
-    result = cursor.fetchone()
-    if result:
-        total_amount, shipping_fee, discount, promotion_id = result
-        if promotion_id:
-            cursor.execute(
-                "SELECT Discount_Type, Discount_Value FROM Promotion WHERE Promotion_ID = %s",
-                (promotion_id,)
-            )
-            promo = cursor.fetchone()
-            if promo and promo[0] == 'percentage':
-                discount = (total_amount * promo[1]) / 100
-        final_amount = total_amount + shipping_fee - discount
+    with get_connection() as cnx:
+        cursor = cnx.cursor()
+        cursor.execute(
+            "SELECT Total_Amount, Shipping_Fee, Discount, Promotion_ID FROM `Order` WHERE Order_ID = %s",
+            (order_id,)
+        )
+        result = cursor.fetchone()
+        if result:
+            total_amount, shipping_fee, discount, promotion_id = result
+            if promotion_id:
+                cursor.execute(
+                    "SELECT Discount_Type, Discount_Value FROM Promotion WHERE Promotion_ID = %s",
+                    (promotion_id,)
+                )
+                promo = cursor.fetchone()
+                if promo and promo[0] == 'percentage':
+                    discount = (total_amount * promo[1]) / 100
+            final_amount = total_amount + shipping_fee - discount
+            cursor.close()
+            return final_amount
         cursor.close()
-        return final_amount
-    cursor.close()
-    return 0
+        return 0
 
 def get_next_order_id():
-    cursor = cnx.cursor()
-    cursor.execute("SELECT MAX(Order_ID) FROM `Order`")
-    result = cursor.fetchone()[0]
-    cursor.close()
-    return (result + 1) if result else 1
+    with get_connection() as cnx:
+        cursor = cnx.cursor()
+        cursor.execute("SELECT MAX(Order_ID) FROM `Order`")
+        result = cursor.fetchone()[0]
+        cursor.close()
+        return (result + 1) if result else 1
 
 def get_order_status(order_id):
-    cursor = cnx.cursor()
-    cursor.execute(
-        "SELECT Order_Status FROM `Order` WHERE Order_ID = %s",
-        (order_id,)
-    )
-    result = cursor.fetchone()
-    cursor.close()
-    return result[0] if result else None
+    with get_connection() as cnx:
+        cursor = cnx.cursor()
+        cursor.execute(
+            "SELECT Order_Status FROM `Order` WHERE Order_ID = %s",
+            (order_id,)
+        )
+        result = cursor.fetchone()
+        cursor.close()
+        return result[0] if result else None
 
-def search_products(category=None, brand=None):
-    cursor = cnx.cursor()
-    try:
-        query = """
+def escape_like(text):
+    """Escape LIKE/ILIKE wildcards so user input is matched literally"""
+    return text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+def build_search_products_query(category=None, after=None, limit=None, min_price=None, max_price=None):
+    """
+    Products ordered by product_id; the rating comes from product_rating_summary
+    (migration 005), so it costs one index lookup per row whatever the review volume.
+    Price is filtered as min_price <= price < max_price (either bound optional).
+    Text search goes through build_ranked_search_query (migration 006).
+    """
+    query = """
+        SELECT 
+            p.product_id as id,
+            p.product_name as name,
+            p.description,
+            p.price,
+            pc.category_name as category,
+            p.stock_quantity as stock,
+            COALESCE(rs.rating_avg, 4.5) as rating
+        FROM product p
+        JOIN product_category pc ON p.category_id = pc.category_id
+        LEFT JOIN product_rating_summary rs ON rs.product_id = p.product_id
+        WHERE 1=1
+    """
+    params = []
+
+    if category:
+        query += " AND pc.category_name = %s"
+        params.append(category)
+    if min_price is not None:
+        query += " AND p.price >= %s"
+        params.append(min_price)
+    if max_price is not None:
+        query += " AND p.price < %s"
+        params.append(max_price)
+    if after is not None:
+        query += " AND p.product_id > %s"
+        params.append(after)
+
+    query += " ORDER BY p.product_id"
+    if limit is not None:
+        query += " LIMIT %s"
+        params.append(limit)
+    return query, params
+
+def product_row_to_dict(row):
+    return {
+        "id": row[0],
+        "name": row[1],
+        "description": row[2],
+        "price": row[3],
+        "category": row[4],
+        "stock": row[5],
+        "rating": float(row[6])
+    }
+
+def search_products(category=None, brand=None, limit=None, after=None, min_price=None, max_price=None):
+    """Catalog listing; limit/after page through it by product_id (`after` = last id already seen)"""
+    with get_connection() as cnx:
+        cursor = cnx.cursor()
+        try:
+            query, params = build_search_products_query(category, after, limit, min_price, max_price)
+            cursor.execute(query, params)
+            return [product_row_to_dict(row) for row in cursor.fetchall()]
+        
+        except Exception as e:
+            print(f"Error searching products: {e}")
+            return []
+        finally:
+            cursor.close()
+
+_TSQUERY_WORD = re.compile(r"[^\W_]+")
+
+def build_tsquery(search):
+    """'air max 27' -> 'air:* & max:* & 27:*' (every word, as a prefix); None when there is no word"""
+    words = _TSQUERY_WORD.findall(search.lower()) if search else []
+    return " & ".join(f"{word}:*" for word in words) or None
+
+def build_ranked_search_query(tsquery, category=None, after=None, limit=None, min_price=None, max_price=None):
+    """
+    Full-text search over product.search_vector (migration 006), best match first.
+    Pages are keyed on (rank, product_id): `after` is the (rank, id) of the last row seen.
+    """
+    query = """
+        SELECT * FROM (
             SELECT 
                 p.product_id as id,
                 p.product_name as name,
@@ -748,159 +1109,186 @@ def search_products(category=None, brand=None):
                 p.price,
                 pc.category_name as category,
                 p.stock_quantity as stock,
-                COALESCE(AVG(r.rating), 4.5) as rating
+                COALESCE(rs.rating_avg, 4.5) as rating,
+                ts_rank_cd(p.search_vector, q.query)::float8 as rank
             FROM product p
+            CROSS JOIN to_tsquery('simple', %s) AS q(query)
             JOIN product_category pc ON p.category_id = pc.category_id
-            LEFT JOIN review r ON p.product_id = r.product_id
-            WHERE 1=1
-        """
-        params = []
-        
-        if category:
-            query += " AND pc.category_name = %s"
-            params.append(category)
-        
-        query += " GROUP BY p.product_id, p.product_name, p.description, p.price, pc.category_name, p.stock_quantity"
-        
-        cursor.execute(query, params)
-        results = cursor.fetchall()
-        
-        return [
-            {
-                "id": row[0],
-                "name": row[1],
-                "description": row[2],
-                "price": row[3],
-                "category": row[4],
-                "stock": row[5],
-                "rating": float(row[6])
-            }
-            for row in results
-        ]
-        
-    except Exception as e:
-        print(f"Error searching products: {e}")
-        return []
-    finally:
-        cursor.close()
+            LEFT JOIN product_rating_summary rs ON rs.product_id = p.product_id
+            WHERE p.search_vector @@ q.query
+    """
+    params = [tsquery]
 
-def get_product_details(product_name):
-    cursor = cnx.cursor()
-    cursor.execute(
-        """
-        SELECT p.Product_Name, p.Price, p.Description, p.Specifications, p.Stock_Quantity, b.Brand_Name, pc.Category_Name
-        FROM Product p
-        JOIN Brand b ON p.Brand_ID = b.Brand_ID
-        JOIN Product_Category pc ON p.Category_ID = pc.Category_ID
-        WHERE p.Product_Name = %s
-        """,
-        (product_name,)
-    )
-    result = cursor.fetchone()
-    cursor.close()
-    return result
+    if category:
+        query += " AND pc.category_name = %s"
+        params.append(category)
+    if min_price is not None:
+        query += " AND p.price >= %s"
+        params.append(min_price)
+    if max_price is not None:
+        query += " AND p.price < %s"
+        params.append(max_price)
+    query += "\n        ) ranked"
 
-def get_active_promotions():
-    cursor = cnx.cursor()
-    cursor.execute(
-        """
-        SELECT Coupon_Code, Description, Discount_Type, Discount_Value, Minimum_Order
-        FROM Promotion
-        WHERE Status = 'active' AND Start_Date <= NOW() AND End_Date >= NOW()
-        """
-    )
-    results = cursor.fetchall()
-    cursor.close()
-    return results
+    if after is not None:
+        after_rank, after_id = after
+        query += " WHERE (rank < %s OR (rank = %s AND id > %s))"
+        params.extend([after_rank, after_rank, after_id])
 
-def get_promotion_by_code(coupon_code):
-    cursor = cnx.cursor()
-    cursor.execute(
-        "SELECT Promotion_ID, Discount_Type, Discount_Value FROM Promotion WHERE Coupon_Code = %s",
-        (coupon_code,)
-    )
-    result = cursor.fetchone()
-    cursor.close()
-    return result
+    query += " ORDER BY rank DESC, id"
+    if limit is not None:
+        query += " LIMIT %s"
+        params.append(limit)
+    return query, params
 
-def insert_review(product_name, customer_id, rating, comment):
-    if not product_name:
-        raise ValueError("Product name cannot be None or empty")
-    cursor = cnx.cursor()
-    
-    try:
-        # Lấy Product_ID từ product name
+def ranked_product_row_to_dict(row):
+    product = product_row_to_dict(row)
+    product["rank"] = row[7]
+    return product
+
+def search_products_ranked(search, category=None, limit=None, after=None, min_price=None, max_price=None):
+    """Catalog search box: products matching every word of `search`, most relevant first (dicts carry "rank")"""
+    tsquery = build_tsquery(search)
+    if tsquery is None:
+        return []
+    with get_connection() as cnx:
+        cursor = cnx.cursor()
+        try:
+            query, params = build_ranked_search_query(tsquery, category, after, limit, min_price, max_price)
+            cursor.execute(query, params)
+            return [ranked_product_row_to_dict(row) for row in cursor.fetchall()]
+
+        except Exception as e:
+            print(f"Error searching products: {e}")
+            return []
+        finally:
+            cursor.close()
+
+def get_product_details(product_name):
+    with get_connection() as cnx:
+        cursor = cnx.cursor()
         cursor.execute(
-            "SELECT Product_ID FROM Product WHERE Product_Name = %s",
+            """
+            SELECT p.Product_Name, p.Price, p.Description, p.Specifications, p.Stock_Quantity, b.Brand_Name, pc.Category_Name
+            FROM Product p
+            JOIN Brand b ON p.Brand_ID = b.Brand_ID
+            JOIN Product_Category pc ON p.Category_ID = pc.Category_ID
+            WHERE p.Product_Name = %s
+            """,
             (product_name,)
         )
         result = cursor.fetchone()
-        if not result:
-            raise ValueError(f"Product {product_name} not found in database")
-        product_id = result[0]
-        
-        # Insert review và trả về review_id bằng RETURNING clause (PostgreSQL)
+        cursor.close()
+        return result
+
+def get_active_promotions():
+    with get_connection() as cnx:
+        cursor = cnx.cursor()
         cursor.execute(
             """
-            INSERT INTO Review (Product_ID, Customer_ID, Rating, Comment, Review_Date)
-            VALUES (%s, %s, %s, %s, NOW())
-            RETURNING Review_ID
-            """,
-            (product_id, customer_id, rating, comment)
+            SELECT Coupon_Code, Description, Discount_Type, Discount_Value, Minimum_Order
+            FROM Promotion
+            WHERE Status = 'active' AND Start_Date <= NOW() AND End_Date >= NOW()
+            """
+        )
+        results = cursor.fetchall()
+        cursor.close()
+        return results
+
+def get_promotion_by_code(coupon_code):
+    with get_connection() as cnx:
+        cursor = cnx.cursor()
+        cursor.execute(
+            "SELECT Promotion_ID, Discount_Type, Discount_Value FROM Promotion WHERE Coupon_Code = %s",
+            (coupon_code,)
         )
-        
-        # Lấy review_id từ RETURNING clause
         result = cursor.fetchone()
-        if not result:
-            raise Exception("Failed to retrieve review_id from database")
-        review_id = result[0]
+        cursor.close()
+        return result
+
+def insert_review(product_name, customer_id, rating, comment):
+    with get_connection() as cnx:
+        if not product_name:
+            raise ValueError("Product name cannot be None or empty")
+        cursor = cnx.cursor()
+    
+        try:
+            # Lấy Product_ID từ product name
+            cursor.execute(
+                "SELECT Product_ID FROM Product WHERE Product_Name = %s",
+                (product_name,)
+            )
+            result = cursor.fetchone()
+            if not result:
+                raise ValueError(f"Product {product_name} not found in database")
+            product_id = result[0]
         
-        cnx.commit()
-        return review_id
+            # Insert review và trả về review_id bằng RETURNING clause (PostgreSQL)
+            # product_rating_summary được trigger cập nhật trong cùng transaction
+            cursor.execute(
+                """
+                INSERT INTO Review (Product_ID, Customer_ID, Rating, Comment, Review_Date)
+                VALUES (%s, %s, %s, %s, NOW())
+                RETURNING Review_ID
+                """,
+                (product_id, customer_id, rating, comment)
+            )
         
-    except Exception as e:
-        cnx.rollback()  # Rollback nếu có lỗi
-        raise e
-    finally:
-        cursor.close()
+            # Lấy review_id từ RETURNING clause
+            result = cursor.fetchone()
+            if not result:
+                raise Exception("Failed to retrieve review_id from database")
+            review_id = result[0]
+        
+            cnx.commit()
+            return review_id
+        
+        except Exception as e:
+            cnx.rollback()  # Rollback nếu có lỗi
+            raise e
+        finally:
+            cursor.close()
 
 def get_unreviewed_products(customer_id):
-    try:
-        cursor = cnx.cursor()
-        query = """
-            SELECT DISTINCT p.product_name, p.price, b.brand_Name, pc.category_name
-            FROM product p
-            JOIN order_item oi ON p.product_id = oi.product_id
-            JOIN "Order" o ON oi.order_id = o.order_id
-            JOIN product_category pc ON p.category_id = pc.category_id
-            JOIN brand b ON p.brand_id = b.brand_id
-            LEFT JOIN review r ON p.product_id = r.product_id AND r.customer_id = %s
-            WHERE o.customer_id = %s AND r.review_id IS NULL
-        """
-        cursor.execute(query, (customer_id, customer_id))
-        results = cursor.fetchall()
-        cursor.close()
-        return results
-    except Exception as e:
-        print(f"Database error in get_unreviewed_products: {e}")
-        return []
+    with get_connection() as cnx:
+        try:
+            cursor = cnx.cursor()
+            query = """
+                SELECT DISTINCT p.product_name, p.price, b.brand_Name, pc.category_name
+                FROM product p
+                JOIN order_item oi ON p.product_id = oi.product_id
+                JOIN "Order" o ON oi.order_id = o.order_id
+                JOIN product_category pc ON p.category_id = pc.category_id
+                JOIN brand b ON p.brand_id = b.brand_id
+                LEFT JOIN review r ON p.product_id = r.product_id AND r.customer_id = %s
+                WHERE o.customer_id = %s AND r.review_id IS NULL
+            """
+            cursor.execute(query, (customer_id, customer_id))
+            results = cursor.fetchall()
+            cursor.close()
+            return results
+        except Exception as e:
+            print(f"Database error in get_unreviewed_products: {e}")
+            return []
     
 def delete_review_by_id(review_id):
-    print (f"Attempting to delete review with ID: {review_id}")
-    cursor = cnx.cursor()
+    with get_connection() as cnx:
+        print (f"Attempting to delete review with ID: {review_id}")
+        cursor = cnx.cursor()
     
-    try:
-        cursor.execute(
-            "DELETE FROM review WHERE review_id = %s",
-            (review_id,)
-        )
+        try:
+            cursor.execute(
+                # Trigger review_rating_summary trừ rating này khỏi product_rating_summary
+                "DELETE FROM review WHERE review_id = %s",
+                (review_id,)
+            )
         
-        deleted_count = cursor.rowcount
-        cnx.commit()
-        cursor.close()
+            deleted_count = cursor.rowcount
+            cnx.commit()
+            cursor.close()
         
-        return deleted_count
+            return deleted_count
         
-    except Exception as e:
-        cursor.close()
-        raise e
\ No newline at end of file
+        except Exception as e:
+            cursor.close()
+            raise e
\ No newline at end of file
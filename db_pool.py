@@ -0,0 +1,191 @@
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2 import extensions
+
+
+class PoolTimeoutError(Exception):
+    """Raised when no connection could be checked out before the timeout"""
+
+
+class BoundedConnectionPool:
+    """
+    Thread-safe psycopg2 connection pool with a hard upper bound.
+
+    - minconn connections are opened eagerly, up to maxconn are opened on demand
+    - callers block up to checkout_timeout seconds when every connection is busy
+    - a connection idle longer than health_check_after seconds is pinged before
+      being handed out, broken connections are replaced transparently
+    - a connection returned with an open or failed transaction is rolled back,
+      so one failed query never leaks into the next borrower
+    """
+
+    def __init__(self, minconn=1, maxconn=10, checkout_timeout=5.0,
+                 health_check=True, health_check_after=30.0, **connect_kwargs):
+        if minconn < 0 or maxconn < 1 or minconn > maxconn:
+            raise ValueError("Invalid pool size: require 0 <= minconn <= maxconn and maxconn >= 1")
+
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.checkout_timeout = checkout_timeout
+        self.health_check = health_check
+        self.health_check_after = health_check_after
+        self._connect_kwargs = connect_kwargs
+
+        self._cond = threading.Condition()
+        self._idle = []          # [(connection, last_used_monotonic)], used as a LIFO stack
+        self._total = 0          # open connections (idle + in use + being opened)
+        self._in_use = 0
+        self._waiting = 0
+        self._closed = False
+
+        # Monitoring counters
+        self._checkouts = 0
+        self._timeouts = 0
+        self._replaced = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+
+        for _ in range(minconn):
+            self._idle.append((self._connect(), time.monotonic()))
+            self._total += 1
+
+    def _connect(self):
+        return psycopg2.connect(**self._connect_kwargs)
+
+    def _is_healthy(self, conn, last_used):
+        if conn.closed:
+            return False
+        if not self.health_check or time.monotonic() - last_used < self.health_check_after:
+            return True
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1")
+            cursor.close()
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    @staticmethod
+    def _close_quietly(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def getconn(self, timeout=None):
+        """Borrow a connection, blocking up to `timeout` seconds (default: checkout_timeout)"""
+        timeout = self.checkout_timeout if timeout is None else timeout
+        started = time.monotonic()
+        deadline = started + timeout
+        conn, last_used = None, None
+
+        with self._cond:
+            if self._closed:
+                raise PoolTimeoutError("Connection pool is closed")
+            self._waiting += 1
+            try:
+                while True:
+                    if self._idle:
+                        conn, last_used = self._idle.pop()
+                        break
+                    if self._total < self.maxconn:
+                        self._total += 1  # reserve a slot, connect outside the lock
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._timeouts += 1
+                        raise PoolTimeoutError(
+                            f"Timed out after {timeout:.1f}s waiting for a database connection "
+                            f"(max {self.maxconn} in use)"
+                        )
+                    self._cond.wait(remaining)
+            finally:
+                self._waiting -= 1
+            self._in_use += 1
+
+        try:
+            if conn is None:
+                conn = self._connect()
+            elif not self._is_healthy(conn, last_used):
+                self._close_quietly(conn)
+                conn = self._connect()
+                with self._cond:
+                    self._replaced += 1
+        except Exception:
+            with self._cond:
+                self._total -= 1
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+
+        waited = time.monotonic() - started
+        with self._cond:
+            self._checkouts += 1
+            self._total_wait += waited
+            self._max_wait = max(self._max_wait, waited)
+        return conn
+
+    def putconn(self, conn, close=False):
+        """Return a borrowed connection; pass close=True to discard it"""
+        if not close and not conn.closed:
+            try:
+                if conn.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except Exception:
+                close = True
+
+        with self._cond:
+            self._in_use -= 1
+            if close or conn.closed or self._closed:
+                self._total -= 1
+                self._close_quietly(conn)
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self, timeout=None):
+        """Context manager that borrows a connection and always gives it back"""
+        conn = self.getconn(timeout)
+        broken = False
+        try:
+            yield conn
+        except Exception:
+            try:
+                conn.rollback()
+            except Exception:
+                broken = True
+            raise
+        finally:
+            self.putconn(conn, close=broken)
+
+    def stats(self):
+        """Snapshot of pool usage for monitoring"""
+        with self._cond:
+            return {
+                "min_size": self.minconn,
+                "max_size": self.maxconn,
+                "open": self._total,
+                "idle": len(self._idle),
+                "in_use": self._in_use,
+                "waiting": self._waiting,
+                "checkouts": self._checkouts,
+                "timeouts": self._timeouts,
+                "replaced_connections": self._replaced,
+                "total_wait_seconds": round(self._total_wait, 6),
+                "avg_wait_seconds": round(self._total_wait / self._checkouts, 6) if self._checkouts else 0.0,
+                "max_wait_seconds": round(self._max_wait, 6),
+            }
+
+    def closeall(self):
+        with self._cond:
+            self._closed = True
+            while self._idle:
+                conn, _ = self._idle.pop()
+                self._total -= 1
+                self._close_quietly(conn)
+            self._cond.notify_all()
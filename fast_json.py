@@ -0,0 +1,31 @@
+import datetime
+import decimal
+import json
+
+try:
+    import orjson
+except ImportError:  # orjson is in requirements.txt; stdlib json produces the same output, only slower
+    orjson = None
+
+
+def _default(value):
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def loads(data):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def dumps(content):
+    """Compact UTF-8 JSON bytes; Decimal is written as a number, dates as ISO strings"""
+    if orjson is not None:
+        return orjson.dumps(content, default=_default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(content, default=_default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
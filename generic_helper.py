@@ -8,4 +8,71 @@ def extract_session_id(session_str: str):
     match = re.search(r"/sessions/(.*?)/contexts/", session_str)
     if match:
         return match.group(1)
-    return ""
\ No newline at end of file
+    return ""
+
+def first_value(value, default=None):
+    """Dialogflow sends some parameters as lists; return the first element (or the value itself)"""
+    if isinstance(value, list):
+        return value[0] if value else default
+    return value if value is not None else default
+
+
+class ContextMap(list):
+    """
+    queryResult.outputContexts parsed once per request.
+
+    Still a list of the raw context dicts (handlers may iterate it), plus:
+    - session_path: "projects/.../sessions/<id>" taken from the first context name
+    - get(short_name): context dict by its short name ("submit_review_confirm")
+    - param(short_name, key): parameter of that context with list values collapsed to their first element
+    - raw_param(short_name, key): the parameter as sent (lists kept)
+    - find_param(key): value of `key` in the first context that has it
+    """
+
+    def __init__(self, output_contexts):
+        super().__init__(output_contexts or [])
+        self.session_path = None
+        self._by_name = {}
+        self._scalar_params = {}  # filled lazily, most handlers only read one or two contexts
+        self._by_param = None
+        for context in self:
+            base, _, short_name = context.get("name", "").partition("/contexts/")
+            if short_name and short_name not in self._by_name:
+                self._by_name[short_name] = context
+                if self.session_path is None:
+                    self.session_path = base
+
+    @property
+    def session_id(self):
+        return self.session_path.rsplit("/sessions/", 1)[-1] if self.session_path else ""
+
+    def get(self, short_name):
+        return self._by_name.get(short_name)
+
+    def param(self, short_name, key, default=None):
+        params = self._scalar_params.get(short_name)
+        if params is None:
+            context = self._by_name.get(short_name) or {}
+            params = {k: first_value(v) for k, v in (context.get("parameters") or {}).items()}
+            self._scalar_params[short_name] = params
+        value = params.get(key)
+        return default if value is None else value
+
+    def raw_param(self, short_name, key, default=None):
+        context = self._by_name.get(short_name)
+        if context is None:
+            return default
+        return (context.get("parameters") or {}).get(key, default)
+
+    def find_param(self, key, default=None):
+        if self._by_param is None:
+            self._by_param = {}
+            for context in self:
+                for param_key, value in (context.get("parameters") or {}).items():
+                    self._by_param.setdefault(param_key, value)
+        return self._by_param.get(key, default)
+
+    def context_path(self, short_name, session_id=None):
+        """Full context name for an output context of this session"""
+        base = self.session_path or f"projects/shopdbchatbot-nhmk/locations/global/agent/sessions/{session_id}"
+        return f"{base}/contexts/{short_name}"
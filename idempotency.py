@@ -0,0 +1,55 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class ResponseCache:
+    """
+    Short-lived cache of webhook responses keyed by Dialogflow responseId.
+
+    Dialogflow re-sends a webhook call with the same responseId when the first
+    attempt is slow; the retry gets the stored response instead of running the
+    handler again (adding items twice, placing a second order, ...).
+    """
+
+    def __init__(self, ttl=120, max_entries=5000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (stored_at, response), oldest first
+        self._hits = 0
+        self._misses = 0
+
+    def get(self, key):
+        if not key:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or now - entry[0] >= self.ttl:
+                self._misses += 1
+                return None
+            self._hits += 1
+            return entry[1]
+
+    def put(self, key, response):
+        if not key:
+            return
+        now = time.monotonic()
+        with self._lock:
+            self._entries[key] = (now, response)
+            self._entries.move_to_end(key)
+            while self._entries:
+                oldest_key, (stored_at, _) = next(iter(self._entries.items()))
+                if len(self._entries) <= self.max_entries and now - stored_at < self.ttl:
+                    break
+                del self._entries[oldest_key]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "ttl_seconds": self.ttl,
+                "hits": self._hits,
+                "misses": self._misses,
+            }
@@ -0,0 +1,247 @@
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class Route:
+    __slots__ = ("intent", "handler", "read_only")
+
+    def __init__(self, intent, handler, read_only=False):
+        self.intent = intent
+        self.handler = handler
+        # read_only: the response depends only on the parameters (no session reads/writes)
+        self.read_only = read_only
+
+
+class IntentRouter:
+    """
+    Dialogflow intent name -> handler registry, built once at import time.
+
+    Handlers register with the @router.intent(...) decorator. Middleware wraps
+    every dispatch and is called as
+        middleware(route, call_next, parameters, output_contexts, session_id)
+    where call_next(parameters, output_contexts, session_id) runs the rest of the
+    chain. The first middleware added is the outermost one.
+    """
+
+    def __init__(self):
+        self._routes = {}
+        self._middleware = []
+        self._chains = {}
+
+    def intent(self, name, read_only=False):
+        def register(handler):
+            if name in self._routes:
+                raise ValueError(f"Intent '{name}' is already handled by {self._routes[name].handler.__name__}")
+            self._routes[name] = Route(name, handler, read_only)
+            return handler
+        return register
+
+    def add_middleware(self, middleware):
+        self._middleware.append(middleware)
+        self._chains = {}
+
+    def __contains__(self, intent):
+        return intent in self._routes
+
+    def routes(self):
+        return dict(self._routes)
+
+    def _chain(self, route):
+        chain = self._chains.get(route.intent)
+        if chain is None:
+            chain = route.handler
+            for middleware in reversed(self._middleware):
+                chain = (lambda mw, call_next: lambda p, c, s: mw(route, call_next, p, c, s))(middleware, chain)
+            self._chains[route.intent] = chain
+        return chain
+
+    def dispatch(self, intent, parameters, output_contexts, session_id):
+        route = self._routes[intent]
+        return self._chain(route)(parameters, output_contexts, session_id)
+
+    def stats(self):
+        return {
+            "intents": len(self._routes),
+            "read_only_intents": sorted(r.intent for r in self._routes.values() if r.read_only),
+            **{
+                getattr(mw, "name", type(mw).__name__): mw.stats()
+                for mw in self._middleware if hasattr(mw, "stats")
+            },
+        }
+
+
+class _PerIntentStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._by_intent = {}
+
+    def record(self, intent, **values):
+        with self._lock:
+            entry = self._by_intent.setdefault(intent, {})
+            for key, value in values.items():
+                entry[key] = entry.get(key, 0) + value
+            return entry
+
+    def record_max(self, intent, key, value):
+        with self._lock:
+            entry = self._by_intent.setdefault(intent, {})
+            entry[key] = max(entry.get(key, value), value)
+
+    def snapshot(self):
+        with self._lock:
+            return {intent: dict(entry) for intent, entry in self._by_intent.items()}
+
+
+class TimingMiddleware:
+    """Call count, total and max handler time per intent"""
+
+    name = "timing"
+
+    def __init__(self, slow_threshold=1.0):
+        self.slow_threshold = slow_threshold
+        self._stats = _PerIntentStats()
+
+    def __call__(self, route, call_next, parameters, output_contexts, session_id):
+        started = time.perf_counter()
+        try:
+            return call_next(parameters, output_contexts, session_id)
+        finally:
+            elapsed = time.perf_counter() - started
+            self._stats.record(route.intent, calls=1, total_seconds=elapsed)
+            self._stats.record_max(route.intent, "max_seconds", elapsed)
+            if elapsed >= self.slow_threshold:
+                logger.warning(f"Slow intent '{route.intent}': {elapsed:.2f}s")
+
+    def stats(self):
+        result = {}
+        for intent, entry in self._stats.snapshot().items():
+            result[intent] = {
+                "calls": entry["calls"],
+                "avg_ms": round(entry["total_seconds"] / entry["calls"] * 1000, 2),
+                "max_ms": round(entry["max_seconds"] * 1000, 2),
+            }
+        return result
+
+
+class DbCallCounterMiddleware:
+    """Number of db_helper calls (connection checkouts) per intent"""
+
+    name = "db_calls"
+
+    def __init__(self, count_db_calls):
+        # db_helper.count_db_calls, injected so the router does not depend on the database layer
+        self._count_db_calls = count_db_calls
+        self._stats = _PerIntentStats()
+
+    def __call__(self, route, call_next, parameters, output_contexts, session_id):
+        with self._count_db_calls() as counter:
+            try:
+                return call_next(parameters, output_contexts, session_id)
+            finally:
+                self._stats.record(route.intent, calls=1, db_calls=counter[0])
+
+    def stats(self):
+        return {
+            intent: {**entry, "db_calls_per_call": round(entry["db_calls"] / entry["calls"], 2)}
+            for intent, entry in self._stats.snapshot().items()
+        }
+
+
+class ReadOnlyCacheMiddleware:
+    """
+    Caches responses of read-only intents by (intent, parameters) for `ttl` seconds.
+    Call clear() when the underlying data changes (e.g. from a catalog listener).
+    """
+
+    name = "response_cache"
+
+    def __init__(self, ttl=60, max_entries=2000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (stored_at, response), least recently used first
+        self._hits = 0
+        self._misses = 0
+
+    def clear(self, *_):
+        with self._lock:
+            self._entries.clear()
+
+    def __call__(self, route, call_next, parameters, output_contexts, session_id):
+        if not route.read_only:
+            return call_next(parameters, output_contexts, session_id)
+        key = (route.intent, json.dumps(parameters, sort_keys=True, default=str))
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now - entry[0] < self.ttl:
+                self._entries.move_to_end(key)
+                self._hits += 1
+                return entry[1]
+            self._misses += 1
+
+        response = call_next(parameters, output_contexts, session_id)
+        if getattr(response, "status_code", 200) == 200:
+            with self._lock:
+                self._entries[key] = (now, response)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return response
+
+    def stats(self):
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "entries": len(self._entries),
+                "ttl_seconds": self.ttl,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_ratio": round(self._hits / lookups, 4) if lookups else None,
+            }
+
+
+class IntentInputError(ValueError):
+    """Raised by a handler when the user's parameters can't be used; mapped to a "please rephrase" reply"""
+
+
+class ErrorMappingMiddleware:
+    """
+    Turns exceptions that escape a handler into a normal chatbot reply.
+
+    `mapping` is a list of (exception types, reply text), checked in order, for
+    errors we expect (IntentInputError, DB unavailable); they are logged without
+    a traceback. Anything else is a bug: logged with its traceback and answered
+    with `default_message`. Exceptions in `passthrough` are re-raised.
+    """
+
+    name = "errors"
+
+    def __init__(self, make_response, mapping=(), default_message="Sorry, something went wrong. Please try again.", passthrough=()):
+        self._make_response = make_response
+        self._mapping = list(mapping)
+        self._default_message = default_message
+        self._passthrough = tuple(passthrough)
+        self._stats = _PerIntentStats()
+
+    def __call__(self, route, call_next, parameters, output_contexts, session_id):
+        try:
+            return call_next(parameters, output_contexts, session_id)
+        except self._passthrough:
+            raise
+        except Exception as e:
+            self._stats.record(route.intent, **{type(e).__name__: 1})
+            for exc_types, message in self._mapping:
+                if isinstance(e, exc_types):
+                    logger.warning(f"Intent '{route.intent}' failed: {type(e).__name__}: {e}")
+                    return self._make_response(message)
+            logger.exception(f"Unhandled error in intent '{route.intent}': {e}")
+            return self._make_response(self._default_message)
+
+    def stats(self):
+        return self._stats.snapshot()
@@ -1,19 +1,54 @@
 from fastapi import FastAPI, Request, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse as StarletteJSONResponse
+from starlette.concurrency import run_in_threadpool
 import logging
 from datetime import datetime, timedelta
 from typing import Dict, Any, Optional
+import hashlib
 import json
+import os
+import uuid
+import psycopg2
 import db_helper
+import fast_json
 import generic_helper
+import idempotency
+import intent_router
+import name_index
+import reference_cache
+import session_store
+import webhook_models
+from catalog_cache import catalog
+from cheapest_index import cheapest_products
+from db_pool import PoolTimeoutError
+from price_index import price_index
 
 import logging
 logger = logging.getLogger(__name__)
 
-inprogress_orders = {}
+sessions = session_store.create_session_store()
+session_locks = session_store.SessionLocks(int(os.getenv("SESSION_LOCK_STRIPES", "256")))
+recent_responses = idempotency.ResponseCache(ttl=float(os.getenv("WEBHOOK_RETRY_WINDOW", "120")))
 customer_id = 1
 
 
+router = intent_router.IntentRouter()
+router.add_middleware(intent_router.TimingMiddleware())
+router.add_middleware(intent_router.ErrorMappingMiddleware(
+    lambda text: create_response(text),
+    mapping=[
+        ((psycopg2.OperationalError, PoolTimeoutError), "Our store is busy right now. Please try again in a moment."),
+        (intent_router.IntentInputError, "Sorry, I couldn't understand some of the details. Could you rephrase that?"),
+    ],
+    passthrough=(session_store.SessionConflictError,),
+))
+router.add_middleware(intent_router.DbCallCounterMiddleware(db_helper.count_db_calls))
+read_only_responses = intent_router.ReadOnlyCacheMiddleware(ttl=float(os.getenv("READ_ONLY_INTENT_CACHE_TTL", "60")))
+router.add_middleware(read_only_responses)
+# Search results depend on the catalog: drop them as soon as a product or brand changes
+catalog.add_listener(read_only_responses.clear)
+
+
 def safe_extract_session_id(context_name: str) -> str:
     try:
         if generic_helper:
@@ -27,17 +62,45 @@ def safe_extract_session_id(context_name: str) -> str:
     except Exception as e:
         return "default_session"
     
+class JSONResponse(StarletteJSONResponse):
+    """Webhook responses are encoded with fast_json (orjson) instead of stdlib json"""
+
+    def render(self, content) -> bytes:
+        return fast_json.dumps(content)
+
 def create_response(text: str, contexts: Optional[list] = None) -> JSONResponse:
     """Create a standardized response for Dialogflow"""
-    response = {
-        "fulfillmentText": text,
-        "source": "shopdb-chatbot"
-    }
-    
-    if contexts:
-        response["outputContexts"] = contexts
-    
-    return JSONResponse(content=response)
+    return JSONResponse(content=webhook_models.WebhookResponse(text, contexts).to_dict())
+
+def input_int(value, what):
+    """int() of a user or context parameter; a non-number raises IntentInputError (the "please rephrase" reply)"""
+    try:
+        return int(value)
+    except (ValueError, TypeError):
+        raise intent_router.IntentInputError(f"{what} is not a number: {value!r}") from None
+
+def find_products_by_name(product_name):
+    """
+    Products for a name as the user typed it ("air max 270"), resolved through the
+    in-memory name index. Returns (rows shaped like db_helper.get_products_by_name,
+    suggested catalog names when the name is unknown or ambiguous).
+    """
+    if name_index.product_names.loaded:
+        name, candidates = name_index.product_names.best_match(product_name)
+        if name is None:
+            return [], list(dict.fromkeys(c[1] for c in candidates))[:3]
+        product_name = name
+    return catalog.get_products_by_name(product_name) or [], []
+
+def did_you_mean(suggestions):
+    return f" Did you mean: {', '.join(suggestions)}?" if suggestions else ""
+
+def resolve_review_product(product, unreviewed_names):
+    """Catalog name of `product` among the customer's unreviewed products (unchanged if none matches)"""
+    if product and product not in unreviewed_names and name_index.product_names.loaded:
+        name, _ = name_index.product_names.best_match(product, choices=unreviewed_names)
+        return name or product
+    return product
 
 # Intent handler functions
 def handle_welcome(parameters: dict, contexts: list, session_id: str):
@@ -73,51 +136,43 @@ def convert_decimals_to_floats(product_list):
         logger.error(f"Error converting decimals: {e}")
         return product_list
 
-async def handle_request(request: Request):
-    payload = await request.json()
-    intent = payload['queryResult']['intent']['displayName']
-    parameters = payload['queryResult']['parameters']
-    output_contexts = payload['queryResult']['outputContexts']
-    session_id = generic_helper.extract_session_id(output_contexts[0]["name"])
-
-    intent_handler_dict = {
-        'search.by.brand - context: ongoing-order': search_by_brand,
-        'search.by.price - context: ongoing-order': search_by_price,
-        'show.product.detail.by.id : context: ongoing-order': search_by_id,
-        'show.product.detail.by.name : context: ongoing-order': search_by_name,
-        'choose.cheapest.product - context: ongoing-order': choose_cheapest_product,
-        'confirm.product.order : context: ongoing-order': confirm_order,
-        'Update.order : context: edit-order': update_order,
-        'user.confirm_checkout : context: ongoing-order': proceed_to_checkout,
-        'apply-coupon-code : context: ongoing-applyCode': apply_coupon_code,
-        'identify-customer - context: ongoing-identify': identify_customer,
-        'confirm-customer-info - context: ongoing-confirm-info': confirm_customer_info,
-        'use-default-address - context: ongoing-address': use_default_address,
-        'new-shipping-address - context: ongoing-address': request_new_shipping_address,
-        'provide-new-shipping-address - context: ongoing-new-address': process_new_shipping_address,
-        'confirm-new-address - context: ongoing-new-address': confirm_new_address,
-        'confirm-shipping-method - context: ongoing-shipping-method': confirm_shipping_method,
-        'select-payment-method - context: ongoing-payment-method': select_payment_method,
-        'confirm-order - context: ongoing-order-confirmation': confirm_order_placement,
-        'cancel-order - context: ongoing-order-confirmation': cancel_order,
-        'remove-items - context: ongoing-order-confirmation': remove_items,
-        'end-conversation - context: ongoing-order-complete': end_conversation,
-        'showlist.confirm - context: ongoing-tracking': show_customer_orders,
-        'delete - context: ongoing-tracking': delete_order_handler,
-        'update.address.confirm - context: ongoing-tracking': update_shipping_address_handler,
-        'submit_review_start': submit_review_start,
-        'submit_review_product_confirm': submit_review_product_confirm,
-        'submit_review_details_collect': submit_review_details_collect,
-        'submit_review_edit': submit_review_edit,
-        'submit_review_submit': submit_review_submit,
-        'submit_review_end': submit_review_end,
-        'submit_review_cancel': submit_review_cancel,
-        'submit_review_select_different_product': submit_review_select_different_product,
-        'submit_review_continue': submit_review_continue
-    }
+def _run_locked(intent, parameters, output_contexts, session_id, response_id=None, session_path=None):
+    # Two turns of the same conversation (e.g. a Dialogflow retry) must not read-modify-write the cart at once
+    with session_locks.hold(session_id) as waited:
+        if waited > 0.5:
+            logger.warning(f"Waited {waited:.2f}s for session lock of {session_id}")
+        # A retry waits for the original call above, then replays its response
+        cached = recent_responses.get(response_id)
+        if cached is not None:
+            logger.info(f"Replaying response {response_id} for retried webhook call")
+            return cached
+        sessions.begin_request(session_id, output_contexts, session_path)
+        response = sessions.end_request(router.dispatch(intent, parameters, output_contexts, session_id))
+        recent_responses.put(response_id, response)
+        return response
 
-    if intent in intent_handler_dict:
-        return intent_handler_dict[intent](parameters, output_contexts, session_id)
+async def handle_request(request: Request):
+    try:
+        webhook = webhook_models.WebhookRequest.from_bytes(await request.body())
+    except webhook_models.WebhookDecodeError as e:
+        logger.warning(f"Rejected webhook request: {e}")
+        return JSONResponse(content={"fulfillmentText": "Invalid webhook request."}, status_code=400)
+    intent = webhook.intent
+    parameters = webhook.parameters
+    # Parsed once here; handlers look contexts up by short name instead of scanning the list
+    output_contexts = webhook.output_contexts
+    session_id = webhook.session_id
+
+    if intent in router:
+        # Handlers use the blocking db_helper API, run them off the event loop
+        try:
+            return await run_in_threadpool(
+                _run_locked, intent, parameters, output_contexts, session_id, webhook.response_id, webhook.session
+            )
+        except session_store.SessionConflictError as e:
+            # Another worker saved this session first (e.g. a Dialogflow retry); ours is discarded
+            logger.warning(f"{e} (intent: {intent})")
+            return create_response("Sorry, your previous message is still being processed. Please repeat your last request.")
     else:
         return JSONResponse(content={
             "fulfillmentText": f"Sorry, I don't understand the intent '{intent}'. Please try again."
@@ -133,49 +188,114 @@ def handle_customer_inquiry(parameters: dict, contexts: list, session_id: str):
         "Bạn có thể cung cấp thông tin nào để tôi tìm kiếm?"
     )
 
+# Product listings are sent one page at a time; the "product-listing" output
+# context remembers the query and the keyset cursor for the next "show more" turn
+LISTING_PAGE_SIZE = int(os.getenv("CHATBOT_LISTING_PAGE_SIZE", "10"))
+LISTING_CONTEXT = "product-listing"
+SHOW_MORE_HINT = "Say 'show more' to see more products."
+
+def listing_response(text, output_contexts, session_id, listing, cursor):
+    """Page text plus the listing context: kept with the next cursor, or cleared after the last page"""
+    context = {"name": output_contexts.context_path(LISTING_CONTEXT, session_id)}
+    if cursor is None:
+        context["lifespanCount"] = 0
+    else:
+        context["lifespanCount"] = 5
+        context["parameters"] = {**listing, "after": cursor}
+    return create_response(text, [context])
+
+def list_brand_products(output_contexts, session_id, brand_name, after=None):
+    # Lấy thêm 1 dòng để biết còn trang sau hay không
+    products = catalog.get_list_products_by_brand(brand_name, after, LISTING_PAGE_SIZE + 1)
+    if not products:
+        return None
+    more = len(products) > LISTING_PAGE_SIZE
+    products = products[:LISTING_PAGE_SIZE]
+    lines = [f"ID: {prod_id:<5} --> Name:{prod_name}||" for prod_id, prod_name in products]
+    lines.append(SHOW_MORE_HINT if more else "Do you have a budget preference, or should I dive into details for a specific product?")
+    cursor = products[-1][0] if more else None
+    return listing_response("".join(lines), output_contexts, session_id, {"listing": "brand", "brand-name-item": brand_name}, cursor)
+
+def list_products_by_price(output_contexts, session_id, brand_name, price_range, price, after=None):
+    products = price_index.get_list_products_by_price(brand_name, price_range, price, after, LISTING_PAGE_SIZE + 1)
+    if not products:
+        return None
+    more = len(products) > LISTING_PAGE_SIZE
+    products = products[:LISTING_PAGE_SIZE]
+    lines = ["id    product_name"]
+    lines.extend(f"{prod_id:<5} {prod_name} (${prod_price})" for prod_id, prod_name, prod_price in products)
+    if more:
+        lines.append(SHOW_MORE_HINT)
+    # (price, id) của dòng cuối; giá lưu dạng chuỗi để so sánh đúng với cột numeric
+    cursor = [str(products[-1][2]), products[-1][0]] if more else None
+    listing = {"listing": "price", "brand-name-item": brand_name, "price-range": price_range, "number": price}
+    return listing_response("\n".join(lines), output_contexts, session_id, listing, cursor)
+
+# Not read_only: responses carry a session-specific listing context, so they cannot be shared
+@router.intent('search.by.brand - context: ongoing-order')
 def search_by_brand(parameters: dict, output_contexts, session_id):
     brand_name_item = parameters["brand-name-item"]
-    products = db_helper.get_list_products_by_brand(brand_name_item)
-
-    if products:
-        response_text = ""
-        for prod_id, prod_name in products: 
-            response_text += f"ID: {prod_id:<5} --> Name:{prod_name}||"
-        response_text += "Do you have a budget preference, or should I dive into details for a specific product?"
-        return JSONResponse(content={"fulfillmentText": response_text.strip()})
-    else:
+    brand = reference_cache.brands.get_by_name(brand_name_item)
+    if reference_cache.brands.rows() and not brand:
+        return JSONResponse(content={"fulfillmentText": f"No product found for brand '{brand_name_item}'."})
+
+    response = list_brand_products(output_contexts, session_id, brand["brand_name"] if brand else brand_name_item)
+    if response is None:
         return JSONResponse(content={"fulfillmentText": f"No product found for brand '{brand_name_item}'."})
+    return response
 
+@router.intent('search.by.price - context: ongoing-order')
 def search_by_price(parameters: dict, output_contexts, session_id):
     brand_name_item = parameters.get("brand-name-item", "")
     price_range = parameters.get("price-range", "")
     price = parameters.get("number")
 
     if price_range == "Under" and isinstance(price, (list, tuple)):
-        price = price[0] 
+        price = price[0] if price else None
     elif price_range == "Between" and (not isinstance(price, (list, tuple)) or len(price) != 2):
         return JSONResponse(content={"fulfillmentText": "Price range 'Between' requires two numbers."})
+    # Thiếu giá hoặc giá không phải số: hỏi lại thay vì để lỗi rơi vào middleware
+    if price_range in ("Under", "Between") and db_helper.price_range_bounds(price_range, price) is None:
+        return JSONResponse(content={"fulfillmentText": "Please tell me a price, e.g. 'under $60' or 'between $50 and $100'."})
 
-    products = db_helper.get_list_products_by_price(brand_name_item, price_range, price)
-
-    if products:
-        response_text = "id    product_name\n"
-        for prod_id, prod_name in products:
-            response_text += f"{prod_id:<5} {prod_name}\n"
-        return JSONResponse(content={"fulfillmentText": response_text.strip()})
-    else:
+    response = list_products_by_price(output_contexts, session_id, brand_name_item, price_range, price)
+    if response is None:
         return JSONResponse(content={"fulfillmentText": f"No product found for the given criteria."})
+    return response
+
+@router.intent('show.more.products - context: product-listing')
+def show_more_products(parameters: dict, output_contexts, session_id):
+    listing = output_contexts.get(LISTING_CONTEXT)
+    params = (listing or {}).get("parameters") or {}
+    after = params.get("after")
+    if after is None:
+        return create_response("There are no more products to show. Try another brand or price range.")
+
+    if params.get("listing") == "brand":
+        response = list_brand_products(output_contexts, session_id, params.get("brand-name-item"), input_int(after, "listing cursor"))
+    else:
+        if not isinstance(after, (list, tuple)) or len(after) != 2:
+            raise intent_router.IntentInputError(f"malformed price listing cursor: {after!r}")
+        response = list_products_by_price(
+            output_contexts, session_id,
+            params.get("brand-name-item", ""), params.get("price-range", ""), params.get("number"),
+            after=(after[0], input_int(after[1], "listing cursor")),
+        )
+    if response is None:
+        return listing_response("There are no more products to show.", output_contexts, session_id, {}, None)
+    return response
 
+@router.intent('show.product.detail.by.id : context: ongoing-order', read_only=True)
 def search_by_id(parameters: dict, output_contexts, session_id):
     product_id = parameters.get("number-integer")
     print(f"Received product_id: {product_id}")
     if isinstance(product_id, list) and len(product_id) > 0:
         product_id = product_id[0]
-    if isinstance(product_id, float):
-        product_id = int(product_id)
+    if product_id:
+        product_id = input_int(product_id, "product id")
 
     if product_id:
-        products = db_helper.get_list_products_by_id(product_id)
+        products = catalog.get_list_products_by_id(product_id)
         if products:
             product = products[0]
             (
@@ -200,6 +320,7 @@ def search_by_id(parameters: dict, output_contexts, session_id):
     else:
         return JSONResponse(content={"fulfillmentText": "Product ID is required."})
 
+@router.intent('show.product.detail.by.name : context: ongoing-order', read_only=True)
 def search_by_name(parameters: dict, output_contexts, session_id):
     product_name = parameters.get("product-name")
     print(f"Received product_id: {product_name}")
@@ -207,7 +328,8 @@ def search_by_name(parameters: dict, output_contexts, session_id):
         product_name = product_name[0]
     
     if product_name:
-        products = db_helper.get_products_by_name(product_name)
+        matches, suggestions = find_products_by_name(product_name)
+        products = catalog.get_list_products_by_id(matches[0][0]) if matches else None
         if products:
             product = products[0]
             (
@@ -228,12 +350,21 @@ def search_by_name(parameters: dict, output_contexts, session_id):
             )
             return JSONResponse(content={"fulfillmentText": response_text})
         else:
-            return JSONResponse(content={"fulfillmentText": f"No product found for name '{product_name}'."})
+            return JSONResponse(content={"fulfillmentText": f"No product found for name '{product_name}'.{did_you_mean(suggestions)}"})
     else:
         return JSONResponse(content={"fulfillmentText": "Product name is required."})
 
+# Not read_only: the answer depends on the brand/category in the output contexts, not only on parameters
+@router.intent('choose.cheapest.product - context: ongoing-order')
 def choose_cheapest_product(parameters: dict, output_contexts, session_id):
-    product = db_helper.get_product_cheapest()
+    # Phạm vi theo thương hiệu / danh mục khách đang xem (nếu có)
+    brand_name = generic_helper.first_value(parameters.get("brand-name-item") or output_contexts.find_param("brand-name-item"))
+    category_name = generic_helper.first_value(parameters.get("category") or output_contexts.find_param("category"))
+    brand = reference_cache.brands.get_by_name(brand_name)
+    if brand:
+        brand_name = brand["brand_name"]
+
+    product = cheapest_products.get_product_cheapest(brand_name or None, category_name or None)
     if product:  
         (
             product_name,
@@ -252,8 +383,23 @@ def choose_cheapest_product(parameters: dict, output_contexts, session_id):
         )
         return JSONResponse(content={"fulfillmentText": response_text})
     else:
-        return JSONResponse(content={"fulfillmentText": "No product found."})
+        scope = " / ".join(name for name in (brand_name, category_name) if name)
+        return JSONResponse(content={"fulfillmentText": f"No product in stock for {scope}." if scope else "No product found."})
 
+def begin_cart(session):
+    """
+    Give the session's cart a checkout_nonce (part of the order idempotency key).
+    A cart that was already placed is emptied first, so ordering the same
+    products again in this session is a new order, not a replay of the old one.
+    """
+    if session.get("checkout_nonce") and session.get("placed_checkout_nonce") == session["checkout_nonce"]:
+        session.pop("order_list", None)
+        session.pop("discount", None)
+        session["checkout_nonce"] = None
+    if not session.get("checkout_nonce"):
+        session["checkout_nonce"] = uuid.uuid4().hex
+
+@router.intent('confirm.product.order : context: ongoing-order')
 def confirm_order(parameters: dict, output_contexts, session_id: str):
     product_names = parameters.get("product-name", [])
     quantities = parameters.get("number-integer", [])
@@ -268,9 +414,10 @@ def confirm_order(parameters: dict, output_contexts, session_id: str):
     order_list = []
 
     for product_name, quantity in zip(product_names, quantities):
-        products = db_helper.get_products_by_name(product_name)
+        quantity = input_int(quantity, "quantity")
+        products, suggestions = find_products_by_name(product_name)
         if not products:
-            not_found_lines.append(f"- No products found with the name '{product_name}'.")
+            not_found_lines.append(f"- No products found with the name '{product_name}'.{did_you_mean(suggestions)}")
             continue
 
         for product in products:
@@ -287,9 +434,6 @@ def confirm_order(parameters: dict, output_contexts, session_id: str):
 
             if isinstance(stock_quantity, str):
                 stock_quantity = int(stock_quantity)
-                
-            if isinstance(quantity, float):
-                quantity = int(quantity) 
 
             if stock_quantity < quantity:
                 insufficient_stock_lines.append(
@@ -304,28 +448,30 @@ def confirm_order(parameters: dict, output_contexts, session_id: str):
             order_list.append((product_id, quantity))
 
     if session_id and order_list:
-        if session_id in inprogress_orders:
+        session = sessions.get(session_id)
+        if session is not None:
+            begin_cart(session)
             # Cập nhật order hiện tại
-            current_order = inprogress_orders[session_id]
-            if "order_list" in current_order:
+            if "order_list" in session:
                 # Merge với order cũ
-                existing_orders = dict(current_order["order_list"])
+                existing_orders = dict(session["order_list"])
                 for product_id, quantity in order_list:
                     if product_id in existing_orders:
                         existing_orders[product_id] += quantity
                     else:
                         existing_orders[product_id] = quantity
-                current_order["order_list"] = list(existing_orders.items())
+                session["order_list"] = list(existing_orders.items())
             else:
-                current_order["order_list"] = order_list
-            inprogress_orders[session_id] = current_order
+                session["order_list"] = order_list
         else:
             # Tạo order mới
-            inprogress_orders[session_id] = {
+            session = {
                 "order_list": order_list,
                 "customer_info": None,
-                "shipping_address": None
+                "shipping_address": None,
+                "checkout_nonce": uuid.uuid4().hex,
             }
+        sessions.save(session_id, session)
 
     if not confirm_lines:
         messages = []
@@ -347,6 +493,7 @@ def confirm_order(parameters: dict, output_contexts, session_id: str):
 
     return JSONResponse(content={"fulfillmentText": confirm_text})
 
+@router.intent('Update.order : context: edit-order')
 def update_order(parameters: dict, output_contexts, session_id: str) -> JSONResponse:
     product_names = parameters.get("product-name", [])
     quantities = parameters.get("number-integer", [])
@@ -365,10 +512,11 @@ def update_order(parameters: dict, output_contexts, session_id: str) -> JSONResp
     if len(product_names) != len(quantities):
         return JSONResponse(content={"fulfillmentText": "Product name and quantity do not match."})
 
-    if session_id not in inprogress_orders:
+    session = sessions.get(session_id)
+    if session is None:
         return JSONResponse(content={"fulfillmentText": "No pending orders found. Please create a new order first."})
 
-    current_order = inprogress_orders[session_id]["order_list"]
+    current_order = session["order_list"]
     updated = False
     not_found_lines = []
     insufficient_stock_lines = []
@@ -381,9 +529,9 @@ def update_order(parameters: dict, output_contexts, session_id: str) -> JSONResp
                 not_found_lines.append(f"- Invalid quantity {qty} for '{name}'.")
                 continue
                 
-            products = db_helper.get_products_by_name(name)
+            products, suggestions = find_products_by_name(name)
             if not products:
-                not_found_lines.append(f"- No products found with name '{name}'.")
+                not_found_lines.append(f"- No products found with name '{name}'.{did_you_mean(suggestions)}")
                 continue
 
             product = products[0]
@@ -422,22 +570,23 @@ def update_order(parameters: dict, output_contexts, session_id: str) -> JSONResp
 
     # Cập nhật nếu có thay đổi
     if updated:
-        inprogress_orders[session_id]["order_list"] = current_order
+        session["order_list"] = current_order
+        sessions.save(session_id, session)
         logger.info(f"Updated order in session {session_id}: {current_order}")
 
     #Hiển thị đơn hàng đúng cách
     current_products = []
+    products_by_id = catalog.get_products_by_ids(pid for pid, _ in current_order)
     for product_id, quantity in current_order:  #Đặt tên biến đúng
-        products = db_helper.get_list_products_by_id(product_id)  #Tìm theo ID
-        if products:
-            product = products[0] if isinstance(products, list) else products
+        product = products_by_id.get(product_id)
+        if product:
             current_products.append({
-                "id": product[0],
-                "name": product[1],  # Lấy tên từ DB
+                "id": product_id,
+                "name": product[0],  # Lấy tên từ DB
                 "quantity": quantity,
-                "price": product[3],
-                "brand": product[5],
-                "origin": product[6]
+                "price": product[2],
+                "brand": product[4],
+                "origin": product[7]
             })
 
     # Tạo thông điệp phản hồi (giữ nguyên phần này)
@@ -466,15 +615,16 @@ def update_order(parameters: dict, output_contexts, session_id: str) -> JSONResp
 
     return JSONResponse(content={"fulfillmentText": response_text})
 
+@router.intent('user.confirm_checkout : context: ongoing-order')
 def proceed_to_checkout(parameters: dict, output_contexts, session_id: str):
 
     # Kiểm tra session tồn tại như code mẫu
-    if session_id not in inprogress_orders:
+    session = sessions.get(session_id)
+    if session is None:
         fulfillment_text = "You have not added any items to your cart yet."
         return JSONResponse(content={"fulfillmentText": fulfillment_text})
     
-    session_data = inprogress_orders.get(session_id, {})
-    order_list = session_data.get("order_list", [])
+    order_list = session.get("order_list", [])
 
     if not order_list:
         return JSONResponse(content={"fulfillmentText": "You have not added any items to your cart yet."})
@@ -482,11 +632,11 @@ def proceed_to_checkout(parameters: dict, output_contexts, session_id: str):
     total_amount = 0
     order_summary_lines = []
 
+    products_by_id = catalog.get_products_by_ids(pid for pid, _ in order_list)
     for product_id, quantity in order_list:
-        products = db_helper.get_list_products_by_id(product_id)
-        if not products:
+        product = products_by_id.get(product_id)
+        if not product:
             continue
-        product = products[0]
         
         product_name = product[0]        # product_name
         price = product[2]               # price
@@ -522,20 +672,21 @@ def proceed_to_checkout(parameters: dict, output_contexts, session_id: str):
 
     return JSONResponse(content={"fulfillmentText": response_text})
 
+@router.intent('apply-coupon-code : context: ongoing-applyCode')
 def apply_coupon_code(parameters: dict, output_contexts, session_id: str):
     coupon_code = parameters.get("coupon_code", "").strip().upper()
-    session_data = inprogress_orders.get(session_id, {})
-    order_list = session_data.get("order_list", [])
+    session = sessions.get(session_id) or {}
+    order_list = session.get("order_list", [])
 
     if not coupon_code or not order_list:
         return JSONResponse(content={"fulfillmentText": "Invalid coupon or no items in your cart."})
 
     total_amount = 0
+    products_by_id = catalog.get_products_by_ids(pid for pid, _ in order_list)
     for product_id, quantity in order_list:
-        product = db_helper.get_list_products_by_id(product_id)
+        product = products_by_id.get(product_id)
         if not product:
             continue
-        product = product[0]
         price = float(product[2])
         total_amount += price * quantity
 
@@ -550,10 +701,11 @@ def apply_coupon_code(parameters: dict, output_contexts, session_id: str):
     total_after_discount = total_amount - discount_amount
 
     # Lưu thông tin discount vào session
-    inprogress_orders[session_id]["discount"] = {
+    session["discount"] = {
         "promo_code": promo_code,
         "discount_amount": discount_amount
     }
+    sessions.save(session_id, session)
 
     response_text = (
         f"Thanks! Your promo code has been applied. Order Summary:\n"
@@ -565,6 +717,7 @@ def apply_coupon_code(parameters: dict, output_contexts, session_id: str):
 
     return JSONResponse(content={"fulfillmentText": response_text})
 
+@router.intent('identify-customer - context: ongoing-identify')
 def identify_customer(parameters: dict, output_contexts, session_id: str):
     email = parameters.get("email", "").strip()
     phone = parameters.get("phone-number", "").strip()
@@ -583,9 +736,11 @@ def identify_customer(parameters: dict, output_contexts, session_id: str):
                 f"Email: {customer_info[1]}\n"
                 f"Phone: {customer_info[2]}"
             )
-            if session_id not in inprogress_orders:
-                inprogress_orders[session_id] = {"order_list": [], "customer_info": None, "shipping_address": None}
-            inprogress_orders[session_id]["customer_info"] = {"email": customer_info[1], "phone": customer_info[2]}
+            session = sessions.get(session_id)
+            if session is None:
+                session = {"order_list": [], "customer_info": None, "shipping_address": None}
+            session["customer_info"] = {"email": customer_info[1], "phone": customer_info[2]}
+            sessions.save(session_id, session)
             return JSONResponse(content={
                 "fulfillmentText": f"Thank you! Your information has been found:\n{customer_text}\nPlease confirm if this is correct. Reply with 'Yes, that’s correct' or 'No, that’s wrong'."
             })
@@ -593,16 +748,18 @@ def identify_customer(parameters: dict, output_contexts, session_id: str):
         "fulfillmentText": "Customer not found. Please provide a valid email or phone number (e.g., 'My email is john.doe@example.com' or 'My phone is 1234567890')."
     })
 
+@router.intent('confirm-customer-info - context: ongoing-confirm-info')
 def confirm_customer_info(parameters: dict, output_contexts, session_id: str):
+    session = sessions.get(session_id)
     confirmation = parameters.get("confirmation", "").lower()
 
-    if session_id not in inprogress_orders or not inprogress_orders[session_id].get("customer_info"):
+    if session is None or not session.get("customer_info"):
         return JSONResponse(content={
             "fulfillmentText": "Session not found. Please provide your email or phone number again to identify yourself."
         })
 
-    email = inprogress_orders[session_id]["customer_info"]["email"]
-    phone = inprogress_orders[session_id]["customer_info"]["phone"]
+    email = session["customer_info"]["email"]
+    phone = session["customer_info"]["phone"]
 
     customer = db_helper.get_customer_by_email_or_phone(email, phone)
     if not customer:
@@ -634,14 +791,16 @@ def confirm_customer_info(parameters: dict, output_contexts, session_id: str):
             "fulfillmentText": "Let’s update your information. Please provide your correct email or phone number (e.g., 'My email is john.doe@example.com' or 'My phone is 1234567890')."
         })
 
+@router.intent('use-default-address - context: ongoing-address')
 def use_default_address(parameters: dict, output_contexts, session_id: str):
-    if session_id not in inprogress_orders or not inprogress_orders[session_id].get("customer_info"):
+    session = sessions.get(session_id)
+    if session is None or not session.get("customer_info"):
         return JSONResponse(content={
             "fulfillmentText": "Session not found. Please provide your email or phone number again to identify yourself."
         })
 
-    email = inprogress_orders[session_id]["customer_info"]["email"]
-    phone = inprogress_orders[session_id]["customer_info"]["phone"]
+    email = session["customer_info"]["email"]
+    phone = session["customer_info"]["phone"]
 
     customer = db_helper.get_customer_by_email_or_phone(email, phone)
     if not customer:
@@ -654,7 +813,7 @@ def use_default_address(parameters: dict, output_contexts, session_id: str):
     if default_address:
         # Lưu địa chỉ mặc định vào session
         address_id, receiver_name, receiver_phone, country, city, province_state, postal_code = default_address
-        inprogress_orders[session_id]["shipping_address"] = {
+        session["shipping_address"] = {
             "address_id": address_id,
             "receiver_name": receiver_name,
             "receiver_phone": receiver_phone,
@@ -664,16 +823,17 @@ def use_default_address(parameters: dict, output_contexts, session_id: str):
             "postal_code": postal_code,
             "is_default": True  # Địa chỉ mặc định nên có is_default là True
         }
+        sessions.save(session_id, session)
 
-        # Lấy danh sách phương thức giao hàng
-        shipping_methods = db_helper.get_shipping_methods()
+        # Lấy danh sách phương thức giao hàng (từ cache)
+        shipping_methods = reference_cache.shipping_methods.rows()
         if not shipping_methods:
             return JSONResponse(content={
                 "fulfillmentText": "Sorry, no shipping methods are available at the moment. Please contact support."
             })
 
         # Tính tổng số lượng sản phẩm trong đơn hàng
-        order_list = inprogress_orders[session_id]["order_list"]
+        order_list = session["order_list"]
         total_quantity = sum(quantity for _, quantity in order_list)
 
         # Giả định khoảng cách (km) để tính thời gian giao hàng
@@ -704,14 +864,16 @@ def use_default_address(parameters: dict, output_contexts, session_id: str):
             "fulfillmentText": "No default address found. Please provide a new address with 'New address'."
         })
 
+@router.intent('new-shipping-address - context: ongoing-address')
 def request_new_shipping_address(parameters: dict, output_contexts, session_id: str):
-    if session_id not in inprogress_orders or not inprogress_orders[session_id].get("customer_info"):
+    session = sessions.get(session_id)
+    if session is None or not session.get("customer_info"):
         return JSONResponse(content={
             "fulfillmentText": "Session not found. Please provide your email or phone number again to identify yourself."
         })
 
-    email = inprogress_orders[session_id]["customer_info"]["email"]
-    phone = inprogress_orders[session_id]["customer_info"]["phone"]
+    email = session["customer_info"]["email"]
+    phone = session["customer_info"]["phone"]
 
     customer = db_helper.get_customer_by_email_or_phone(email, phone)
     if not customer:
@@ -739,14 +901,16 @@ def request_new_shipping_address(parameters: dict, output_contexts, session_id:
     )
     return JSONResponse(content={"fulfillmentText": response_text})
 
+@router.intent('provide-new-shipping-address - context: ongoing-new-address')
 def process_new_shipping_address(parameters: dict, output_contexts, session_id: str):
-    if session_id not in inprogress_orders or not inprogress_orders[session_id].get("customer_info"):
+    session = sessions.get(session_id)
+    if session is None or not session.get("customer_info"):
         return JSONResponse(content={
             "fulfillmentText": "Session not found. Please provide your email or phone number again to identify yourself."
         })
 
-    email = inprogress_orders[session_id]["customer_info"]["email"]
-    phone = inprogress_orders[session_id]["customer_info"]["phone"]
+    email = session["customer_info"]["email"]
+    phone = session["customer_info"]["phone"]
 
     customer = db_helper.get_customer_by_email_or_phone(email, phone)
     if not customer:
@@ -828,7 +992,7 @@ def process_new_shipping_address(parameters: dict, output_contexts, session_id:
     )
     if new_address_id:
         # Đảm bảo địa chỉ được lưu vào session
-        inprogress_orders[session_id]["shipping_address"] = {
+        session["shipping_address"] = {
             "address_id": new_address_id,
             "receiver_name": receiver_name,
             "receiver_phone": receiver_phone,
@@ -838,6 +1002,7 @@ def process_new_shipping_address(parameters: dict, output_contexts, session_id:
             "postal_code": postal_code,
             "is_default": is_default
         }
+        sessions.save(session_id, session)
         address_text = (
             f"Receiver Name: {receiver_name}\n"
             f"Receiver Phone: {receiver_phone}\n"
@@ -857,8 +1022,10 @@ def process_new_shipping_address(parameters: dict, output_contexts, session_id:
             "fulfillmentText": "Sorry, there was an error saving your new address. Please try again."
         })
 
+@router.intent('confirm-new-address - context: ongoing-new-address')
 def confirm_new_address(parameters: dict, output_contexts, session_id: str):
-    if session_id not in inprogress_orders or not inprogress_orders[session_id].get("shipping_address"):
+    session = sessions.get(session_id)
+    if session is None or not session.get("shipping_address"):
         return JSONResponse(content={
             "fulfillmentText": "No shipping address found. Please provide a new address."
         })
@@ -889,21 +1056,21 @@ def confirm_new_address(parameters: dict, output_contexts, session_id: str):
 
     if "yes" in confirmation or "correct" in confirmation:
         # Đảm bảo địa chỉ vẫn tồn tại trong session
-        address = inprogress_orders[session_id].get("shipping_address")
+        address = session.get("shipping_address")
         if not address:
             return JSONResponse(content={
                 "fulfillmentText": "No shipping address found. Please provide a new address."
             })
 
-        # Lấy danh sách phương thức giao hàng
-        shipping_methods = db_helper.get_shipping_methods()
+        # Lấy danh sách phương thức giao hàng (từ cache)
+        shipping_methods = reference_cache.shipping_methods.rows()
         if not shipping_methods:
             return JSONResponse(content={
                 "fulfillmentText": "Sorry, no shipping methods are available at the moment. Please contact support."
             })
 
         # Tính tổng số lượng sản phẩm trong đơn hàng
-        order_list = inprogress_orders[session_id]["order_list"]
+        order_list = session["order_list"]
         total_quantity = sum(quantity for _, quantity in order_list)
 
         # Giả định khoảng cách (km) để tính thời gian giao hàng
@@ -934,8 +1101,10 @@ def confirm_new_address(parameters: dict, output_contexts, session_id: str):
         "fulfillmentText": "Please confirm if the address is correct (e.g., 'Yes' or let me know what to change)."
     })
 
+@router.intent('confirm-shipping-method - context: ongoing-shipping-method')
 def confirm_shipping_method(parameters: dict, output_contexts, session_id: str):
-    if session_id not in inprogress_orders:
+    session = sessions.get(session_id)
+    if session is None:
         return JSONResponse(content={
             "fulfillmentText": "Session not found. Please start your order again."
         })
@@ -947,19 +1116,14 @@ def confirm_shipping_method(parameters: dict, output_contexts, session_id: str):
             "fulfillmentText": "Please specify a shipping method (e.g., 'I’ll go with Express Shipping')."
         })
 
-    # Lấy danh sách phương thức vận chuyển từ database
-    shipping_methods = db_helper.get_shipping_methods()
-    if not shipping_methods:
+    # Lấy danh sách phương thức vận chuyển từ cache
+    if not reference_cache.shipping_methods.rows():
         return JSONResponse(content={
             "fulfillmentText": "Sorry, no shipping methods are available at the moment. Please contact support."
         })
 
     # Tìm phương thức vận chuyển khớp với lựa chọn của khách hàng
-    selected_method = None
-    for method in shipping_methods:
-        if method["method_name"].lower() == shipping_method_name.lower():
-            selected_method = method
-            break
+    selected_method = reference_cache.shipping_methods.get_by_name(shipping_method_name)
 
     if not selected_method:
         return JSONResponse(content={
@@ -967,7 +1131,7 @@ def confirm_shipping_method(parameters: dict, output_contexts, session_id: str):
         })
 
     # Tính tổng số lượng sản phẩm
-    order_list = inprogress_orders[session_id]["order_list"]
+    order_list = session["order_list"]
     total_quantity = sum(quantity for _, quantity in order_list)
 
     # Tính phí vận chuyển và thời gian giao hàng
@@ -978,14 +1142,15 @@ def confirm_shipping_method(parameters: dict, output_contexts, session_id: str):
     estimated_delivery = (current_date + timedelta(days=delivery_time_days)).strftime("%Y-%m-%d")
 
     # Lưu thông tin phương thức vận chuyển vào session
-    inprogress_orders[session_id]["shipping_info"] = {
+    session["shipping_info"] = {
         "method_name": selected_method["method_name"],
         "shipping_fee": shipping_fee,
         "estimated_delivery": estimated_delivery
     }
+    sessions.save(session_id, session)
 
     # Kiểm tra và lấy địa chỉ giao hàng
-    address = inprogress_orders[session_id].get("shipping_address")
+    address = session.get("shipping_address")
     if not address:
         return JSONResponse(content={
             "fulfillmentText": "No shipping address found. Please provide a delivery address using 'New address' or confirm a default address."
@@ -994,11 +1159,11 @@ def confirm_shipping_method(parameters: dict, output_contexts, session_id: str):
     # Tổng hợp thông tin đơn hàng
     items_ordered = []
     subtotal = 0
+    products_by_id = catalog.get_products_by_ids(pid for pid, _ in order_list)
     for product_id, quantity in order_list:
-        product = db_helper.get_list_products_by_id(product_id)
+        product = products_by_id.get(product_id)
         if not product:
             continue
-        product = product[0]
         product_name = product[0]
         price = float(product[2])
         line_total = price * quantity
@@ -1006,7 +1171,7 @@ def confirm_shipping_method(parameters: dict, output_contexts, session_id: str):
         items_ordered.append(f"- {product_name} x{quantity} (${price:.2f} each) = ${line_total:.2f}")
 
     # Discount (nếu có)
-    discount_info = inprogress_orders[session_id].get("discount", None)
+    discount_info = session.get("discount", None)
     discount_text = ""
     discount_amount = 0
     if discount_info:
@@ -1042,8 +1207,10 @@ def confirm_shipping_method(parameters: dict, output_contexts, session_id: str):
 
     return JSONResponse(content={"fulfillmentText": summary_text})
 
+@router.intent('select-payment-method - context: ongoing-payment-method')
 def select_payment_method(parameters: dict, output_contexts, session_id: str):
-    if session_id not in inprogress_orders:
+    session = sessions.get(session_id)
+    if session is None:
         return JSONResponse(content={
             "fulfillmentText": "Session not found. Please start your order again."
         })
@@ -1055,35 +1222,35 @@ def select_payment_method(parameters: dict, output_contexts, session_id: str):
             "fulfillmentText": "Please specify a payment method (e.g., 'I’ll go with COD' or 'PayPal, please')."
         })
 
-    # Lấy danh sách phương thức thanh toán hợp lệ từ database
-    payment_methods = db_helper.get_payment_methods()  # Cần thêm hàm này trong db_helper.py
-    valid_methods = [method["method_name"] for method in payment_methods]
-
-    # Kiểm tra phương thức thanh toán có hợp lệ không
-    if payment_method not in valid_methods:
+    # Kiểm tra phương thức thanh toán có hợp lệ không (tra cứu trong cache)
+    selected_payment = reference_cache.payment_methods.get_by_name(payment_method)
+    if not selected_payment:
+        valid_methods = [method["method_name"] for method in reference_cache.payment_methods.rows()]
         valid_methods_text = "\n".join([f"- {method}" for method in valid_methods])
         return JSONResponse(content={
             "fulfillmentText": f"Sorry, '{payment_method}' is not a valid payment method. Please choose from the following:\n{valid_methods_text}"
         })
 
     # Lưu phương thức thanh toán vào session
-    inprogress_orders[session_id]["payment_method"] = payment_method
+    payment_method = selected_payment["method_name"]
+    session["payment_method"] = payment_method
+    sessions.save(session_id, session)
 
     # Tổng hợp thông tin đơn hàng
-    order_list = inprogress_orders[session_id]["order_list"]
-    shipping_info = inprogress_orders[session_id].get("shipping_info", {})
+    order_list = session["order_list"]
+    shipping_info = session.get("shipping_info", {})
     shipping_method = shipping_info.get("method_name", "Not specified")
     estimated_delivery = shipping_info.get("estimated_delivery", "Not specified")
-    discount_info = inprogress_orders[session_id].get("discount", {})
-    address = inprogress_orders[session_id].get("shipping_address", {})
+    discount_info = session.get("discount", {})
+    address = session.get("shipping_address", {})
 
     items_ordered = []
     subtotal = 0
+    products_by_id = catalog.get_products_by_ids(pid for pid, _ in order_list)
     for product_id, quantity in order_list:
-        product = db_helper.get_list_products_by_id(product_id)
+        product = products_by_id.get(product_id)
         if not product:
             continue
-        product = product[0]
         product_name = product[0]
         price = float(product[2])
         line_total = price * quantity
@@ -1120,31 +1287,33 @@ def select_payment_method(parameters: dict, output_contexts, session_id: str):
 
     return JSONResponse(content={"fulfillmentText": summary_text})
 
+@router.intent('confirm-order - context: ongoing-order-confirmation')
 def confirm_order_placement(parameters: dict, output_contexts, session_id: str):
-    if session_id not in inprogress_orders:
+    session = sessions.get(session_id)
+    if session is None:
         return JSONResponse(content={
             "fulfillmentText": "Session not found. Please start your order again."
         })
     # Kiểm tra xem thông tin cần thiết đã sẵn sàng chưa
-    if not all(key in inprogress_orders[session_id] for key in ["order_list", "shipping_address", "shipping_info", "payment_method", "customer_info"]):
+    if not all(key in session for key in ["order_list", "shipping_address", "shipping_info", "payment_method", "customer_info"]):
         return JSONResponse(content={
             "fulfillmentText": "Order information is incomplete. Please ensure all steps (products, shipping, and payment) are confirmed."
         })
     # Lấy thông tin từ session
-    order_list = inprogress_orders[session_id]["order_list"]
-    shipping_info = inprogress_orders[session_id]["shipping_info"]
-    payment_method = inprogress_orders[session_id]["payment_method"]
-    address = inprogress_orders[session_id]["shipping_address"]
-    discount_info = inprogress_orders[session_id].get("discount", {})
-    customer_info = inprogress_orders[session_id]["customer_info"]
+    order_list = session["order_list"]
+    shipping_info = session["shipping_info"]
+    payment_method = session["payment_method"]
+    address = session["shipping_address"]
+    discount_info = session.get("discount", {})
+    customer_info = session["customer_info"]
 
     # Tính toán tổng giá trị
     subtotal = 0
+    products_by_id = catalog.get_products_by_ids(pid for pid, _ in order_list)
     for product_id, quantity in order_list:
-        product = db_helper.get_list_products_by_id(product_id)
+        product = products_by_id.get(product_id)
         if not product:
             continue
-        product = product[0]
         price = float(product[2])
         line_total = price * quantity
         subtotal += line_total
@@ -1162,23 +1331,15 @@ def confirm_order_placement(parameters: dict, output_contexts, session_id: str):
     customer_id = customer[0]
 
     # Lấy payment_method_id
-    payment_methods = db_helper.get_payment_methods()
-    payment_method_id = None
-    for method in payment_methods:
-        if method["method_name"].lower() == payment_method.lower():
-            payment_method_id = method["method_id"]
-            break
+    payment_method_row = reference_cache.payment_methods.get_by_name(payment_method)
+    payment_method_id = payment_method_row["method_id"] if payment_method_row else None
     if not payment_method_id:
         return JSONResponse(content={
             "fulfillmentText": f"Payment method '{payment_method}' not found in database."
         })
     # Lấy shipping_method_id
-    shipping_methods = db_helper.get_shipping_methods()
-    shipping_method_id = None
-    for method in shipping_methods:
-        if method["method_name"].lower() == shipping_info["method_name"].lower():
-            shipping_method_id = method["method_id"]
-            break
+    shipping_method_row = reference_cache.shipping_methods.get_by_name(shipping_info["method_name"])
+    shipping_method_id = shipping_method_row["method_id"] if shipping_method_row else None
     if not shipping_method_id:
         return JSONResponse(content={
             "fulfillmentText": f"Shipping method '{shipping_info['method_name']}' not found in database."
@@ -1207,23 +1368,50 @@ def confirm_order_placement(parameters: dict, output_contexts, session_id: str):
         "estimated_delivery_date": shipping_info["estimated_delivery"],
         "order_list": order_list
     }
+    # Khoá idempotency: Dialogflow gửi lại (kể cả sang worker khác) cho ra cùng một khoá nên không tạo đơn thứ hai.
+    # checkout_nonce được tạo khi bắt đầu giỏ (confirm_order) và lưu trong session, nên đặt lại
+    # cùng giỏ hàng sau khi đã đặt xong vẫn là đơn mới. Tổng tiền/phí/giảm giá tính lại từ dữ liệu sống nên không đưa vào.
+    checkout_nonce = session.get("checkout_nonce")
+    if not checkout_nonce:
+        return JSONResponse(content={
+            "fulfillmentText": "Your cart has expired. Please add your products again."
+        })
+    cart_inputs = {
+        "checkout_nonce": checkout_nonce,
+        "customer_id": customer_id,
+        "order_list": sorted((int(product_id), int(quantity)) for product_id, quantity in order_list),
+        "shipping_address_id": shipping_address_id,
+        "shipping_method_id": shipping_method_id,
+        "payment_method_id": payment_method_id,
+        "promotion_id": promotion_id,
+    }
+    order_fingerprint = hashlib.sha256(
+        json.dumps(cart_inputs, sort_keys=True, default=str).encode("utf-8")
+    ).hexdigest()[:32]
+    order_details["idempotency_key"] = f"{session_id}:{order_fingerprint}"
+
     order_id = db_helper.place_order(order_details, session_id)
 
     if not order_id:
         return JSONResponse(content={
             "fulfillmentText": "Failed to place your order due to a database error. Please try again."
         })
+    # Giỏ này đã đặt: lần confirm_order tiếp theo bắt đầu giỏ mới với nonce mới
+    session["placed_checkout_nonce"] = checkout_nonce
+    sessions.save(session_id, session)
     # Trả về order_id để Dialogflow sử dụng trong default response
     return JSONResponse(content={"fulfillmentText": f"Order placed successfully! Order ID: {order_id}. Is there anything else I can help you with today?",})
 
+@router.intent('end-conversation - context: ongoing-order-complete')
 def end_conversation(parameters: dict, output_contexts, session_id: str):
     try:
-        if session_id not in inprogress_orders or "payment_method" not in inprogress_orders[session_id]:
+        session = sessions.get(session_id)
+        if session is None or "payment_method" not in session:
             return JSONResponse(content={
                 "fulfillmentText": "It seems your order was not completed. Please start a new order if needed."
             })
 
-        payment_method = inprogress_orders[session_id]["payment_method"]
+        payment_method = session["payment_method"]
         is_cod = payment_method.lower() == "cash on delivery"
 
         if is_cod:
@@ -1232,18 +1420,12 @@ def end_conversation(parameters: dict, output_contexts, session_id: str):
             response_text = f"Thank you! Since you've chosen {payment_method}, we'll now redirect you to the secure payment page to complete your transaction. If you have questions in the future, don't hesitate to ask."
 
         # Xóa session sau khi hoàn tất
-        if session_id in inprogress_orders:
-            del inprogress_orders[session_id]
+        sessions.delete(session_id)
 
         # Tạo session path để xóa các context liên quan
         # Session ID từ Dialogflow thường có format: projects/.../sessions/[session-id]
         # Chúng ta cần lấy full path từ output_contexts nếu có
-        session_path = session_id
-        if output_contexts and len(output_contexts) > 0:
-            # Lấy path từ context đầu tiên làm template
-            first_context_name = output_contexts[0].get('name', '')
-            if '/contexts/' in first_context_name:
-                session_path = first_context_name.split('/contexts/')[0]
+        session_path = output_contexts.session_path or session_id
 
         return JSONResponse(content={
             "fulfillmentText": response_text,
@@ -1282,25 +1464,29 @@ def end_conversation(parameters: dict, output_contexts, session_id: str):
             "fulfillmentText": "Thank you for your order! We'll process it shortly."
         })
         
+@router.intent('cancel-order - context: ongoing-order-confirmation')
 def cancel_order(parameters: dict, output_contexts, session_id: str):
-    if session_id not in inprogress_orders:
+    session = sessions.get(session_id)
+    if session is None:
         return JSONResponse(content={
             "fulfillmentText": "No order found to cancel. You can start a new order if you'd like!"
         })
 
     # Xóa toàn bộ session
-    del inprogress_orders[session_id]
+    sessions.delete(session_id)
 
     # Sử dụng default response từ Dialogflow
     return JSONResponse(content={"fulfillmentText": "Got it! Your order has been canceled as requested. If you change your mind, feel free to start a new order anytime. Thank you for visiting us. Let me know if there's anything else I can help with!"})
 
+@router.intent('remove-items - context: ongoing-order-confirmation')
 def remove_items(parameters: dict, output_contexts, session_id: str):
-    if session_id not in inprogress_orders:
+    session = sessions.get(session_id)
+    if session is None:
         return JSONResponse(content={
             "fulfillmentText": "No order found to modify. You can start a new order if you'd like!"
         })
 
-    order_list = inprogress_orders[session_id].get("order_list", [])
+    order_list = session.get("order_list", [])
     if not order_list:
         return JSONResponse(content={
             "fulfillmentText": "Your order is empty. You can start adding items if you'd like!"
@@ -1324,13 +1510,15 @@ def remove_items(parameters: dict, output_contexts, session_id: str):
     # Danh sách sản phẩm bị xóa
     removed_items = []
     updated_order_list = []
+    # Một truy vấn cho toàn bộ giỏ hàng (cả hiển thị tên và tính lại tổng)
+    products_by_id = catalog.get_products_by_ids(pid for pid, _ in order_list)
 
     for product_id, quantity in order_list:
         if product_id in product_ids_to_remove:
             # Lấy thông tin sản phẩm để hiển thị tên
-            product = db_helper.get_list_products_by_id(product_id)
+            product = products_by_id.get(product_id)
             if product:
-                product_name = product[0][0]
+                product_name = product[0]
                 removed_items.append(product_name)
         else:
             updated_order_list.append((product_id, quantity))
@@ -1341,11 +1529,11 @@ def remove_items(parameters: dict, output_contexts, session_id: str):
         })
 
     # Cập nhật order_list trong session
-    inprogress_orders[session_id]["order_list"] = updated_order_list
+    session["order_list"] = updated_order_list
 
     # Nếu order_list trống sau khi xóa, hủy toàn bộ đơn hàng
     if not updated_order_list:
-        del inprogress_orders[session_id]
+        sessions.delete(session_id)
         return JSONResponse(content={
             "fulfillmentText": "All items have been removed, and your order has been canceled. You can start a new order if you'd like!"
         })
@@ -1353,15 +1541,16 @@ def remove_items(parameters: dict, output_contexts, session_id: str):
     # Tính lại tổng giá trị đơn hàng
     total_amount = 0
     for product_id, quantity in updated_order_list:
-        product = db_helper.get_list_products_by_id(product_id)
+        product = products_by_id.get(product_id)
         if not product:
             continue
-        price = float(product[0][2])
+        price = float(product[2])
         total_amount += price * quantity
 
     # Xóa mã giảm giá hiện tại (vì tổng giá trị đơn hàng đã thay đổi)
-    if "discount" in inprogress_orders[session_id]:
-        del inprogress_orders[session_id]["discount"]
+    if "discount" in session:
+        del session["discount"]
+    sessions.save(session_id, session)
 
     # Lấy danh sách mã giảm giá hợp lệ
     promotions = db_helper.get_available_promotions(total_amount)
@@ -1393,6 +1582,7 @@ def remove_items(parameters: dict, output_contexts, session_id: str):
 
     return JSONResponse(content={"fulfillmentText": response_text})
 
+@router.intent('showlist.confirm - context: ongoing-tracking')
 def show_customer_orders(parameters: dict, output_contexts, session_id: str):
     """
     Handle 'show customer orders' intent to display all orders for a customer.
@@ -1473,6 +1663,7 @@ def show_customer_orders(parameters: dict, output_contexts, session_id: str):
 
     return JSONResponse(content={"fulfillmentText": fulfillment_text})
 
+@router.intent('delete - context: ongoing-tracking')
 def delete_order_handler(parameters: dict, output_contexts, session_id: str):
     """
     Handle 'delete order' intent to delete a specific order by Order_ID if its status is 'processing'.
@@ -1503,30 +1694,15 @@ def delete_order_handler(parameters: dict, output_contexts, session_id: str):
         else:
             fulfillment_text = f"Sorry, I cannot delete Order ID {order_id}. The order may not exist or is not in 'Processing' status. Only orders with 'Processing' status can be cancelled."
         
-        # Extract base session path from existing output contexts
-        base_session_path = None
-        if output_contexts:
-            for context in output_contexts:
-                if context.get('name'):
-                    # Extract base path from existing context
-                    context_name = context['name']
-                    if '/contexts/' in context_name:
-                        base_session_path = context_name.split('/contexts/')[0]
-                        break
-        
-        # Fallback if we can't extract from contexts
-        if not base_session_path:
-            base_session_path = f"projects/shopdbchatbot-nhmk/locations/global/agent/sessions/{session_id}"
-        
         response = {
             "fulfillmentText": fulfillment_text,
             "outputContexts": [
                 {
-                    "name": f"{base_session_path}/contexts/ongoing-tracking",
+                    "name": output_contexts.context_path("ongoing-tracking", session_id),
                     "lifespanCount": 0
                 },
                 {
-                    "name": f"{base_session_path}/contexts/delete-tracking-ordered", 
+                    "name": output_contexts.context_path("delete-tracking-ordered", session_id),
                     "lifespanCount": 0
                 }
             ]
@@ -1539,6 +1715,7 @@ def delete_order_handler(parameters: dict, output_contexts, session_id: str):
         }
         return JSONResponse(content=error_response)
                 
+@router.intent('update.address.confirm - context: ongoing-tracking')
 def update_shipping_address_handler(parameters: dict, output_contexts, session_id: str):
     try:
         # Extract parameters - không cần .strip() vì đã là số
@@ -1609,19 +1786,19 @@ def update_shipping_address_handler(parameters: dict, output_contexts, session_i
             "status": 500
         }
         
-def submit_review_start(parameters: dict, output_contexts: list, session_id: str):
+@router.intent('submit_review_start')
+def submit_review_start(parameters: dict, output_contexts: generic_helper.ContextMap, session_id: str):
     unreviewed_products = db_helper.get_unreviewed_products(customer_id)
     unreviewed_products = convert_decimals_to_floats(unreviewed_products)
-    product = parameters.get("product")
-    if isinstance(product, list):
-        product = product[0] if product else None
+    product = generic_helper.first_value(parameters.get("product"))
 
     if not unreviewed_products:
         fulfillment_text = "It looks like you haven’t purchased any products yet, or all your products are already reviewed!"
         return JSONResponse(content={"fulfillmentText": fulfillment_text})
 
     if product:
-        product_details = db_helper.get_product_details(product)
+        product = resolve_review_product(product, [p[0] for p in unreviewed_products])
+        product_details = catalog.get_product_details(product)
         if product_details:
             product_details = list(product_details)
             product_details[1] = float(product_details[1])  # Chuyển đổi Decimal thành float
@@ -1643,29 +1820,23 @@ def submit_review_start(parameters: dict, output_contexts: list, session_id: str
 
     return JSONResponse(content={"fulfillmentText": fulfillment_text})
 
-def submit_review_product_confirm(parameters: dict, output_contexts: list, session_id: str):
-    product = parameters.get("product")
-    if isinstance(product, list):
-        product = product[0] if product else None
-    initial_comment = parameters.get("initial_comment", "")
-    if isinstance(initial_comment, list):
-        initial_comment = initial_comment[0] if initial_comment else ""
+@router.intent('submit_review_product_confirm')
+def submit_review_product_confirm(parameters: dict, output_contexts: generic_helper.ContextMap, session_id: str):
+    product = generic_helper.first_value(parameters.get("product"))
+    initial_comment = generic_helper.first_value(parameters.get("initial_comment"), "")
 
     unreviewed_products = db_helper.get_unreviewed_products(customer_id)
     unreviewed_products = convert_decimals_to_floats(unreviewed_products)
     if not product:
-        for context in output_contexts:
-            if context["name"].endswith("submit_review_active"):
-                params = context.get("parameters", {})
-                product = params.get("product")
-                break
+        product = output_contexts.param("submit_review_active", "product")
 
     if not product:
         product_list = ", ".join([f"{p[0]} (${p[1]}, {p[2]} brand, {p[3]} category)" for p in unreviewed_products])
         fulfillment_text = f"Please specify a product to review from the list: {product_list}, or say 'cancel' to exit."
         return JSONResponse(content={"fulfillmentText": fulfillment_text})
 
-    product_details = db_helper.get_product_details(product)
+    product = resolve_review_product(product, [p[0] for p in unreviewed_products])
+    product_details = catalog.get_product_details(product)
     if product_details:
         product_details = list(product_details)
         product_details[1] = float(product_details[1])  # Chuyển đổi Decimal thành float
@@ -1683,33 +1854,20 @@ def submit_review_product_confirm(parameters: dict, output_contexts: list, sessi
                        f"Please confirm or provide additional details, and I’ll submit the review for you, or say 'cancel' to exit.")
     return JSONResponse(content={"fulfillmentText": fulfillment_text,})
 
-def submit_review_details_collect(parameters: dict, output_contexts: list, session_id: str):
-    product = parameters.get("product") or parameters.get("product-name")
-    rating = parameters.get("rating")
-    comment = parameters.get("comment", "")
-    
-    if isinstance(product, list):
-        product = product[0] if product else None
-    if isinstance(rating, list):
-        rating = rating[0] if rating else None
-    if isinstance(comment, list):
-        comment = comment[0] if comment else ""
+@router.intent('submit_review_details_collect')
+def submit_review_details_collect(parameters: dict, output_contexts: generic_helper.ContextMap, session_id: str):
+    product = generic_helper.first_value(parameters.get("product") or parameters.get("product-name"))
+    rating = generic_helper.first_value(parameters.get("rating"))
+    comment = generic_helper.first_value(parameters.get("comment"), "")
 
     unreviewed_products = db_helper.get_unreviewed_products(customer_id)
     unreviewed_products = convert_decimals_to_floats(unreviewed_products)
     if not product:
-        for context in output_contexts:
-            if context["name"].endswith("submit_review_active"):
-                params = context.get("parameters", {})
-                context_product = params.get("product") or params.get("product-name")
-                # Xử lý context product cũng có thể là array
-                if isinstance(context_product, list):
-                    product = context_product[0] if context_product else None
-                else:
-                    product = context_product
-                break
+        product = (output_contexts.param("submit_review_active", "product")
+                   or output_contexts.param("submit_review_active", "product-name"))
 
     product_names = [p[0] for p in unreviewed_products]
+    product = resolve_review_product(product, product_names)
     if not product or product not in product_names:
         product_list = ", ".join([f"{p[0]} (${p[1]}, {p[2]} brand, {p[3]} category)" for p in unreviewed_products])
         if not unreviewed_products:
@@ -1738,30 +1896,13 @@ def submit_review_details_collect(parameters: dict, output_contexts: list, sessi
                        f"Would you like to edit your rating or comment before I submit it? Or say 'submit it now' to proceed, or 'cancel' to exit.")
     return JSONResponse(content={"fulfillmentText": fulfillment_text})
 
-def submit_review_edit(parameters: dict, output_contexts: list, session_id: str):
+@router.intent('submit_review_edit')
+def submit_review_edit(parameters: dict, output_contexts: generic_helper.ContextMap, session_id: str):
     # Trích xuất từ context
-    product = None
-    rating = None
-    comment = None
-    unreviewed_products = None
-    for context in output_contexts:
-        if context["name"].endswith("submit_review_confirm"):
-            params = context.get("parameters", {})
-            product = params.get("product")
-            rating = params.get("rating")
-            comment = params.get("comment")
-            unreviewed_products = params.get("unreviewed_products")
-            break
-
-    # Xử lý kiểu dữ liệu
-    if isinstance(product, list):
-        product = product[0] if product else None
-    if isinstance(rating, list):
-        rating = rating[0] if rating else None
-    if isinstance(comment, list):
-        comment = comment[0] if comment else None
-    if isinstance(unreviewed_products, list):
-        unreviewed_products = unreviewed_products if unreviewed_products else []
+    product = output_contexts.param("submit_review_confirm", "product")
+    rating = output_contexts.param("submit_review_confirm", "rating")
+    comment = output_contexts.param("submit_review_confirm", "comment")
+    unreviewed_products = output_contexts.raw_param("submit_review_confirm", "unreviewed_products")
 
     # Debug log để kiểm tra giá trị từ context
     debug_info = f"Context values - product: {product}, rating: {rating}, comment: {comment}, unreviewed_products: {unreviewed_products}"
@@ -1773,9 +1914,7 @@ def submit_review_edit(parameters: dict, output_contexts: list, session_id: str)
         rating = None
 
     # Trích xuất new_rating từ @Rating
-    new_rating = parameters.get("new_rating")
-    if isinstance(new_rating, list):
-        new_rating = new_rating[0] if new_rating else None
+    new_rating = generic_helper.first_value(parameters.get("new_rating"))
     if new_rating:  # Chỉ xử lý nếu new_rating không rỗng
         try:
             # Trích xuất số từ @Rating (ví dụ: "4 stars" -> 4)
@@ -1787,10 +1926,7 @@ def submit_review_edit(parameters: dict, output_contexts: list, session_id: str)
             new_rating = None
 
     # Trích xuất new_comment
-    new_comment = parameters.get("new_comment")
-    if isinstance(new_comment, list):
-        new_comment = new_comment[0] if new_comment else None
-    new_comment = new_comment if new_comment else None
+    new_comment = generic_helper.first_value(parameters.get("new_comment")) or None
 
     # Cập nhật rating và comment
     rating = new_rating if new_rating is not None and new_rating != "" else rating
@@ -1811,41 +1947,16 @@ def submit_review_edit(parameters: dict, output_contexts: list, session_id: str)
                        f"Would you like to make more changes, or say 'submit it now' to proceed, or 'cancel' to exit?")
     return JSONResponse(content={"fulfillmentText": fulfillment_text})
 
-def submit_review_submit(parameters: dict, output_contexts: list, session_id: str):
-    product = None
-    rating = None
-    comment = None
-    new_rating = None
-    new_comment = None
-    unreviewed_products = None
-    
+@router.intent('submit_review_submit')
+def submit_review_submit(parameters: dict, output_contexts: generic_helper.ContextMap, session_id: str):
     # Lấy thông tin từ context submit_review_confirm
-    for context in output_contexts:
-        if context["name"].endswith("submit_review_confirm"):
-            params = context.get("parameters", {})
-            product = params.get("product") or params.get("product-name")
-            rating = params.get("rating")
-            comment = params.get("comment")
-            new_rating = params.get("new_rating")
-            new_comment = params.get("new_comment")
-            unreviewed_products = params.get("unreviewed_products")
-            break
-
-    # Xử lý kiểu dữ liệu cho các giá trị cũ
-    if isinstance(product, list):
-        product = product[0] if product else None
-    if isinstance(rating, list):
-        rating = rating[0] if rating else None
-    if isinstance(comment, list):
-        comment = comment[0] if comment else ""
-    if isinstance(unreviewed_products, list):
-        unreviewed_products = unreviewed_products if unreviewed_products else []
-
-    # Xử lý kiểu dữ liệu cho các giá trị mới
-    if isinstance(new_rating, list):
-        new_rating = new_rating[0] if new_rating else None
-    if isinstance(new_comment, list):
-        new_comment = new_comment[0] if new_comment else None
+    product = (output_contexts.param("submit_review_confirm", "product")
+               or output_contexts.param("submit_review_confirm", "product-name"))
+    rating = output_contexts.param("submit_review_confirm", "rating")
+    comment = output_contexts.param("submit_review_confirm", "comment", "")
+    new_rating = output_contexts.param("submit_review_confirm", "new_rating")
+    new_comment = output_contexts.param("submit_review_confirm", "new_comment")
+    unreviewed_products = output_contexts.raw_param("submit_review_confirm", "unreviewed_products")
 
     # Ưu tiên giá trị mới nếu có, không thì lấy giá trị cũ
     final_rating = new_rating if new_rating is not None and new_rating != "" else rating
@@ -1885,6 +1996,7 @@ def submit_review_submit(parameters: dict, output_contexts: list, session_id: st
 
     # Xác nhận sản phẩm hợp lệ
     product_names = [p[0] for p in full_unreviewed_products]
+    product = resolve_review_product(product, product_names)
     if product not in product_names:
         if full_unreviewed_products:
             product_list = ", ".join([f"{p[0]} (${p[1]}, {p[2]} brand, {p[3]} category)" for p in full_unreviewed_products])
@@ -1900,9 +2012,6 @@ def submit_review_submit(parameters: dict, output_contexts: list, session_id: st
         print(f"Review submitted successfully with ID: {review_id}")
         review_date = datetime.now().strftime("%Y-%m-%d")
         
-        # Tạo session path
-        session_path = session_id.split('/sessions/')[0] + '/sessions/' + session_id.split('/sessions/')[1]
-        
         # Lấy danh sách sản phẩm còn lại sau khi submit
         remaining_products = db_helper.get_unreviewed_products(customer_id)
         remaining_products = convert_decimals_to_floats(remaining_products)
@@ -1927,7 +2036,7 @@ def submit_review_submit(parameters: dict, output_contexts: list, session_id: st
                 "fulfillmentText": fulfillment_text,
                 "outputContexts": [
                     {
-                        "name": f"{session_path}/contexts/submit_review_continue-followup",
+                        "name": output_contexts.context_path("submit_review_continue-followup", session_id),
                         "lifespanCount": 5,
                         "parameters": {
                             "remaining_products": [p[0] for p in remaining_products],
@@ -1937,7 +2046,7 @@ def submit_review_submit(parameters: dict, output_contexts: list, session_id: st
                         }
                     },
                     {
-                        "name": f"{session_path}/contexts/submit_review_delete",
+                        "name": output_contexts.context_path("submit_review_delete", session_id),
                         "lifespanCount": 5,
                         "parameters": {
                             "remaining_products": [p[0] for p in remaining_products],
@@ -1948,11 +2057,11 @@ def submit_review_submit(parameters: dict, output_contexts: list, session_id: st
                     },
                     # Disable các context khác để tránh conflict
                     {
-                        "name": f"{session_path}/contexts/submit_review_active",
+                        "name": output_contexts.context_path("submit_review_active", session_id),
                         "lifespanCount": 0
                     },
                     {
-                        "name": f"{session_path}/contexts/submit_review_confirm",
+                        "name": output_contexts.context_path("submit_review_confirm", session_id),
                         "lifespanCount": 0
                     }
                 ]
@@ -1966,7 +2075,7 @@ def submit_review_submit(parameters: dict, output_contexts: list, session_id: st
                 "fulfillmentText": fulfillment_text,
                 "outputContexts": [
                     {
-                        "name": f"{session_path}/contexts/submit_review_delete",
+                        "name": output_contexts.context_path("submit_review_delete", session_id),
                         "lifespanCount": 5,
                         "parameters": {
                             "flow_state": "completed",
@@ -1976,15 +2085,15 @@ def submit_review_submit(parameters: dict, output_contexts: list, session_id: st
                     },
                     # Clear tất cả contexts khác
                     {
-                        "name": f"{session_path}/contexts/submit_review_active",
+                        "name": output_contexts.context_path("submit_review_active", session_id),
                         "lifespanCount": 0
                     },
                     {
-                        "name": f"{session_path}/contexts/submit_review_confirm",
+                        "name": output_contexts.context_path("submit_review_confirm", session_id),
                         "lifespanCount": 0
                     },
                     {
-                        "name": f"{session_path}/contexts/submit_review_continue-followup",
+                        "name": output_contexts.context_path("submit_review_continue-followup", session_id),
                         "lifespanCount": 0
                     }
                 ]
@@ -1995,17 +2104,16 @@ def submit_review_submit(parameters: dict, output_contexts: list, session_id: st
         fulfillment_text = f"Error: Failed to save review to database. Debug info - error: {str(e)}. Please try again, or say 'cancel' to exit."
         return JSONResponse(content={"fulfillmentText": fulfillment_text})
         
-def submit_review_continue(parameters: dict, output_contexts: list, session_id: str):
-    product = parameters.get("product")
-    if isinstance(product, list):
-        product = product[0] if product else None
+@router.intent('submit_review_continue')
+def submit_review_continue(parameters: dict, output_contexts: generic_helper.ContextMap, session_id: str):
+    product = generic_helper.first_value(parameters.get("product"))
 
     # Lấy remaining_products từ context nếu có
     remaining_products_from_context = None
-    for context in output_contexts:
-        if "continue_review_mode" in context["name"] or "submit_review_continue-followup" in context["name"]:
-            params = context.get("parameters", {})
-            remaining_products_from_context = params.get("remaining_products") or params.get("unreviewed_products")
+    for context_name in ("continue_review_mode", "submit_review_continue-followup"):
+        remaining_products_from_context = (output_contexts.raw_param(context_name, "remaining_products")
+                                           or output_contexts.raw_param(context_name, "unreviewed_products"))
+        if remaining_products_from_context:
             break
 
     # Nếu không có context, lấy từ database
@@ -2022,7 +2130,8 @@ def submit_review_continue(parameters: dict, output_contexts: list, session_id:
         return JSONResponse(content={"fulfillmentText": fulfillment_text})
 
     if product:
-        product_details = db_helper.get_product_details(product)
+        product = resolve_review_product(product, [p[0] for p in unreviewed_products])
+        product_details = catalog.get_product_details(product)
         if product_details:
             product_details = list(product_details)
             product_details[1] = float(product_details[1])
@@ -2030,8 +2139,6 @@ def submit_review_continue(parameters: dict, output_contexts: list, session_id:
         product_names = [p[0] for p in unreviewed_products]
         if product_details and product in product_names:
             # Chuyển sang intent để nhập rating và comment
-            session_path = session_id.split('/sessions/')[0] + '/sessions/' + session_id.split('/sessions/')[1]
-            
             fulfillment_text = (f"Thanks for choosing {product} (${product_details[1]}, {product_details[5]} brand, "
                                f"{product_details[6]} category)! Please provide your rating (1-5 stars) and any comments for this product.")
             
@@ -2047,57 +2154,49 @@ def submit_review_continue(parameters: dict, output_contexts: list, session_id:
 
     return JSONResponse(content={"fulfillment_text": fulfillment_text})
 
-def submit_review_end(parameters: dict, output_contexts: list, session_id: str):
+@router.intent('submit_review_end')
+def submit_review_end(parameters: dict, output_contexts: generic_helper.ContextMap, session_id: str):
     fulfillment_text = ("You’re welcome, John! Thanks for taking the time to share your review. "
                         "Your feedback is valuable and helps us improve our products and services. "
                         "If you have any other questions or need assistance with anything else, "
                         "just let me know. Have a great day!")
     
-    # Tạo session path để xóa các context liên quan
-    session_path = session_id.split('/sessions/')[0] + '/sessions/' + session_id.split('/sessions/')[1]
-
     return JSONResponse(content={
         "fulfillmentText": fulfillment_text,
         "outputContexts": [
             # Xóa tất cả các context liên quan đến submit_review
             {
-                "name": f"{session_path}/contexts/submit_review_active",
+                "name": output_contexts.context_path("submit_review_active", session_id),
                 "lifespanCount": 0
             },
             {
-                "name": f"{session_path}/contexts/submit_review_confirm",
+                "name": output_contexts.context_path("submit_review_confirm", session_id),
                 "lifespanCount": 0
             },
             {
-                "name": f"{session_path}/contexts/submit_review_continue-followup",
+                "name": output_contexts.context_path("submit_review_continue-followup", session_id),
                 "lifespanCount": 0
             },
             {
-                "name": f"{session_path}/contexts/submit_review_collect",
+                "name": output_contexts.context_path("submit_review_collect", session_id),
                 "lifespanCount": 0
             },
             {
-                "name": f"{session_path}/contexts/submit_review_finalize",
+                "name": output_contexts.context_path("submit_review_finalize", session_id),
                 "lifespanCount": 0
             },
             {
-                "name": f"{session_path}/contexts/submit_review_delete",
+                "name": output_contexts.context_path("submit_review_delete", session_id),
                 "lifespanCount": 0
             }
         ]
     })
 
-def submit_review_cancel(parameters: dict, output_contexts: list, session_id: str):
-    review_id = None
-    
+@router.intent('submit_review_cancel')
+def submit_review_cancel(parameters: dict, output_contexts: generic_helper.ContextMap, session_id: str):
     # Tìm review_id từ các output contexts
-    for context in output_contexts:
-        context_params = context.get("parameters", {})
-        if "last_review_id" in context_params:
-            review_id = context_params["last_review_id"]
-            print(f"Found review_id in context {context['name']}: {review_id}")
-            break
-    
+    review_id = output_contexts.find_param("last_review_id")
+
     # Fallback: thử lấy từ parameters nếu không tìm thấy trong contexts
     if review_id is None:
         review_id = parameters.get("last_review_id")
@@ -2118,19 +2217,16 @@ def submit_review_cancel(parameters: dict, output_contexts: list, session_id: st
     fulfillment_text = ("No problem, John! I've canceled the review process. "
                         "If you need help with something else, like tracking orders or finding new products.")
     
-    # Tạo session path để xóa các context liên quan
-    session_path = session_id.split('/sessions/')[0] + '/sessions/' + session_id.split('/sessions/')[1]
-    
     return JSONResponse(content={"fulfillmentText": fulfillment_text})
 
-def submit_review_select_different_product(parameters: dict, output_contexts: list, session_id: str):
-    product = parameters.get("product")
-    if isinstance(product, list):
-        product = product[0] if product else None
+@router.intent('submit_review_select_different_product')
+def submit_review_select_different_product(parameters: dict, output_contexts: generic_helper.ContextMap, session_id: str):
+    product = generic_helper.first_value(parameters.get("product"))
 
     unreviewed_products = db_helper.get_unreviewed_products(customer_id)
     unreviewed_products = convert_decimals_to_floats(unreviewed_products)
-    product_details = db_helper.get_product_details(product)
+    product = resolve_review_product(product, [p[0] for p in unreviewed_products])
+    product_details = catalog.get_product_details(product)
     if product_details:
         product_details = list(product_details)
         product_details[1] = float(product_details[1])  # Chuyển đổi Decimal thành float
@@ -2143,7 +2239,7 @@ def submit_review_select_different_product(parameters: dict, output_contexts: li
         return JSONResponse(content={
             "fulfillmentText": fulfillment_text,
             "outputContexts": [{
-                "name": f"projects/{session_id}/agent/sessions/{session_id}/contexts/submit_review_active",
+                "name": output_contexts.context_path("submit_review_active", session_id),
                 "lifespanCount": 5,
                 "parameters": {"unreviewed_products": [p[0] for p in unreviewed_products]}
             }]
@@ -2157,7 +2253,7 @@ def submit_review_select_different_product(parameters: dict, output_contexts: li
     return JSONResponse(content={
         "fulfillmentText": fulfillment_text,
         "outputContexts": [{
-            "name": f"projects/{session_id}/agent/sessions/{session_id}/contexts/submit_review_active",
+            "name": output_contexts.context_path("submit_review_active", session_id),
             "lifespanCount": 5,
             "parameters": {
                 "product": product,
@@ -0,0 +1,35 @@
+-- Publish product/brand changes on the "catalog_changed" channel so that
+-- catalog_cache.py can refresh only the affected rows.
+-- Payload: {"table": "product" | "brand", "op": "INSERT" | "UPDATE" | "DELETE", "id": <primary key>}
+
+CREATE OR REPLACE FUNCTION notify_catalog_change() RETURNS trigger AS $$
+DECLARE
+    changed_row jsonb;
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        changed_row := to_jsonb(OLD);
+    ELSE
+        changed_row := to_jsonb(NEW);
+    END IF;
+
+    PERFORM pg_notify(
+        'catalog_changed',
+        json_build_object(
+            'table', TG_TABLE_NAME,
+            'op', TG_OP,
+            'id', (changed_row ->> TG_ARGV[0])::int
+        )::text
+    );
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS product_catalog_changed ON product;
+CREATE TRIGGER product_catalog_changed
+    AFTER INSERT OR UPDATE OR DELETE ON product
+    FOR EACH ROW EXECUTE FUNCTION notify_catalog_change('product_id');
+
+DROP TRIGGER IF EXISTS brand_catalog_changed ON brand;
+CREATE TRIGGER brand_catalog_changed
+    AFTER INSERT OR UPDATE OR DELETE ON brand
+    FOR EACH ROW EXECUTE FUNCTION notify_catalog_change('brand_id');
@@ -0,0 +1,10 @@
+-- One "Order" row per chatbot checkout, even when Dialogflow re-sends the
+-- confirm-order webhook or two workers handle the same turn.
+-- db_helper.place_order() stores the checkout key here and, on a unique
+-- violation, returns the order that was already placed.
+
+ALTER TABLE "Order" ADD COLUMN IF NOT EXISTS Idempotency_Key text;
+
+CREATE UNIQUE INDEX IF NOT EXISTS order_idempotency_key_uq
+    ON "Order" (Idempotency_Key)
+    WHERE Idempotency_Key IS NOT NULL;
@@ -0,0 +1,20 @@
+-- Indexes behind the keyset pagination of /api/products and /api/orders
+-- (db_helper.search_products / get_customer_orders with limit + after).
+
+-- Orders of one customer, newest first: ORDER BY order_date DESC, order_id DESC.
+-- /api/orders reads order_summary since migration 010; this index still serves
+-- the o.customer_id lookup of db_helper.get_unreviewed_products.
+CREATE INDEX IF NOT EXISTS order_customer_date_idx
+    ON "Order" (customer_id, order_date DESC, order_id DESC);
+
+-- Items of the orders on a page
+CREATE INDEX IF NOT EXISTS order_item_order_id_idx
+    ON order_item (order_id);
+
+-- Catalog pages filtered by category, in product_id order
+CREATE INDEX IF NOT EXISTS product_category_product_idx
+    ON product (category_id, product_id);
+
+-- Per-product rating of the rows on a page
+CREATE INDEX IF NOT EXISTS review_product_id_idx
+    ON review (product_id);
@@ -0,0 +1,8 @@
+-- Indexes for the filters of /api/products (db_helper.search_products):
+-- price_range becomes price >= min AND price < max.
+-- (Text search uses the tsvector index of migration 006.)
+
+CREATE INDEX IF NOT EXISTS product_price_idx
+    ON product (price, product_id);
+
+ANALYZE product;
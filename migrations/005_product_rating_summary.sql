@@ -0,0 +1,89 @@
+-- Per-product rating aggregates read by db_helper.search_products instead of
+-- averaging the review table on every /api/products call.
+-- Kept in step with review by the trigger below, so insert_review,
+-- delete_review_by_id and any manual edit of review all update it in the
+-- same transaction as the review row.
+
+CREATE TABLE IF NOT EXISTS product_rating_summary (
+    product_id   int PRIMARY KEY REFERENCES product (product_id) ON DELETE CASCADE,
+    review_count int NOT NULL DEFAULT 0,
+    rating_sum   numeric NOT NULL DEFAULT 0,
+    rating_avg   numeric GENERATED ALWAYS AS (
+                     CASE WHEN review_count > 0 THEN rating_sum / review_count END
+                 ) STORED,
+    -- Star histogram: ratings rounded to the nearest star
+    stars_1      int NOT NULL DEFAULT 0,
+    stars_2      int NOT NULL DEFAULT 0,
+    stars_3      int NOT NULL DEFAULT 0,
+    stars_4      int NOT NULL DEFAULT 0,
+    stars_5      int NOT NULL DEFAULT 0
+);
+
+-- Add (sign = 1) or remove (sign = -1) one rating of a product
+CREATE OR REPLACE FUNCTION apply_product_rating(p_product_id int, p_rating numeric, sign int) RETURNS void AS $$
+DECLARE
+    star int := LEAST(GREATEST(round(p_rating)::int, 1), 5);
+BEGIN
+    INSERT INTO product_rating_summary AS s
+        (product_id, review_count, rating_sum, stars_1, stars_2, stars_3, stars_4, stars_5)
+    VALUES (
+        p_product_id, sign, sign * p_rating,
+        CASE WHEN star = 1 THEN sign ELSE 0 END,
+        CASE WHEN star = 2 THEN sign ELSE 0 END,
+        CASE WHEN star = 3 THEN sign ELSE 0 END,
+        CASE WHEN star = 4 THEN sign ELSE 0 END,
+        CASE WHEN star = 5 THEN sign ELSE 0 END
+    )
+    ON CONFLICT (product_id) DO UPDATE SET
+        review_count = s.review_count + EXCLUDED.review_count,
+        rating_sum   = s.rating_sum + EXCLUDED.rating_sum,
+        stars_1      = s.stars_1 + EXCLUDED.stars_1,
+        stars_2      = s.stars_2 + EXCLUDED.stars_2,
+        stars_3      = s.stars_3 + EXCLUDED.stars_3,
+        stars_4      = s.stars_4 + EXCLUDED.stars_4,
+        stars_5      = s.stars_5 + EXCLUDED.stars_5;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION maintain_product_rating_summary() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.rating IS NOT NULL THEN
+        -- The product itself may be gone already (cascading delete)
+        IF EXISTS (SELECT 1 FROM product_rating_summary WHERE product_id = OLD.product_id) THEN
+            PERFORM apply_product_rating(OLD.product_id, OLD.rating, -1);
+        END IF;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.rating IS NOT NULL THEN
+        PERFORM apply_product_rating(NEW.product_id, NEW.rating, 1);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Trigger and backfill in one transaction: no review can be written between them
+BEGIN;
+
+DROP TRIGGER IF EXISTS review_rating_summary ON review;
+CREATE TRIGGER review_rating_summary
+    AFTER INSERT OR DELETE OR UPDATE OF product_id, rating ON review
+    FOR EACH ROW EXECUTE FUNCTION maintain_product_rating_summary();
+
+-- Backfill from the existing reviews (the trigger keeps it current from here on)
+LOCK TABLE review IN SHARE MODE;
+TRUNCATE product_rating_summary;
+INSERT INTO product_rating_summary
+    (product_id, review_count, rating_sum, stars_1, stars_2, stars_3, stars_4, stars_5)
+SELECT
+    product_id,
+    COUNT(*),
+    SUM(rating),
+    COUNT(*) FILTER (WHERE LEAST(GREATEST(round(rating)::int, 1), 5) = 1),
+    COUNT(*) FILTER (WHERE LEAST(GREATEST(round(rating)::int, 1), 5) = 2),
+    COUNT(*) FILTER (WHERE LEAST(GREATEST(round(rating)::int, 1), 5) = 3),
+    COUNT(*) FILTER (WHERE LEAST(GREATEST(round(rating)::int, 1), 5) = 4),
+    COUNT(*) FILTER (WHERE LEAST(GREATEST(round(rating)::int, 1), 5) = 5)
+FROM review
+WHERE rating IS NOT NULL AND product_id IN (SELECT product_id FROM product)
+GROUP BY product_id;
+
+COMMIT;
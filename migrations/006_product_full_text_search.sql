@@ -0,0 +1,58 @@
+-- Full-text search for /api/products?search= (db_helper.search_products_ranked).
+-- product.search_vector holds name (weight A), brand name (B) and description (C),
+-- kept current by triggers on product and brand, and indexed with GIN.
+-- The 'simple' configuration is used because names and descriptions mix
+-- Vietnamese and English; matching is by word prefix (see db_helper.build_tsquery).
+
+CREATE OR REPLACE FUNCTION product_search_vector(product_name text, description text, brand_name text)
+RETURNS tsvector AS $$
+    SELECT setweight(to_tsvector('simple', coalesce(product_name, '')), 'A')
+        || setweight(to_tsvector('simple', coalesce(brand_name, '')), 'B')
+        || setweight(to_tsvector('simple', coalesce(description, '')), 'C');
+$$ LANGUAGE sql IMMUTABLE;
+
+ALTER TABLE product ADD COLUMN IF NOT EXISTS search_vector tsvector;
+
+CREATE OR REPLACE FUNCTION product_search_vector_refresh() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector := product_search_vector(
+        NEW.product_name,
+        NEW.description,
+        (SELECT brand_name FROM brand WHERE brand_id = NEW.brand_id)
+    );
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS product_search_vector_refresh ON product;
+CREATE TRIGGER product_search_vector_refresh
+    BEFORE INSERT OR UPDATE OF product_name, description, brand_id ON product
+    FOR EACH ROW EXECUTE FUNCTION product_search_vector_refresh();
+
+-- A renamed brand changes the vector of all its products
+CREATE OR REPLACE FUNCTION brand_search_vector_refresh() RETURNS trigger AS $$
+BEGIN
+    UPDATE product p
+    SET search_vector = product_search_vector(p.product_name, p.description, NEW.brand_name)
+    WHERE p.brand_id = NEW.brand_id;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS brand_search_vector_refresh ON brand;
+CREATE TRIGGER brand_search_vector_refresh
+    AFTER UPDATE OF brand_name ON brand
+    FOR EACH ROW
+    WHEN (OLD.brand_name IS DISTINCT FROM NEW.brand_name)
+    EXECUTE FUNCTION brand_search_vector_refresh();
+
+-- Backfill the existing rows
+UPDATE product p
+SET search_vector = product_search_vector(p.product_name, p.description, b.brand_name)
+FROM brand b
+WHERE b.brand_id = p.brand_id;
+
+CREATE INDEX IF NOT EXISTS product_search_vector_idx
+    ON product USING gin (search_vector);
+
+ANALYZE product;
@@ -0,0 +1,14 @@
+-- "Cheapest product" lookups (db_helper.get_cheapest_products): in-stock rows
+-- only, cheapest first, optionally within one brand or one category.
+-- Partial indexes keep out-of-stock products out of the scan entirely.
+
+CREATE INDEX IF NOT EXISTS product_in_stock_price_idx
+    ON product (price, product_id) WHERE stock_quantity > 0;
+
+CREATE INDEX IF NOT EXISTS product_brand_in_stock_price_idx
+    ON product (brand_id, price, product_id) WHERE stock_quantity > 0;
+
+CREATE INDEX IF NOT EXISTS product_category_in_stock_price_idx
+    ON product (category_id, price, product_id) WHERE stock_quantity > 0;
+
+ANALYZE product;
@@ -0,0 +1,12 @@
+-- Keyset pages of the chatbot product listings ("show more"):
+-- db_helper.get_list_products_by_brand (brand, product_id order) and
+-- db_helper.get_list_products_by_price with a brand (brand, price, product_id order).
+-- Listings without a brand use product_price_idx from migration 004.
+
+CREATE INDEX IF NOT EXISTS product_brand_product_idx
+    ON product (brand_id, product_id);
+
+CREATE INDEX IF NOT EXISTS product_brand_price_idx
+    ON product (brand_id, price, product_id);
+
+ANALYZE product;
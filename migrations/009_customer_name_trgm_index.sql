@@ -0,0 +1,11 @@
+-- Customer name lookups of db_helper.get_customer_orders(customer_name=...):
+-- c.name ILIKE '%name%' (substring, and therefore prefix) is answered from
+-- this trigram index instead of a sequential scan over customer.
+-- The orders of the matched customers then come from order_summary_customer_date_idx (migration 010).
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX IF NOT EXISTS customer_name_trgm_idx
+    ON customer USING gin (name gin_trgm_ops);
+
+ANALYZE customer;
@@ -0,0 +1,162 @@
+-- Denormalized order history read by db_helper.get_customer_orders
+-- (/api/orders and the showlist.confirm intent): one row per order with the
+-- product names already aggregated, so a customer's history is a single
+-- range scan of order_summary_customer_date_idx.
+--
+-- Kept up to date by the triggers below, in the same transaction as the
+-- write: "Order" inserts (so an order without items is listed too) and
+-- updates (status, payment, total, address), order_item
+-- inserts/updates/deletes (place_order, staff edits), and renames of a
+-- product or payment method. Deleting an order removes its row through the
+-- ON DELETE CASCADE.
+
+CREATE TABLE IF NOT EXISTS order_summary (
+    order_id            int PRIMARY KEY REFERENCES "Order" (order_id) ON DELETE CASCADE,
+    customer_id         int NOT NULL,
+    product_names       text NOT NULL,
+    item_count          int NOT NULL,
+    total_amount        numeric NOT NULL,
+    payment_method      text NOT NULL,
+    order_status        text NOT NULL,
+    order_date          timestamp NOT NULL,
+    shipping_address_id int,
+    updated_at          timestamptz NOT NULL DEFAULT now()
+);
+
+CREATE INDEX IF NOT EXISTS order_summary_customer_date_idx
+    ON order_summary (customer_id, order_date DESC, order_id DESC);
+
+-- (Re)build the summary row of one order from "Order" + order_item; an order without items gets an empty row
+CREATE OR REPLACE FUNCTION refresh_order_summary(p_order_id int) RETURNS void AS $$
+BEGIN
+    DELETE FROM order_summary WHERE order_id = p_order_id;
+    INSERT INTO order_summary (
+        order_id, customer_id, product_names, item_count, total_amount,
+        payment_method, order_status, order_date, shipping_address_id
+    )
+    SELECT
+        o.order_id,
+        o.customer_id,
+        COALESCE(STRING_AGG(p.product_name, ', '), ''),
+        COUNT(oi.order_id),
+        o.total_amount,
+        COALESCE(pm.method_name, ''),
+        o.order_status,
+        o.order_date,
+        o.shipping_address_id
+    FROM "Order" o
+    LEFT JOIN order_item oi ON o.order_id = oi.order_id
+    LEFT JOIN product p ON oi.product_id = p.product_id
+    LEFT JOIN payment_method pm ON o.payment_method_id = pm.payment_method_id
+    WHERE o.order_id = p_order_id
+    GROUP BY o.order_id, o.customer_id, o.total_amount, pm.method_name, o.order_status, o.order_date, o.shipping_address_id;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION order_summary_order_changed() RETURNS trigger AS $$
+BEGIN
+    PERFORM refresh_order_summary(NEW.order_id);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Statement level, so an order placed with many items is summarized once
+CREATE OR REPLACE FUNCTION order_summary_items_changed() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM refresh_order_summary(order_id) FROM (SELECT DISTINCT order_id FROM new_items) changed;
+    END IF;
+    IF TG_OP IN ('DELETE', 'UPDATE') THEN
+        PERFORM refresh_order_summary(order_id) FROM (SELECT DISTINCT order_id FROM old_items) changed;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION order_summary_product_renamed() RETURNS trigger AS $$
+BEGIN
+    PERFORM refresh_order_summary(order_id)
+    FROM (SELECT DISTINCT order_id FROM order_item WHERE product_id = NEW.product_id) renamed;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION order_summary_payment_method_renamed() RETURNS trigger AS $$
+BEGIN
+    UPDATE order_summary s
+    SET payment_method = NEW.method_name, updated_at = now()
+    FROM "Order" o
+    WHERE o.order_id = s.order_id AND o.payment_method_id = NEW.payment_method_id;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+BEGIN;
+
+DROP TRIGGER IF EXISTS order_summary_order_inserted ON "Order";
+CREATE TRIGGER order_summary_order_inserted
+    AFTER INSERT ON "Order"
+    FOR EACH ROW EXECUTE FUNCTION order_summary_order_changed();
+
+DROP TRIGGER IF EXISTS order_summary_order_changed ON "Order";
+CREATE TRIGGER order_summary_order_changed
+    AFTER UPDATE OF order_status, payment_method_id, total_amount, order_date, customer_id, shipping_address_id ON "Order"
+    FOR EACH ROW EXECUTE FUNCTION order_summary_order_changed();
+
+-- Transition tables allow a single event per trigger
+DROP TRIGGER IF EXISTS order_summary_items_inserted ON order_item;
+CREATE TRIGGER order_summary_items_inserted
+    AFTER INSERT ON order_item REFERENCING NEW TABLE AS new_items
+    FOR EACH STATEMENT EXECUTE FUNCTION order_summary_items_changed();
+
+DROP TRIGGER IF EXISTS order_summary_items_updated ON order_item;
+CREATE TRIGGER order_summary_items_updated
+    AFTER UPDATE ON order_item REFERENCING OLD TABLE AS old_items NEW TABLE AS new_items
+    FOR EACH STATEMENT EXECUTE FUNCTION order_summary_items_changed();
+
+DROP TRIGGER IF EXISTS order_summary_items_deleted ON order_item;
+CREATE TRIGGER order_summary_items_deleted
+    AFTER DELETE ON order_item REFERENCING OLD TABLE AS old_items
+    FOR EACH STATEMENT EXECUTE FUNCTION order_summary_items_changed();
+
+DROP TRIGGER IF EXISTS order_summary_product_renamed ON product;
+CREATE TRIGGER order_summary_product_renamed
+    AFTER UPDATE OF product_name ON product
+    FOR EACH ROW WHEN (OLD.product_name IS DISTINCT FROM NEW.product_name)
+    EXECUTE FUNCTION order_summary_product_renamed();
+
+DROP TRIGGER IF EXISTS order_summary_payment_method_renamed ON payment_method;
+CREATE TRIGGER order_summary_payment_method_renamed
+    AFTER UPDATE OF method_name ON payment_method
+    FOR EACH ROW WHEN (OLD.method_name IS DISTINCT FROM NEW.method_name)
+    EXECUTE FUNCTION order_summary_payment_method_renamed();
+
+-- The product rename trigger looks orders up by product
+CREATE INDEX IF NOT EXISTS order_item_product_idx ON order_item (product_id);
+
+-- Backfill every existing order
+LOCK TABLE "Order", order_item IN SHARE MODE;
+TRUNCATE order_summary;
+INSERT INTO order_summary (
+    order_id, customer_id, product_names, item_count, total_amount,
+    payment_method, order_status, order_date, shipping_address_id
+)
+SELECT
+    o.order_id,
+    o.customer_id,
+    COALESCE(STRING_AGG(p.product_name, ', '), ''),
+    COUNT(oi.order_id),
+    o.total_amount,
+    COALESCE(pm.method_name, ''),
+    o.order_status,
+    o.order_date,
+    o.shipping_address_id
+FROM "Order" o
+LEFT JOIN order_item oi ON o.order_id = oi.order_id
+LEFT JOIN product p ON oi.product_id = p.product_id
+LEFT JOIN payment_method pm ON o.payment_method_id = pm.payment_method_id
+GROUP BY o.order_id, o.customer_id, o.total_amount, pm.method_name, o.order_status, o.order_date, o.shipping_address_id;
+
+COMMIT;
+
+ANALYZE order_summary;
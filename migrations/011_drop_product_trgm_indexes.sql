@@ -0,0 +1,7 @@
+-- /api/products?search= goes through the full-text index of migration 006;
+-- nothing matches product name / description with ILIKE any more, so the
+-- trigram indexes that an earlier 004 created only slowed down writes.
+-- (pg_trgm itself stays: customer_name_trgm_idx of migration 009 uses it.)
+
+DROP INDEX IF EXISTS product_name_trgm_idx;
+DROP INDEX IF EXISTS product_description_trgm_idx;
@@ -0,0 +1,181 @@
+import re
+import threading
+import unicodedata
+from collections import Counter
+
+from catalog_cache import catalog
+
+MIN_SCORE = 0.45        # below this a candidate is not offered at all
+AUTO_PICK_SCORE = 0.7   # a non-exact candidate needs at least this to be picked without asking
+CONFIDENT_MARGIN = 0.1  # the best candidate must beat the runner-up by this much to be picked alone
+
+_NON_WORD = re.compile(r"[^0-9a-z]+")
+_NUMBER = re.compile(r"[0-9]+")
+
+
+def normalize_name(text):
+    """Lower-case, strip accents and punctuation: 'Nike Air-Max 270 ' -> 'nike air max 270'"""
+    text = unicodedata.normalize("NFKD", str(text)).encode("ascii", "ignore").decode("ascii")
+    return " ".join(_NON_WORD.split(text.lower())).strip()
+
+
+def model_numbers(normalized):
+    """Digit runs of a normalized name ('iphone15 pro' -> {'15'}): model numbers a match must not change"""
+    return set(_NUMBER.findall(normalized))
+
+
+def trigrams(normalized):
+    """pg_trgm style trigrams: every word padded with two leading spaces and one trailing space"""
+    grams = set()
+    for word in normalized.split():
+        padded = f"  {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+class ProductNameIndex:
+    """
+    Trigram index over the catalog product names, for resolving what users type
+    ("air max 270", "iphone15 pro") to product ids without a database query.
+
+    Subscribed to the catalog cache: rebuilt after every full reload, and only
+    the changed products are re-indexed on LISTEN/NOTIFY refreshes.
+
+    Score = average of the share of the query's trigrams found in the name and
+    the trigram Jaccard similarity, so a query that is a fragment of a longer
+    name still ranks high, and an exact (normalized) match scores 1.0.
+    """
+
+    def __init__(self, source):
+        self._source = source
+        self._lock = threading.Lock()
+        self._names = {}        # product_id -> product_name
+        self._grams = {}        # product_id -> trigram set
+        self._by_gram = {}      # trigram -> {product_id}
+        self._by_exact = {}     # normalized name -> {product_id}
+        self._loaded = False
+        self.lookups = 0
+        self.ambiguous = 0
+        self.rebuilds = 0
+
+    # ---------- maintenance ----------
+
+    def _add(self, product_id, product_name):
+        normalized = normalize_name(product_name)
+        grams = trigrams(normalized)
+        self._names[product_id] = product_name
+        self._grams[product_id] = grams
+        self._by_exact.setdefault(normalized, set()).add(product_id)
+        for gram in grams:
+            self._by_gram.setdefault(gram, set()).add(product_id)
+
+    def _remove(self, product_id):
+        product_name = self._names.pop(product_id, None)
+        if product_name is None:
+            return
+        for gram in self._grams.pop(product_id):
+            ids = self._by_gram.get(gram)
+            ids.discard(product_id)
+            if not ids:
+                del self._by_gram[gram]
+        normalized = normalize_name(product_name)
+        ids = self._by_exact.get(normalized)
+        ids.discard(product_id)
+        if not ids:
+            del self._by_exact[normalized]
+
+    def on_catalog_change(self, changed_ids):
+        """Catalog listener: None after a full reload, else the refreshed product ids"""
+        if changed_ids is None:
+            rows = self._source.rows()
+            with self._lock:
+                self._names, self._grams, self._by_gram, self._by_exact = {}, {}, {}, {}
+                for row in rows:
+                    self._add(row["product_id"], row["product_name"])
+                self._loaded = True
+                self.rebuilds += 1
+            return
+        rows = self._source.peek_rows(changed_ids)
+        with self._lock:
+            for product_id in changed_ids:
+                self._remove(product_id)
+            for row in rows:
+                self._add(row["product_id"], row["product_name"])
+
+    # ---------- readers ----------
+
+    @property
+    def loaded(self):
+        return self._loaded
+
+    def resolve(self, text, limit=5):
+        """Ranked [(product_id, product_name, score)] for a free-text product name"""
+        normalized = normalize_name(text or "")
+        if not normalized:
+            return []
+        self.lookups += 1
+        query_grams = trigrams(normalized)
+        with self._lock:
+            exact = self._by_exact.get(normalized, ())
+            if exact:
+                return [(pid, self._names[pid], 1.0) for pid in sorted(exact)][:limit]
+
+            shared = Counter()
+            for gram in query_grams:
+                shared.update(self._by_gram.get(gram, ()))
+            ranked = []
+            for product_id, common in shared.items():
+                name_grams = len(self._grams[product_id])
+                coverage = common / len(query_grams)
+                jaccard = common / (len(query_grams) + name_grams - common)
+                score = (coverage + jaccard) / 2
+                if score >= MIN_SCORE:
+                    ranked.append((product_id, self._names[product_id], round(score, 4)))
+        ranked.sort(key=lambda c: (-c[2], c[0]))
+        return ranked[:limit]
+
+    def best_match(self, text, choices=None):
+        """
+        (product_name, candidates): the catalog name `text` means, or None when
+        the caller should offer `candidates` as "Did you mean ..." instead.
+
+        A name is picked on an exact (normalized) match, or when the best
+        candidate scores AUTO_PICK_SCORE or more, clearly beats the runner-up and
+        keeps every model number the user typed ("air max 90" never picks
+        "Air Max 270", "iphone 14" never picks "iPhone 15 Pro").
+        With `choices`, only those names are considered (e.g. the customer's
+        unreviewed products).
+        """
+        candidates = self.resolve(text, limit=20 if choices else 5)
+        if choices is not None:
+            choices = set(choices)
+            candidates = [c for c in candidates if c[1] in choices]
+        if not candidates:
+            return None, []
+        top = candidates[0]
+        if top[2] == 1.0:
+            return top[1], candidates
+        # Several products sharing one name are a single answer
+        runner_up = next((c for c in candidates[1:] if c[1] != top[1]), None)
+        if (
+            top[2] >= AUTO_PICK_SCORE
+            and (runner_up is None or top[2] - runner_up[2] >= CONFIDENT_MARGIN)
+            and model_numbers(normalize_name(text)) <= model_numbers(normalize_name(top[1]))
+        ):
+            return top[1], candidates
+        self.ambiguous += 1
+        return None, candidates
+
+    def stats(self):
+        return {
+            "loaded": self._loaded,
+            "products": len(self._names),
+            "trigrams": len(self._by_gram),
+            "lookups": self.lookups,
+            "ambiguous": self.ambiguous,
+            "rebuilds": self.rebuilds,
+        }
+
+
+product_names = ProductNameIndex(catalog)
+catalog.add_listener(product_names.on_catalog_change)
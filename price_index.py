@@ -0,0 +1,139 @@
+import threading
+from bisect import bisect_left, bisect_right, insort
+
+import db_helper
+from catalog_cache import catalog
+
+
+class _SortedPrices:
+    """Parallel lists sorted by (price, product_id): prices for bisect, entries for the answer"""
+
+    __slots__ = ("keys", "prices", "entries")
+
+    def __init__(self):
+        self.keys = []      # (price, product_id)
+        self.prices = []    # price only, bisected by range lookups
+        self.entries = []   # (product_id, product_name, price)
+
+    def add(self, price, product_id, product_name):
+        i = bisect_left(self.keys, (price, product_id))
+        self.keys.insert(i, (price, product_id))
+        self.prices.insert(i, price)
+        self.entries.insert(i, (product_id, product_name, price))
+
+    def remove(self, price, product_id):
+        i = bisect_left(self.keys, (price, product_id))
+        if i < len(self.keys) and self.keys[i] == (price, product_id):
+            del self.keys[i], self.prices[i], self.entries[i]
+
+    def between(self, min_price, max_price, after=None, limit=None):
+        """
+        Entries with min_price <= price <= max_price (SQL BETWEEN), cheapest first;
+        `after` is the (price, product_id) of the last entry already returned.
+        """
+        start = bisect_left(self.prices, min_price)
+        if after is not None:
+            start = max(start, bisect_right(self.keys, (float(after[0]), after[1])))
+        end = bisect_right(self.prices, max_price)
+        if limit is not None:
+            end = min(end, start + limit)
+        return self.entries[start:end]
+
+
+class PriceIndex:
+    """
+    Catalog products sorted by price, globally and per brand name, so the
+    search.by.price intent is a bisect over memory: O(log n + k) instead of a
+    price scan (plus a brand join) in the database.
+
+    Subscribed to the catalog cache like name_index: rebuilt after a full
+    reload, changed products moved in place on LISTEN/NOTIFY refreshes.
+    Until the first load it answers from db_helper.
+    """
+
+    def __init__(self, source):
+        self._source = source
+        self._lock = threading.Lock()
+        self._all = _SortedPrices()
+        self._by_brand = {}     # brand_name -> _SortedPrices
+        self._placed = {}       # product_id -> (price, brand_name) currently indexed
+        self._loaded = False
+        self.hits = 0
+        self.misses = 0
+
+    # ---------- maintenance ----------
+
+    def _add(self, row):
+        price = float(row["price"])
+        self._all.add(price, row["product_id"], row["product_name"])
+        self._by_brand.setdefault(row["brand_name"], _SortedPrices()).add(price, row["product_id"], row["product_name"])
+        self._placed[row["product_id"]] = (price, row["brand_name"])
+
+    def _remove(self, product_id):
+        placed = self._placed.pop(product_id, None)
+        if placed is None:
+            return
+        price, brand_name = placed
+        self._all.remove(price, product_id)
+        brand = self._by_brand[brand_name]
+        brand.remove(price, product_id)
+        if not brand.keys:
+            del self._by_brand[brand_name]
+
+    def on_catalog_change(self, changed_ids):
+        """Catalog listener: None after a full reload, else the refreshed product ids"""
+        if changed_ids is None:
+            rows = sorted(
+                (row for row in self._source.rows() if row["price"] is not None),
+                key=lambda r: (float(r["price"]), r["product_id"]),
+            )
+            full, by_brand, placed = _SortedPrices(), {}, {}
+            # Rows are already in (price, id) order: append instead of insort
+            for row in rows:
+                price = float(row["price"])
+                entry = (row["product_id"], row["product_name"], price)
+                for target in (full, by_brand.setdefault(row["brand_name"], _SortedPrices())):
+                    target.keys.append((price, row["product_id"]))
+                    target.prices.append(price)
+                    target.entries.append(entry)
+                placed[row["product_id"]] = (price, row["brand_name"])
+            with self._lock:
+                self._all, self._by_brand, self._placed = full, by_brand, placed
+                self._loaded = True
+            return
+        rows = self._source.peek_rows(changed_ids)
+        with self._lock:
+            for product_id in changed_ids:
+                self._remove(product_id)
+            for row in rows:
+                if row["price"] is not None:
+                    self._add(row)
+
+    # ---------- readers ----------
+
+    def get_list_products_by_price(self, brand_name, price_range, price, after=None, limit=None):
+        """Same arguments and (product_id, product_name, price) rows as db_helper.get_list_products_by_price"""
+        if not self._loaded:
+            self.misses += 1
+            return db_helper.get_list_products_by_price(brand_name, price_range, price, after, limit)
+        bounds = db_helper.price_range_bounds(price_range, price)
+        if bounds is None:
+            return []
+        min_price, max_price = bounds
+        self.hits += 1
+        with self._lock:
+            prices = self._all if brand_name == "" else self._by_brand.get(brand_name)
+            return prices.between(min_price, max_price, after, limit) if prices is not None else []
+
+    def stats(self):
+        return {
+            "loaded": self._loaded,
+            "products": len(self._placed),
+            "brands": len(self._by_brand),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+price_index = PriceIndex(catalog)
+catalog.add_listener(price_index.on_catalog_change)
@@ -0,0 +1,159 @@
+import threading
+import time
+
+import db_helper
+
+DEFAULT_TTL_SECONDS = 300
+DEFAULT_RETRY_SECONDS = 15  # after a failed or empty reload, wait this long before asking the DB again
+
+
+class ReferenceTable:
+    """
+    In-process copy of a small, rarely changing table (shipping methods, payment methods, brands).
+
+    rows() serves the cached list and reloads it lazily once the TTL has expired;
+    get_by_name() is a dict lookup on the lower-cased name column instead of a linear scan.
+    A failed or empty reload keeps serving the previous data, and the next
+    attempt waits `retry` seconds so an unavailable DB is not hit on every read.
+    """
+
+    def __init__(self, name, loader, id_key, name_key, ttl=DEFAULT_TTL_SECONDS, retry=DEFAULT_RETRY_SECONDS):
+        self.name = name
+        self.ttl = ttl
+        self.retry = retry
+        self._loader = loader
+        self._id_key = id_key
+        self._name_key = name_key
+        self._lock = threading.Lock()
+        self._rows = []
+        self._by_name = {}
+        self._by_id = {}
+        self._loaded_at = None
+        self._failed_at = None
+        self._hits = 0
+        self._reloads = 0
+        self._failures = 0
+
+    def _is_fresh(self):
+        return self._loaded_at is not None and time.monotonic() - self._loaded_at < self.ttl
+
+    def _is_backing_off(self):
+        return self._failed_at is not None and time.monotonic() - self._failed_at < self.retry
+
+    def _record_failure(self):
+        with self._lock:
+            self._failed_at = time.monotonic()
+            self._failures += 1
+
+    def refresh(self):
+        try:
+            rows = self._loader()
+        except Exception:
+            self._record_failure()
+            raise
+        if not rows:
+            self._record_failure()
+            return False
+        by_name = {row[self._name_key].lower(): row for row in rows}
+        by_id = {row[self._id_key]: row for row in rows}
+        with self._lock:
+            self._rows = rows
+            self._by_name = by_name
+            self._by_id = by_id
+            self._loaded_at = time.monotonic()
+            self._failed_at = None
+            self._reloads += 1
+        return True
+
+    def invalidate(self):
+        with self._lock:
+            self._loaded_at = None
+            self._failed_at = None
+
+    def _ensure_loaded(self):
+        if self._is_fresh():
+            self._hits += 1
+            return
+        if self._is_backing_off():
+            return
+        try:
+            self.refresh()
+        except Exception as e:
+            print(f"[ERROR] Failed to reload reference table {self.name}: {e}")
+
+    def rows(self):
+        self._ensure_loaded()
+        return self._rows
+
+    def get_by_name(self, name):
+        if not name:
+            return None
+        self._ensure_loaded()
+        return self._by_name.get(name.strip().lower())
+
+    def get_by_id(self, row_id):
+        self._ensure_loaded()
+        return self._by_id.get(row_id)
+
+    def stats(self):
+        return {
+            "rows": len(self._rows),
+            "fresh": self._is_fresh(),
+            "age_seconds": round(time.monotonic() - self._loaded_at, 1) if self._loaded_at is not None else None,
+            "ttl_seconds": self.ttl,
+            "retry_seconds": self.retry,
+            "backing_off": self._is_backing_off(),
+            "hits": self._hits,
+            "reloads": self._reloads,
+            "failures": self._failures,
+        }
+
+
+shipping_methods = ReferenceTable("shipping_methods", db_helper.get_shipping_methods, "method_id", "method_name")
+payment_methods = ReferenceTable("payment_methods", db_helper.get_payment_methods, "method_id", "method_name")
+brands = ReferenceTable("brands", db_helper.get_brands, "brand_id", "brand_name")
+
+TABLES = {table.name: table for table in (shipping_methods, payment_methods, brands)}
+
+_refresh_stop = threading.Event()
+_refresh_thread = None
+
+
+def load_all():
+    """Warm every reference table (called at startup)"""
+    for table in TABLES.values():
+        try:
+            table.refresh()
+        except Exception as e:
+            print(f"[ERROR] Failed to load reference table {table.name}: {e}")
+
+
+def invalidate(table_name=None):
+    """Drop one table (or all of them) so the next read goes back to the database"""
+    tables = [TABLES[table_name]] if table_name else TABLES.values()
+    for table in tables:
+        table.invalidate()
+
+
+def _refresh_loop(interval):
+    while not _refresh_stop.wait(interval):
+        load_all()
+
+
+def start_background_refresh(interval=None):
+    """Reload all tables every `interval` seconds (default: half the shortest TTL) so reads never wait on the DB"""
+    global _refresh_thread
+    if _refresh_thread is not None and _refresh_thread.is_alive():
+        return
+    interval = interval or min(table.ttl for table in TABLES.values()) / 2
+    _refresh_stop.clear()
+    _refresh_thread = threading.Thread(target=_refresh_loop, args=(interval,), name="reference-cache-refresh", daemon=True)
+    _refresh_thread.start()
+
+
+def stop_background_refresh():
+    _refresh_stop.set()
+
+
+def stats():
+    return {name: table.stats() for name, table in TABLES.items()}
@@ -0,0 +1,535 @@
+import base64
+import contextvars
+import hashlib
+import hmac
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+class SessionConflictError(Exception):
+    """Raised when a session was changed by another worker since it was loaded"""
+
+
+class Session(dict):
+    """Session data as loaded from a shared backend; `version` is used for optimistic concurrency"""
+
+    def __init__(self, data, version):
+        super().__init__(data)
+        self.version = version
+
+
+class SessionStore:
+    """
+    Storage for in-progress chatbot carts, keyed by Dialogflow session id.
+
+    Handlers load a session with get(), mutate the returned dict and write it
+    back with save(); a backend is free to hand out copies, so changes that are
+    not saved are not guaranteed to persist.
+    """
+
+    def get(self, session_id):
+        raise NotImplementedError
+
+    def save(self, session_id, data):
+        raise NotImplementedError
+
+    def delete(self, session_id):
+        raise NotImplementedError
+
+    def __contains__(self, session_id):
+        return self.get(session_id) is not None
+
+    def begin_request(self, session_id, output_contexts, session_path=None):
+        """
+        Called by the webhook before a handler runs; only stores that live in the request need it.
+        `session_path` is the request's "projects/.../sessions/<id>" (WebhookRequest.session).
+        """
+
+    def end_request(self, response):
+        """Called with the handler's response; returns the response to send back"""
+        return response
+
+    def stats(self):
+        return {}
+
+
+def _estimate_size(data):
+    return len(json.dumps(data, default=str, separators=(",", ":")))
+
+
+COMPRESS_THRESHOLD_BYTES = 512
+
+def encode_session(data):
+    """Compact JSON, zlib-compressed once it is large enough to be worth it; first byte tags the format"""
+    raw = json.dumps(data, default=str, separators=(",", ":")).encode("utf-8")
+    if len(raw) >= COMPRESS_THRESHOLD_BYTES:
+        return b"z" + zlib.compress(raw, 6)
+    return b"j" + raw
+
+def decode_session(blob):
+    blob = bytes(blob)
+    raw = zlib.decompress(blob[1:]) if blob[:1] == b"z" else blob[1:]
+    return json.loads(raw)
+
+
+class InMemorySessionStore(SessionStore):
+    """
+    Per-process store with bounded memory.
+
+    - ttl: a session is dropped this many seconds after it was created
+    - idle_timeout: a session is dropped after this many seconds without access
+    - max_entries / max_bytes: least recently used sessions are evicted beyond these
+      (size is the compact JSON length of the session, a stable proxy for memory)
+    """
+
+    def __init__(self, ttl=6 * 3600, idle_timeout=1800, max_entries=10000, max_bytes=64 * 1024 * 1024):
+        self.ttl = ttl
+        self.idle_timeout = idle_timeout
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # session_id -> [data, size, created_at, last_access], ordered by last access (oldest first)
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = {"ttl": 0, "idle": 0, "lru": 0}
+
+    def _is_expired(self, entry, now):
+        _, _, created_at, last_access = entry
+        if now - created_at >= self.ttl:
+            return "ttl"
+        if now - last_access >= self.idle_timeout:
+            return "idle"
+        return None
+
+    def _drop(self, session_id, reason=None):
+        entry = self._entries.pop(session_id, None)
+        if entry is None:
+            return
+        self._bytes -= entry[1]
+        if reason:
+            self._evictions[reason] += 1
+
+    def _evict(self, now):
+        # Idle sessions sit at the front of the LRU order
+        while self._entries:
+            session_id, entry = next(iter(self._entries.items()))
+            reason = self._is_expired(entry, now)
+            if not reason:
+                break
+            self._drop(session_id, reason)
+        while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            self._drop(next(iter(self._entries)), "lru")
+
+    def get(self, session_id):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is not None and self._is_expired(entry, now):
+                self._drop(session_id, self._is_expired(entry, now))
+                entry = None
+            if entry is None:
+                self._misses += 1
+                return None
+            entry[3] = now
+            self._entries.move_to_end(session_id)
+            self._hits += 1
+            return entry[0]
+
+    def save(self, session_id, data):
+        now = time.monotonic()
+        size = _estimate_size(data)
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is not None:
+                self._bytes += size - entry[1]
+                entry[0], entry[1], entry[3] = data, size, now
+                self._entries.move_to_end(session_id)
+            else:
+                self._entries[session_id] = [data, size, now, now]
+                self._bytes += size
+            self._evict(now)
+
+    def delete(self, session_id):
+        with self._lock:
+            self._drop(session_id)
+
+    def purge_expired(self):
+        """Full sweep for sessions past their TTL (idle ones are also evicted lazily on writes)"""
+        now = time.monotonic()
+        with self._lock:
+            for session_id, entry in list(self._entries.items()):
+                reason = self._is_expired(entry, now)
+                if reason:
+                    self._drop(session_id, reason)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "backend": "memory",
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "ttl_seconds": self.ttl,
+                "idle_timeout_seconds": self.idle_timeout,
+                "hits": self._hits,
+                "misses": self._misses,
+                "evictions": dict(self._evictions),
+            }
+
+
+class SQLiteSessionStore(SessionStore):
+    """
+    Store shared by every worker process on the host, backed by one SQLite file in WAL mode.
+
+    Sessions are serialized with encode_session(). get() returns a Session
+    carrying the row version; save() of a loaded Session only succeeds if
+    nobody saved that session in between, otherwise SessionConflictError is
+    raised. Idle time counts from the last save. Expired and over-limit
+    sessions are purged every `purge_every` saves.
+    """
+
+    def __init__(self, path, ttl=6 * 3600, idle_timeout=1800, max_entries=10000, purge_every=200):
+        self.path = path
+        self.ttl = ttl
+        self.idle_timeout = idle_timeout
+        self.max_entries = max_entries
+        self.purge_every = purge_every
+        self._local = threading.local()
+        self._counter_lock = threading.Lock()
+        self._saves = 0
+        self._hits = 0
+        self._misses = 0
+        self._conflicts = 0
+        cnx = self._connection()
+        cnx.execute("PRAGMA journal_mode=WAL")
+        cnx.execute("""
+            CREATE TABLE IF NOT EXISTS chatbot_session (
+                session_id TEXT PRIMARY KEY,
+                version INTEGER NOT NULL,
+                data BLOB NOT NULL,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+        """)
+        cnx.execute("CREATE INDEX IF NOT EXISTS chatbot_session_updated_at ON chatbot_session (updated_at)")
+
+    def _connection(self):
+        # sqlite3 connections must not be shared across threads; handlers run in a thread pool
+        cnx = getattr(self._local, "cnx", None)
+        if cnx is None:
+            cnx = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            cnx.execute("PRAGMA synchronous=NORMAL")
+            self._local.cnx = cnx
+        return cnx
+
+    def get(self, session_id):
+        now = time.time()
+        row = self._connection().execute(
+            "SELECT version, data FROM chatbot_session WHERE session_id = ? AND created_at > ? AND updated_at > ?",
+            (session_id, now - self.ttl, now - self.idle_timeout)
+        ).fetchone()
+        if row is None:
+            self._misses += 1
+            return None
+        self._hits += 1
+        return Session(decode_session(row[1]), row[0])
+
+    def save(self, session_id, data):
+        now = time.time()
+        blob = encode_session(data)
+        cnx = self._connection()
+        version = getattr(data, "version", None)
+        if version is None:
+            # New session: must not already exist (another worker may have created it first)
+            cursor = cnx.execute(
+                "INSERT INTO chatbot_session (session_id, version, data, created_at, updated_at) VALUES (?, 1, ?, ?, ?) "
+                "ON CONFLICT (session_id) DO UPDATE SET version = 1, data = excluded.data, "
+                "created_at = excluded.created_at, updated_at = excluded.updated_at "
+                "WHERE chatbot_session.created_at <= ? OR chatbot_session.updated_at <= ?",
+                (session_id, blob, now, now, now - self.ttl, now - self.idle_timeout)
+            )
+            new_version = 1
+        else:
+            cursor = cnx.execute(
+                "UPDATE chatbot_session SET version = version + 1, data = ?, updated_at = ? "
+                "WHERE session_id = ? AND version = ?",
+                (blob, now, session_id, version)
+            )
+            new_version = version + 1
+        if cursor.rowcount == 0:
+            self._conflicts += 1
+            raise SessionConflictError(f"Session {session_id} was modified concurrently")
+        if isinstance(data, Session):
+            data.version = new_version
+
+        with self._counter_lock:
+            self._saves += 1
+            purge = self._saves % self.purge_every == 0
+        if purge:
+            self.purge_expired()
+
+    def delete(self, session_id):
+        self._connection().execute("DELETE FROM chatbot_session WHERE session_id = ?", (session_id,))
+
+    def purge_expired(self):
+        now = time.time()
+        cnx = self._connection()
+        cnx.execute(
+            "DELETE FROM chatbot_session WHERE created_at <= ? OR updated_at <= ?",
+            (now - self.ttl, now - self.idle_timeout)
+        )
+        cnx.execute(
+            "DELETE FROM chatbot_session WHERE session_id IN ("
+            "SELECT session_id FROM chatbot_session ORDER BY updated_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,)
+        )
+
+    def stats(self):
+        entries, size = self._connection().execute(
+            "SELECT COUNT(*), COALESCE(SUM(LENGTH(data)), 0) FROM chatbot_session"
+        ).fetchone()
+        return {
+            "backend": "sqlite",
+            "path": self.path,
+            "entries": entries,
+            "bytes": size,
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl,
+            "idle_timeout_seconds": self.idle_timeout,
+            "hits": self._hits,
+            "misses": self._misses,
+            "conflicts": self._conflicts,
+        }
+
+
+class ContextSessionStore(SessionStore):
+    """
+    Stateless store: the session travels with the conversation instead of living on the server.
+
+    On save() the session is encoded with encode_session(), signed with
+    HMAC-SHA256 and attached by end_request() as the `state` parameter of a
+    `cart-state` output context. Dialogflow sends that context back on the next
+    turn and begin_request() verifies and decodes it. Tokens that are
+    tampered with, older than `ttl` or issued for another session are ignored.
+    """
+
+    CONTEXT_NAME = "cart-state"
+
+    def __init__(self, secret, ttl=6 * 3600, lifespan=50):
+        if not secret:
+            raise ValueError("ContextSessionStore needs a signing secret (SESSION_CONTEXT_SECRET)")
+        self._secret = secret.encode("utf-8") if isinstance(secret, str) else secret
+        self.ttl = ttl
+        self.lifespan = lifespan
+        # Per-request state; handlers run in a thread pool, which copies the context
+        self._request = contextvars.ContextVar("session_request", default=None)
+        self._hits = 0
+        self._misses = 0
+        self._rejected = 0
+        self._emitted = 0
+        self._emitted_bytes = 0
+
+    def _sign(self, body):
+        return base64.urlsafe_b64encode(hmac.new(self._secret, body, hashlib.sha256).digest()[:18]).decode("ascii")
+
+    def encode_token(self, session_id, data):
+        body = base64.urlsafe_b64encode(
+            encode_session({"sid": session_id, "iat": int(time.time()), "data": data})
+        )
+        return f"{body.decode('ascii')}.{self._sign(body)}"
+
+    def decode_token(self, session_id, token):
+        """Session data carried by `token`, or None if it is invalid, expired or belongs to another session"""
+        try:
+            body, signature = token.rsplit(".", 1)
+            body = body.encode("ascii")
+            if not hmac.compare_digest(signature, self._sign(body)):
+                raise ValueError("bad signature")
+            state = decode_session(base64.urlsafe_b64decode(body))
+        except (ValueError, TypeError, zlib.error) as e:
+            self._rejected += 1
+            print(f"[WARN] Ignoring invalid session context for {session_id}: {e}")
+            return None
+        if state.get("sid") != session_id or time.time() - state.get("iat", 0) >= self.ttl:
+            self._rejected += 1
+            return None
+        return state["data"]
+
+    def begin_request(self, session_id, output_contexts, session_path=None):
+        data = None
+        for context in output_contexts or []:
+            name = context.get("name", "")
+            if not session_path and "/contexts/" in name:
+                session_path = name.split("/contexts/")[0]
+            if name.endswith("/contexts/" + self.CONTEXT_NAME):
+                token = context.get("parameters", {}).get("state")
+                if token:
+                    data = self.decode_token(session_id, token)
+        self._request.set({
+            "session_id": session_id,
+            "session_path": session_path,
+            "data": data,
+            "changed": False,
+        })
+
+    def _current(self, session_id):
+        request = self._request.get()
+        if request is None or request["session_id"] != session_id:
+            return None
+        return request
+
+    def get(self, session_id):
+        request = self._current(session_id)
+        if request is None or request["data"] is None:
+            self._misses += 1
+            return None
+        self._hits += 1
+        return request["data"]
+
+    def save(self, session_id, data):
+        request = self._current(session_id)
+        if request is None:
+            print(f"[WARN] Session {session_id} saved outside of a webhook request, change is lost")
+            return
+        request["data"], request["changed"] = data, True
+
+    def delete(self, session_id):
+        request = self._current(session_id)
+        if request is not None:
+            request["data"], request["changed"] = None, True
+
+    def end_request(self, response):
+        request = self._request.get()
+        if request is None or not request["changed"]:
+            return response
+        if not request["session_path"]:
+            print(f"[WARN] No session path for {request['session_id']}, session change is lost")
+            return response
+        try:
+            # Handlers return a JSONResponse, a few return the plain dict
+            payload = dict(response) if isinstance(response, dict) else json.loads(response.body)
+        except (AttributeError, TypeError, ValueError) as e:
+            # The handler already did its work; send its response as is rather than fail the turn
+            print(f"[WARN] Cannot attach session context to a {type(response).__name__} response: {e}")
+            return response
+        if not isinstance(payload, dict):
+            print(f"[WARN] Cannot attach session context to a non-object response for {request['session_id']}")
+            return response
+        context = {"name": f"{request['session_path']}/contexts/{self.CONTEXT_NAME}"}
+        if request["data"] is None:
+            context["lifespanCount"] = 0
+        else:
+            token = self.encode_token(request["session_id"], request["data"])
+            context["lifespanCount"] = self.lifespan
+            context["parameters"] = {"state": token}
+            self._emitted += 1
+            self._emitted_bytes += len(token)
+
+        contexts = [c for c in payload.get("outputContexts", []) if not c.get("name", "").endswith("/contexts/" + self.CONTEXT_NAME)]
+        payload["outputContexts"] = contexts + [context]
+        if isinstance(response, dict):
+            return payload
+        return type(response)(content=payload, status_code=response.status_code)
+
+    def stats(self):
+        return {
+            "backend": "context",
+            "ttl_seconds": self.ttl,
+            "lifespan_count": self.lifespan,
+            "hits": self._hits,
+            "misses": self._misses,
+            "rejected_tokens": self._rejected,
+            "emitted": self._emitted,
+            "avg_token_bytes": round(self._emitted_bytes / self._emitted) if self._emitted else None,
+        }
+
+
+class SessionLocks:
+    """
+    Serializes handler turns of the same session with a fixed table of locks.
+
+    A session id always maps to the same stripe, so two turns of one
+    conversation never interleave, while unrelated sessions only contend when
+    they share a stripe. Memory stays constant no matter how many sessions exist.
+    """
+
+    def __init__(self, stripes=256):
+        self._locks = [threading.Lock() for _ in range(stripes)]
+        self._stats_lock = threading.Lock()
+        self._acquisitions = 0
+        self._contended = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    def _stripe(self, session_id):
+        return self._locks[zlib.crc32(session_id.encode("utf-8")) % len(self._locks)]
+
+    @contextmanager
+    def hold(self, session_id):
+        lock = self._stripe(session_id)
+        started = time.perf_counter()
+        contended = not lock.acquire(blocking=False)
+        if contended:
+            lock.acquire()
+        waited = time.perf_counter() - started
+        with self._stats_lock:
+            self._acquisitions += 1
+            if contended:
+                self._contended += 1
+                self._wait_total += waited
+                self._wait_max = max(self._wait_max, waited)
+        try:
+            yield waited
+        finally:
+            lock.release()
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                "stripes": len(self._locks),
+                "acquisitions": self._acquisitions,
+                "contended": self._contended,
+                "total_wait_seconds": round(self._wait_total, 4),
+                "avg_contended_wait_seconds": round(self._wait_total / self._contended, 4) if self._contended else 0.0,
+                "max_wait_seconds": round(self._wait_max, 4),
+            }
+
+
+def create_session_store():
+    """
+    Build the session store configured through SESSION_* environment variables.
+    Running more than one uvicorn worker needs SESSION_BACKEND=sqlite or SESSION_BACKEND=context.
+    """
+    ttl = float(os.getenv("SESSION_TTL", str(6 * 3600)))
+    idle_timeout = float(os.getenv("SESSION_IDLE_TIMEOUT", "1800"))
+    max_entries = int(os.getenv("SESSION_MAX_ENTRIES", "10000"))
+
+    backend = os.getenv("SESSION_BACKEND", "memory").lower()
+    if backend == "context":
+        return ContextSessionStore(
+            os.getenv("SESSION_CONTEXT_SECRET"),
+            ttl=ttl,
+            lifespan=int(os.getenv("SESSION_CONTEXT_LIFESPAN", "50")),
+        )
+    if backend == "sqlite":
+        return SQLiteSessionStore(
+            os.getenv("SESSION_DB_PATH", "chatbot_sessions.db"),
+            ttl=ttl,
+            idle_timeout=idle_timeout,
+            max_entries=max_entries,
+        )
+    return InMemorySessionStore(
+        ttl=ttl,
+        idle_timeout=idle_timeout,
+        max_entries=max_entries,
+        max_bytes=int(os.getenv("SESSION_MAX_BYTES", str(64 * 1024 * 1024))),
+    )
@@ -0,0 +1,87 @@
+from fast_json import dumps, loads
+from generic_helper import ContextMap
+
+
+class WebhookDecodeError(ValueError):
+    """The request body is not a Dialogflow ES webhook request"""
+
+
+class WebhookRequest:
+    """
+    The parts of a Dialogflow ES WebhookRequest the chatbot uses, decoded
+    straight from the raw request body.
+    """
+
+    __slots__ = ("response_id", "session", "query_text", "language_code", "intent", "parameters", "output_contexts")
+
+    def __init__(self, response_id, session, query_text, language_code, intent, parameters, output_contexts):
+        self.response_id = response_id
+        self.session = session
+        self.query_text = query_text
+        self.language_code = language_code
+        self.intent = intent
+        self.parameters = parameters
+        self.output_contexts = output_contexts
+
+    @classmethod
+    def from_bytes(cls, body):
+        try:
+            payload = loads(body)
+        except ValueError as e:
+            raise WebhookDecodeError(f"Invalid JSON: {e}") from None
+        if not isinstance(payload, dict):
+            raise WebhookDecodeError("Webhook body must be a JSON object")
+
+        query_result = payload.get("queryResult")
+        if not isinstance(query_result, dict):
+            raise WebhookDecodeError("Missing queryResult")
+        intent = query_result.get("intent") or {}
+        if not isinstance(intent, dict) or not isinstance(intent.get("displayName"), str):
+            raise WebhookDecodeError("Missing queryResult.intent.displayName")
+        parameters = query_result.get("parameters") or {}
+        if not isinstance(parameters, dict):
+            raise WebhookDecodeError("queryResult.parameters must be an object")
+        contexts = query_result.get("outputContexts") or []
+        if not isinstance(contexts, list) or not all(isinstance(c, dict) for c in contexts):
+            raise WebhookDecodeError("queryResult.outputContexts must be a list of objects")
+
+        return cls(
+            response_id=payload.get("responseId"),
+            session=payload.get("session"),
+            query_text=query_result.get("queryText", ""),
+            language_code=query_result.get("languageCode"),
+            intent=intent["displayName"],
+            parameters=parameters,
+            output_contexts=ContextMap(contexts),
+        )
+
+    @property
+    def session_id(self):
+        if self.output_contexts.session_id:
+            return self.output_contexts.session_id
+        # Dialogflow also sends the session path at the top level
+        return self.session.rsplit("/sessions/", 1)[-1] if self.session else ""
+
+    def summary(self):
+        """Short description for logs (the full payload carries customer data)"""
+        return f"intent={self.intent!r} session={self.session_id} responseId={self.response_id}"
+
+
+class WebhookResponse:
+    """A Dialogflow ES WebhookResponse"""
+
+    __slots__ = ("fulfillment_text", "output_contexts", "source")
+
+    def __init__(self, fulfillment_text, output_contexts=None, source="shopdb-chatbot"):
+        self.fulfillment_text = fulfillment_text
+        self.output_contexts = output_contexts
+        self.source = source
+
+    def to_dict(self):
+        response = {"fulfillmentText": self.fulfillment_text, "source": self.source}
+        if self.output_contexts:
+            response["outputContexts"] = self.output_contexts
+        return response
+
+    def encode(self):
+        return dumps(self.to_dict())